@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Project ：wrf_auto_install
+# File    ：bench_extract.py
+# IDE     ：PyCharm
+# Author  ：黄浩瑜
+# Date    ：2026/10/17 下午10:30
+"""
+比较单线程与多线程解压源码包的耗时。
+
+默认下载 url_config.ini 中配置的 WRF 源码包，也可以指定本地压缩包。
+用 --target-dir 指定 NFS/Lustre 等共享文件系统上的目录来测量实际部署环境中的差异。
+
+python benchmarks/bench_extract.py --wrf-version 3.9 --workers 1,4,8 --target-dir /scratch/bench
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import wrf_auto_install as installer
+from conf.common import Common
+
+
+def resolve_archive(args):
+	"""返回要测试的压缩包路径，未指定时下载 WRF 源码包"""
+	if args.archive:
+		return args.archive
+	compat_map, _ = installer.parse_config_file(installer.VER_CONFIG, args.wrf_version)
+	_, _, url_wrf_map = installer.parse_url_config(installer.URL_CONFIG, args.wrf_version, args.wrf_version, compat_map)
+	archive = os.path.join(args.target_dir, f"WRF-{args.wrf_version}.tar.gz")
+	if not os.path.exists(archive):
+		installer.download_file(url_wrf_map['wrf'], archive)
+	return archive
+
+
+def run_once(archive, target_dir, workers):
+	"""解压一次，返回 (耗时秒数, 文件数)"""
+	dest = tempfile.mkdtemp(prefix=f"extract-{workers}-", dir=target_dir)
+	try:
+		start = time.perf_counter()
+		installer.extract_file(archive, dest, strip_top=True, workers=workers)
+		elapsed = time.perf_counter() - start
+		files = sum(len(names) for _, _, names in os.walk(dest))
+		return elapsed, files
+	finally:
+		shutil.rmtree(dest, ignore_errors=True)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark serial and threaded extract_file.")
+	parser.add_argument("archive", nargs="?", help="Archive to extract (default: download the WRF source)")
+	parser.add_argument("--wrf-version", default='3.9', help="WRF version to download when no archive is given")
+	parser.add_argument("--workers", default=f"1,{Common.extract_workers}", help="Comma separated worker counts, 1 is serial")
+	parser.add_argument("--repeat", default=3, type=int, help="Runs per worker count")
+	parser.add_argument("--target-dir", default=tempfile.gettempdir(), help="Directory to extract into")
+	parser.add_argument("--json", help="Write results to this JSON file")
+	args = parser.parse_args()
+
+	os.makedirs(args.target_dir, exist_ok=True)
+	archive = resolve_archive(args)
+	results = []
+	for workers in [int(w) for w in args.workers.split(',')]:
+		times = []
+		for _ in range(args.repeat):
+			elapsed, files = run_once(archive, args.target_dir, workers)
+			times.append(elapsed)
+		best = min(times)
+		results.append({'workers': workers, 'files': files, 'times': times, 'best': best,
+						'files_per_second': files / best if best else None})
+		logging.info(f"workers={workers:<3} files={files} best={best:.2f}s mean={sum(times) / len(times):.2f}s")
+
+	serial = next((r['best'] for r in results if r['workers'] == 1), None)
+	for result in results:
+		if serial:
+			result['speedup'] = serial / result['best']
+			logging.info(f"workers={result['workers']:<3} speedup={result['speedup']:.2f}x")
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump({'archive': archive, 'target_dir': args.target_dir, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Project ：wrf_auto_install
+# File    ：bench_install.py
+# IDE     ：PyCharm
+# Author  ：黄浩瑜
+# Date    ：2026/10/17 下午11:00
+"""
+离线测量安装脚本自身的开销：下载、解压、配置解析、阶段调度和各阶段的执行。
+
+在工作目录下生成合成的源码包（autotools 风格的依赖包，以及文件数量与 WRF/WPS 相近、
+带顶层目录的压缩包）和假的 Intel 安装程序（安装只做版本检查和创建输出文件的桩编译器及 setvars.sh），
+通过本地 HTTP 服务器提供下载，生成指向它的 url_config.ini/version_config.ini，
+再按几种缓存状态完整运行 wrf_auto_install.py，从 logs/profile.json 汇总各阶段的耗时和吞吐量。
+
+场景:
+- cold: 下载缓存、包存储和二进制缓存都为空
+- cached: 只保留下载缓存，依赖和 WRF/WPS 重新编译
+- reuse: 保留包存储和二进制缓存，新的安装目录
+- rerun: 在同一个安装目录中再次运行，所有阶段按日志跳过
+
+python benchmarks/bench_install.py --wrf-files 20000 --latency 50 --json bench.json
+python benchmarks/bench_install.py --scenarios cold,cached --installer-args "--ccache --check deferred"
+"""
+import argparse
+import functools
+import gzip
+import http.server
+import io
+import json
+import logging
+import os
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import wrf_auto_install as installer
+from conf.common import Common
+
+SCENARIOS = ['cold', 'cached', 'reuse', 'rerun']
+# 各场景运行前清空的目录
+SCENARIO_RESET = {
+	'cold': ['inst', 'cache', 'store', 'bundles'],
+	'cached': ['inst', 'store', 'bundles'],
+	'reuse': ['inst'],
+	'rerun': [],
+}
+
+# 桩编译器：-v 输出版本，有 -o 时创建输出文件
+STUB_COMPILER = """#!/bin/bash
+out=
+while [ $# -gt 0 ]; do
+	case "$1" in
+		-v|-V|--version) echo "$(basename "$0") (stub) 2022.1.0"; exit 0;;
+		-o) out="$2"; shift;;
+	esac
+	shift
+done
+[ -n "$out" ] && echo stub > "$out"
+exit 0
+"""
+
+# 假的 oneAPI 安装程序，支持 --install-dir
+STUB_INSTALLER = """#!/bin/bash
+while [ $# -gt 0 ]; do
+	case "$1" in --install-dir) dir="$2"; shift;; esac
+	shift
+done
+mkdir -p "$dir/bin" "$dir/mpi/latest/bin" "$dir/mpi/latest/lib" "$dir/mpi/latest/include"
+for cc in icc icpc ifort mpiicc mpiifort; do
+	cat > "$dir/bin/$cc" <<'EOF'
+@STUB@
+EOF
+	chmod +x "$dir/bin/$cc"
+done
+cat > "$dir/setvars.sh" <<EOF
+export ONEAPI_ROOT=$dir
+export I_MPI_ROOT=$dir/mpi/latest
+export PATH=$dir/bin:$dir/mpi/latest/bin\\${PATH:+:\\$PATH}
+export LD_LIBRARY_PATH=$dir/mpi/latest/lib\\${LD_LIBRARY_PATH:+:\\$LD_LIBRARY_PATH}
+EOF
+""".replace('@STUB@', STUB_COMPILER.strip())
+
+# 依赖包：configure 只处理 --prefix，make 用桩编译器逐个编译源文件
+DEP_CONFIGURE = """#!/bin/sh
+for arg in "$@"; do
+	case $arg in --prefix=*) prefix=${arg#--prefix=};; esac
+done
+sed "s|@PREFIX@|$prefix|g" Makefile.in > Makefile
+"""
+DEP_MAKEFILE = """PREFIX = @PREFIX@
+SRCS := $(wildcard src/*/*.c)
+OBJS := $(SRCS:.c=.o)
+
+all: lib@NAME@.a
+
+%.o: %.c
+\t$(CC) $(CFLAGS) -c $< -o $@
+
+lib@NAME@.a: $(OBJS)
+\tcat $(OBJS) > $@
+
+check: all
+\ttrue
+
+install: all
+\tmkdir -p $(PREFIX)/lib $(PREFIX)/include $(PREFIX)/bin
+\tcp lib@NAME@.a $(PREFIX)/lib/
+\tcp src/*/*.h $(PREFIX)/include/ 2>/dev/null || true
+"""
+
+# WRF：configure 从标准输入读取选项，compile 生成 WPS 需要的 I/O 库和 main/*.exe
+WRF_CONFIGURE = """#!/bin/bash
+read option
+printf 'FCOPTIM = -O3\\nCFLAGS_LOCAL = -O3\\nLDFLAGS_LOCAL =\\n# option %s\\n' "$option" > configure.wrf
+"""
+WRF_COMPILE = """#!/bin/bash
+find . -name '*.F' | xargs -r -n 64 ${J:+-P ${J#-j }} sh -c 'for f; do ${FC:-ifort} -c "$f" -o "${f%.F}.o"; done' _
+@IO_LIBS@
+mkdir -p main
+for exe in wrf real tc ndown; do ${FC:-ifort} -o main/$exe.exe; done
+"""
+WPS_CONFIGURE = """#!/bin/bash
+read option
+echo "WRF_DIR = ../WRFV3" > configure.wps
+"""
+WPS_COMPILE = """#!/bin/bash
+ls "$WRF_DIR/external/io_netcdf/libwrfio_nf.a" > /dev/null || exit 1
+find . -name '*.F' | while read f; do ${FC:-ifort} -c "$f" -o "${f%.F}.o"; done
+for exe in geogrid ungrib metgrid; do ${FC:-ifort} -o $exe.exe; done
+"""
+CLEAN = "#!/bin/sh\nfind . -name '*.o' -delete\n"
+
+
+def source_text(rng, size):
+	"""生成大约 size 字节、压缩率与真实源码相近的文本"""
+	lines = []
+	length = 0
+	while length < size:
+		line = f"      var_{rng.randrange(10 ** 6)} = {rng.random():.12f} * coef_{rng.randrange(500)}  ! {rng.getrandbits(64):x}\n"
+		lines.append(line)
+		length += len(line)
+	return ''.join(lines)
+
+
+def write_archive(path, top, files, rng, count, size, subdirs, suffix):
+	"""
+	写出带顶层目录的 tar.gz。
+
+	参数:
+	- path: 压缩包路径
+	- top: 顶层目录名
+	- files: 额外文件 {相对路径: (内容, 权限)}
+	- rng: random.Random
+	- count: 生成的源文件数
+	- size: 每个源文件的大小（字节）
+	- subdirs: 源文件所在的子目录列表（可以多级）
+	- suffix: 源文件扩展名
+	"""
+	with tarfile.open(path, 'w:gz', compresslevel=6) as tar:
+		def add(name, data, mode=0o644):
+			info = tarfile.TarInfo(f"{top}/{name}")
+			data = data.encode()
+			info.size = len(data)
+			info.mode = mode
+			info.mtime = int(time.time())
+			tar.addfile(info, fileobj=io.BytesIO(data))
+
+		for name, (data, mode) in files.items():
+			add(name, data, mode)
+		for i in range(count):
+			add(f"{subdirs[i % len(subdirs)]}/file_{i:05d}{suffix}", source_text(rng, size))
+
+
+def generate_packages(www_dir, compat, wrf_version, args):
+	"""
+	生成全部合成下载文件，文件名与 write_configs 中的地址对应。
+
+	返回:
+	- dict: 文件名 -> 大小（字节）
+	"""
+	rng = random.Random(args.seed)
+	os.makedirs(www_dir, exist_ok=True)
+	for key in ['intel-base', 'intel-hpc']:
+		with open(os.path.join(www_dir, f"{key}-{compat[key]}.sh"), 'w') as f:
+			f.write(STUB_INSTALLER)
+	for dep in Common.dep_list:
+		if dep not in compat:
+			continue
+		top = f"{dep}-{compat[dep]}"
+		files = {
+			'configure': (DEP_CONFIGURE, 0o755),
+			'Makefile.in': (DEP_MAKEFILE.replace('@NAME@', dep), 0o644),
+			f"src/include/{dep}.h": (f"/* {dep} */\n", 0o644),
+		}
+		write_archive(os.path.join(www_dir, f"{top}.tar.gz"), top, files, rng, args.dep_files, args.file_size,
+					  ['src/core', 'src/util', 'src/io', 'src/test'], '.c')
+	io_libs = '\n'.join(f"mkdir -p {os.path.dirname(lib)} && ${{FC:-ifort}} -o {lib}" for lib in Common.wrf_io_libs)
+	wrf_files = {
+		'configure': (WRF_CONFIGURE, 0o755),
+		'compile': (WRF_COMPILE.replace('@IO_LIBS@', io_libs), 0o755),
+		'clean': (CLEAN, 0o755),
+		# wrf_version_set 中的脚本会替换这个文件
+		'share/landread.c.dist': ("/* landread */\n", 0o644),
+		'share/landread.c': ("/* landread */\n", 0o644),
+	}
+	write_archive(os.path.join(www_dir, f"WRF-{wrf_version}.tar.gz"), f"WRF-{wrf_version}", wrf_files, rng, args.wrf_files, args.file_size,
+				  ['dyn_em', 'phys', 'share', 'frame', 'external/io_netcdf', 'external/io_grib1', 'external/RSL_LITE', 'chem/KPP/kpp'], '.F')
+	wps_files = {
+		'configure': (WPS_CONFIGURE, 0o755),
+		'compile': (WPS_COMPILE, 0o755),
+		'clean': (CLEAN, 0o755),
+	}
+	write_archive(os.path.join(www_dir, f"WPS-{wrf_version}.tar.gz"), f"WPS-{wrf_version}", wps_files, rng, args.wps_files, args.file_size,
+				  ['geogrid/src', 'ungrib/src', 'metgrid/src', 'util/src'], '.F')
+	return {name: os.path.getsize(os.path.join(www_dir, name)) for name in sorted(os.listdir(www_dir))}
+
+
+def write_configs(base_dir, base_url, wrf_version):
+	"""
+	在临时基准目录中写出配置文件：version_config.ini 沿用仓库中的版本，url_config.ini 指向本地服务器，
+	并复制 src 下的版本修改脚本。
+	"""
+	os.makedirs(base_dir, exist_ok=True)
+	shutil.copy(installer.VER_CONFIG, os.path.join(base_dir, 'version_config.ini'))
+	for name in ['wrf_version_set', 'wps_version_set']:
+		src = os.path.join(installer.CONFIG_DIR, 'src', name)
+		if os.path.isdir(src):
+			shutil.copytree(src, os.path.join(base_dir, 'src', name), dirs_exist_ok=True)
+	with open(os.path.join(base_dir, 'url_config.ini'), 'w') as f:
+		f.write("[compiler]\n")
+		for key in ['intel-base', 'intel-hpc']:
+			f.write(f"{key}={base_url}/{key}-%v.sh\n")
+		f.write("\n[dep_common]\n")
+		for dep in Common.dep_list:
+			f.write(f"{dep}={base_url}/{dep}-%v.tar.gz\n")
+		f.write(f"\n[wrf_url]\nwrf={base_url}/WRF-%v.tar.gz\nwps={base_url}/WPS-%v.tar.gz\n")
+		f.write("\n[mirrors]\n\n[checksums]\n")
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+	"""不输出访问日志，每个请求前等待 latency 秒，模拟网络延迟"""
+
+	latency = 0.0
+
+	def log_message(self, format, *args):
+		pass
+
+	def send_head(self):
+		if self.latency:
+			time.sleep(self.latency)
+		return super().send_head()
+
+
+def start_server(www_dir, latency):
+	"""在后台线程中启动本地 HTTP 服务器，返回 (server, 根地址)"""
+	handler = type('Handler', (_QuietHandler,), {'latency': latency})
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=www_dir))
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_installer(work_dir, base_dir, wrf_version, jobs, extra_args):
+	"""
+	以子进程运行一次完整安装（Common.base_dir 取自工作目录，所以在基准目录下运行）。
+
+	返回:
+	- tuple: (墙钟秒数, profile.json 内容)
+	"""
+	cmd = [sys.executable, os.path.join(installer.CONFIG_DIR, 'wrf_auto_install.py'),
+		   '-p', os.path.join(work_dir, 'inst'), '-wrf', wrf_version, '-wps', wrf_version, '-n', str(jobs), '--isa', 'none',
+		   '--cache-dir', os.path.join(work_dir, 'cache'), '--store-dir', os.path.join(work_dir, 'store'),
+		   '--bundle-dir', os.path.join(work_dir, 'bundles')] + extra_args
+	log_path = os.path.join(work_dir, 'installer.log.gz')
+	start = time.perf_counter()
+	with gzip.open(log_path, 'wt') as log_file:
+		proc = subprocess.run(cmd, cwd=base_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+		log_file.write(proc.stdout)
+	elapsed = time.perf_counter() - start
+	if proc.returncode != 0:
+		for line in proc.stdout.splitlines()[-Common.log_tail_lines:]:
+			logging.info(f"  | {line}")
+		raise RuntimeError(f"Installer failed with code {proc.returncode}, full log: {log_path}")
+	with open(os.path.join(work_dir, 'inst', 'logs', 'profile.json')) as f:
+		return elapsed, json.load(f)
+
+
+def summarize_profile(profile):
+	"""
+	按阶段类别汇总 profile.json。
+
+	返回:
+	- dict: 类别 -> count、total（各阶段墙钟时间之和）、p50、max，download/extract 另有 MB 和 MB/s
+	"""
+	counters = {'download': 'bytes_downloaded', 'extract': 'bytes_extracted'}
+	by_category = {}
+	for event in profile['stages']:
+		by_category.setdefault(event['cat'], []).append(event)
+	summary = {}
+	for category, events in sorted(by_category.items()):
+		walls = sorted(event['wall'] for event in events)
+		total = sum(walls)
+		summary[category] = {
+			'count': len(walls),
+			'total': total,
+			'p50': walls[len(walls) // 2],
+			'max': walls[-1],
+		}
+		if category in counters:
+			megabytes = sum(event[counters[category]] for event in events) / 1024 ** 2
+			summary[category].update({'MB': megabytes, 'MB/s': megabytes / total if total else None})
+	return summary
+
+
+def time_calls(func, repeat):
+	"""重复调用 func，返回每次调用的平均毫秒数"""
+	start = time.perf_counter()
+	for _ in range(repeat):
+		func()
+	return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_overhead(base_dir, wrf_version, jobs, repeat):
+	"""
+	在本进程中测量配置解析、阶段指纹和重新编译计划的计算，以及依赖调度（空编译）的平均延迟。
+
+	返回:
+	- dict: 项目 -> 毫秒
+	"""
+	ver_config = os.path.join(base_dir, 'version_config.ini')
+	url_config = os.path.join(base_dir, 'url_config.ini')
+
+	def parse():
+		compat_map, name_map = installer.parse_config_file(ver_config, wrf_version)
+		maps = installer.parse_url_config(url_config, wrf_version, wrf_version, compat_map)
+		installer.parse_mirror_config(url_config)
+		installer.parse_checksum_config(url_config)
+		return compat_map, maps
+
+	compat_map, maps = parse()
+	variants = installer.build_variants([Common.wrf_default_variant], 'none')
+	journal = installer.StageJournal(os.path.join(tempfile.mkdtemp(prefix='bench-journal-'), 'install_journal.json'))
+
+	def plan():
+		fingerprints = installer.compute_stage_fingerprints(compat_map[wrf_version], *maps, 'intel', wrf_version, wrf_version, variants)
+		installer.plan_rebuild(fingerprints, journal, {})
+
+	def schedule():
+		installer.run_dependency_graph(list(Common.dep_list), Common.dep_graph, lambda dep, jobs: None, jobs)
+
+	root_logger = logging.getLogger()
+	level = root_logger.level
+	# 调度过程每个包输出一行，测量时关闭
+	root_logger.setLevel(logging.WARNING)
+	try:
+		return {
+			'parse_config': time_calls(parse, repeat),
+			'plan': time_calls(plan, repeat),
+			'schedule': time_calls(schedule, max(1, repeat // 10)),
+		}
+	finally:
+		root_logger.setLevel(level)
+		shutil.rmtree(os.path.dirname(journal.path), ignore_errors=True)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the installer offline with synthetic packages and stub compilers.")
+	parser.add_argument("--wrf-version", default='3.9', help="Version from version_config.ini whose dependency versions are used")
+	parser.add_argument("--wrf-files", default=5000, type=int, help="Source files in the synthetic WRF archive")
+	parser.add_argument("--wps-files", default=800, type=int, help="Source files in the synthetic WPS archive")
+	parser.add_argument("--dep-files", default=200, type=int, help="Source files in each synthetic dependency")
+	parser.add_argument("--file-size", default=4096, type=int, help="Size of each synthetic source file in bytes")
+	parser.add_argument("--seed", default=0, type=int, help="Seed for the synthetic file contents")
+	parser.add_argument("--latency", default=0.0, type=float, help="Delay in milliseconds added to every HTTP request")
+	parser.add_argument("--scenarios", default=','.join(SCENARIOS), help=f"Comma separated scenarios to run in order: {', '.join(SCENARIOS)}")
+	parser.add_argument("--repeat", default=1, type=int, help="Runs per scenario")
+	parser.add_argument("--jobs", default=os.cpu_count() or 1, type=int, help="Passed to the installer as -n")
+	parser.add_argument("--overhead-repeat", default=200, type=int, help="Calls per item when timing config parsing, planning and scheduling")
+	parser.add_argument("--installer-args", default='', help="Extra arguments for wrf_auto_install.py, e.g. \"--ccache --check deferred\"")
+	parser.add_argument("--work-dir", help="Directory for the packages, configs and installs (default: a temporary directory)")
+	parser.add_argument("--keep", action="store_true", help="Keep the work directory")
+	parser.add_argument("--json", help="Write results to this JSON file")
+	args = parser.parse_args()
+
+	scenarios = [name for name in args.scenarios.split(',') if name]
+	unknown = [name for name in scenarios if name not in SCENARIOS]
+	if unknown:
+		parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+	work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='bench-install-')
+	os.makedirs(work_dir, exist_ok=True)
+	www_dir = os.path.join(work_dir, 'www')
+	base_dir = os.path.join(work_dir, 'base')
+	compat_map, _ = installer.parse_config_file(installer.VER_CONFIG, args.wrf_version)
+
+	server = None
+	try:
+		start = time.perf_counter()
+		sizes = generate_packages(www_dir, compat_map[args.wrf_version], args.wrf_version, args)
+		logging.info(f"Generated {len(sizes)} files ({sum(sizes.values()) / 1024 ** 2:.1f} MB) in {time.perf_counter() - start:.1f}s: {www_dir}")
+		server, base_url = start_server(www_dir, args.latency / 1000)
+		write_configs(base_dir, base_url, args.wrf_version)
+
+		overhead = bench_overhead(base_dir, args.wrf_version, args.jobs, args.overhead_repeat)
+		for name, ms in overhead.items():
+			logging.info(f"{name:<13} {ms:8.3f} ms/call")
+
+		results = []
+		for scenario in scenarios:
+			for run in range(args.repeat):
+				for name in SCENARIO_RESET[scenario]:
+					shutil.rmtree(os.path.join(work_dir, name), ignore_errors=True)
+				elapsed, profile = run_installer(work_dir, base_dir, args.wrf_version, args.jobs, shlex.split(args.installer_args))
+				phases = summarize_profile(profile)
+				results.append({'scenario': scenario, 'run': run, 'wall': elapsed, 'phases': phases})
+				logging.info(f"{scenario} run {run}: {elapsed:.2f}s wall")
+				for category, stats in phases.items():
+					throughput = f"{stats['MB']:7.1f} MB {stats['MB/s']:8.1f} MB/s" if stats.get('MB/s') else ''
+					logging.info(f"  {category:<11} n={stats['count']:<3} total={stats['total']:7.2f}s "
+								 f"p50={stats['p50']:6.2f}s max={stats['max']:6.2f}s {throughput}")
+
+		for scenario in scenarios:
+			walls = [result['wall'] for result in results if result['scenario'] == scenario]
+			logging.info(f"{scenario:<7} best={min(walls):.2f}s mean={sum(walls) / len(walls):.2f}s")
+		if args.json:
+			with open(args.json, 'w') as f:
+				json.dump({'args': vars(args), 'files': sizes, 'overhead_ms': overhead, 'results': results}, f, indent=2)
+	finally:
+		if server is not None:
+			server.shutdown()
+		if args.keep or args.work_dir:
+			logging.info(f"Work directory kept: {work_dir}")
+		else:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+	main()
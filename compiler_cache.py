@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Project ：wrf_auto_install
+# File    ：compiler_cache.py
+# IDE     ：PyCharm
+# Author  ：黄浩瑜
+# Date    ：2026/10/17 下午10:45
+"""
+编译器缓存：包装 icc/icpc/ifort，相同的编译单元直接使用上次编译的结果。
+
+安装程序在 PATH 最前面放置与编译器同名的包装脚本（install_shims），脚本调用本文件：
+    compiler_cache.py <编译器名> <编译参数...>
+mpiifort/mpicc 等 MPI 包装脚本最终按名字调用 ifort/icc，因此同样经过缓存。
+
+只缓存单个源文件的 -c 编译：
+- C/C++：以编译器、参数和预处理后的源码为键。
+- Fortran：以编译器、参数、源码（需要预处理时为预处理结果）、INCLUDE 的文件以及
+  USE 的模块对应 .mod 文件的内容为键，同时缓存生成的 .o 和 .mod 文件。
+  命中时恢复的 .mod 与上次完全相同，依赖它的编译单元也能继续命中。
+其它调用（链接、预处理等）直接交给真实编译器。
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+# 包装脚本通过环境变量得到缓存目录和包装脚本所在目录
+CACHE_DIR_ENV = 'WRF_CCACHE_DIR'
+SHIM_DIR_ENV = 'WRF_CCACHE_SHIMS'
+# 每次编译追加一行 hit/miss/uncacheable，用于统计
+STATS_FILE = 'stats.log'
+
+C_SOURCES = ('.c', '.cc', '.cpp', '.cxx', '.C')
+FORTRAN_SOURCES = ('.f', '.for', '.f77', '.f90', '.f95', '.F', '.FOR', '.F77', '.F90', '.F95')
+# 需要先预处理的 Fortran 源文件
+FORTRAN_PREPROCESS = ('.F', '.FOR', '.F77', '.F90', '.F95')
+# 参数在下一个命令行参数中的选项
+ARG_OPTIONS = {'-o', '-I', '-D', '-U', '-L', '-l', '-module', '-MF', '-MT', '-MQ', '-include', '-isystem', '-x', '-Xlinker'}
+# 生成依赖文件（automake 的 depcomp）的选项，不影响目标文件，不参与缓存键
+DEP_FLAGS = {'-MD', '-MMD', '-MP'}
+DEP_OPTIONS = {'-MF', '-MT', '-MQ'}
+# 不能缓存的调用
+UNCACHEABLE_FLAGS = {'-E', '-M', '-MM', '-S', '-P', '-save-temps'}
+
+# use 后必须是空白、逗号或 ::，避免匹配 useful = 1 这样的赋值语句
+USE_RE = re.compile(r'^\s*use\b(?:\s*,\s*(?:non_)?intrinsic\s*::|\s*::|\s+)\s*(\w+)', re.I | re.M)
+MODULE_RE = re.compile(r'^\s*module\s+(?!procedure\b)(\w+)\s*(?:!.*)?$', re.I | re.M)
+INCLUDE_RE = re.compile(r'^\s*include\s*[\'"]([^\'"]+)[\'"]', re.I | re.M)
+
+
+def install_shims(shim_dir, compilers):
+	"""在 shim_dir 下为每个编译器生成调用本文件的同名包装脚本"""
+	shim_dir = os.path.abspath(shim_dir)
+	os.makedirs(shim_dir, exist_ok=True)
+	script = os.path.abspath(__file__)
+	for compiler in compilers:
+		path = os.path.join(shim_dir, compiler)
+		with open(path, 'w') as f:
+			f.write("#!/bin/bash\n")
+			f.write(f'export {SHIM_DIR_ENV}="{shim_dir}"\n')
+			f.write(f'exec "{sys.executable}" "{script}" {compiler} "$@"\n')
+		os.chmod(path, 0o755)
+
+
+def parse_command(args):
+	"""
+	解析编译参数。
+
+	返回:
+	- dict: 源文件、输出文件、模块目录、头文件目录、依赖文件和参与缓存键的参数；
+	  不是单个源文件的 -c 编译时返回 None
+	"""
+	sources = []
+	output = None
+	module_dir = None
+	include_dirs = []
+	dep_file = None
+	dep_enabled = False
+	key_args = []
+	i = 0
+	while i < len(args):
+		arg = args[i]
+		if arg in UNCACHEABLE_FLAGS or arg.startswith('@'):
+			return None
+		if arg in ARG_OPTIONS:
+			if i + 1 >= len(args):
+				return None
+			value = args[i + 1]
+			i += 2
+			if arg == '-o':
+				output = value
+			elif arg in DEP_OPTIONS:
+				if arg == '-MF':
+					dep_file = value
+			else:
+				if arg == '-module':
+					module_dir = value
+				elif arg == '-I':
+					include_dirs.append(value)
+				key_args += [arg, value]
+			continue
+		i += 1
+		if arg in DEP_FLAGS:
+			dep_enabled = True
+			continue
+		if arg.startswith('-I'):
+			include_dirs.append(arg[2:])
+		elif not arg.startswith('-') and arg.endswith(C_SOURCES + FORTRAN_SOURCES):
+			sources.append(arg)
+		key_args.append(arg)
+	if '-c' not in key_args or len(sources) != 1:
+		return None
+	source = sources[0]
+	obj = output or os.path.splitext(os.path.basename(source))[0] + '.o'
+	if dep_enabled and dep_file is None:
+		dep_file = os.path.splitext(obj)[0] + '.d'
+	return {
+		'source': source,
+		'object': obj,
+		'module_dir': module_dir,
+		'include_dirs': include_dirs,
+		'dep_file': dep_file if dep_enabled else None,
+		'key_args': key_args,
+		'fortran': source.endswith(FORTRAN_SOURCES),
+	}
+
+
+def _find_file(name, dirs):
+	for directory in dirs:
+		path = os.path.join(directory, name)
+		if os.path.isfile(path):
+			return path
+	return None
+
+
+def _file_digest(path):
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _preprocess(real, command):
+	"""用真实编译器预处理源文件，返回预处理结果，失败时返回 None"""
+	args = [arg for arg in command['key_args'] if arg != '-c']
+	result = subprocess.run([real] + args + ['-E'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	if result.returncode != 0:
+		return None
+	return result.stdout
+
+
+def _fortran_modules(text):
+	"""返回 (源码中定义的模块, 源码使用的其它模块)，模块名均为小写"""
+	defined = {name.lower() for name in MODULE_RE.findall(text)}
+	used = {name.lower() for name in USE_RE.findall(text)} - defined
+	return sorted(defined), sorted(used)
+
+
+def cache_key(real, command):
+	"""
+	计算编译的缓存键。
+
+	返回:
+	- tuple: (键, 编译生成的 .mod 文件路径列表)；无法计算时返回 (None, [])
+	"""
+	stat = os.stat(real)
+	digest = hashlib.sha256()
+	digest.update(json.dumps([real, stat.st_size, stat.st_mtime_ns, command['key_args']]).encode())
+	source = command['source']
+	mod_outputs = []
+	if not command['fortran']:
+		text = _preprocess(real, command)
+		if text is None:
+			return None, []
+		digest.update(text)
+		return digest.hexdigest(), mod_outputs
+
+	if source.endswith(FORTRAN_PREPROCESS) or '-fpp' in command['key_args']:
+		data = _preprocess(real, command)
+		if data is None:
+			return None, []
+	else:
+		with open(source, 'rb') as f:
+			data = f.read()
+	digest.update(data)
+	text = data.decode('utf-8', errors='replace')
+	search_dirs = [os.path.dirname(source) or '.'] + command['include_dirs'] + ['.']
+	# INCLUDE 的文件（包括嵌套的）按内容参与缓存键
+	pending = INCLUDE_RE.findall(text)
+	seen = set()
+	while pending:
+		name = pending.pop()
+		if name in seen:
+			continue
+		seen.add(name)
+		path = _find_file(name, search_dirs)
+		if path is None:
+			digest.update(f"include {name} missing\n".encode())
+			continue
+		digest.update(f"include {name} {_file_digest(path)}\n".encode())
+		with open(path, 'rb') as f:
+			pending.extend(INCLUDE_RE.findall(f.read().decode('utf-8', errors='replace')))
+	# USE 的模块按 .mod 文件内容参与缓存键，找不到的（编译器自带的模块）只记录名字
+	module_dir = command['module_dir'] or '.'
+	defined, used = _fortran_modules(text)
+	mod_dirs = [module_dir] + command['include_dirs'] + ['.']
+	for name in used:
+		path = _find_file(f"{name}.mod", mod_dirs)
+		digest.update(f"use {name} {_file_digest(path) if path else 'missing'}\n".encode())
+	mod_outputs = [os.path.join(module_dir, f"{name}.mod") for name in defined]
+	return digest.hexdigest(), mod_outputs
+
+
+def entry_dir(cache_dir, key):
+	return os.path.join(cache_dir, key[:2], key)
+
+
+def _record(cache_dir, result):
+	with open(os.path.join(cache_dir, STATS_FILE), 'a') as f:
+		f.write(result + '\n')
+
+
+def _restore(entry, command, mod_outputs):
+	"""把缓存的编译结果复制到目标位置，缓存不完整时返回 False"""
+	with open(os.path.join(entry, 'manifest.json')) as f:
+		manifest = json.load(f)
+	if sorted(manifest['mods']) != sorted(os.path.basename(path) for path in mod_outputs):
+		return False
+	targets = [(os.path.join(entry, 'object'), command['object'])]
+	targets += [(os.path.join(entry, 'mods', os.path.basename(path)), path) for path in mod_outputs]
+	if command['dep_file'] and manifest['dep_file']:
+		targets.append((os.path.join(entry, 'depfile'), command['dep_file']))
+	for src, dest in targets:
+		if os.path.dirname(dest):
+			os.makedirs(os.path.dirname(dest), exist_ok=True)
+		shutil.copyfile(src, dest)
+	sys.stdout.write(manifest['stdout'])
+	sys.stderr.write(manifest['stderr'])
+	# 更新访问时间，按最近使用清理缓存
+	os.utime(entry)
+	return True
+
+
+def _store(entry, command, mod_outputs, stdout, stderr):
+	tmp = f"{entry}.tmp.{os.getpid()}"
+	os.makedirs(os.path.join(tmp, 'mods'), exist_ok=True)
+	shutil.copyfile(command['object'], os.path.join(tmp, 'object'))
+	mods = []
+	for path in mod_outputs:
+		if os.path.exists(path):
+			shutil.copyfile(path, os.path.join(tmp, 'mods', os.path.basename(path)))
+			mods.append(os.path.basename(path))
+	dep_file = bool(command['dep_file'] and os.path.exists(command['dep_file']))
+	if dep_file:
+		shutil.copyfile(command['dep_file'], os.path.join(tmp, 'depfile'))
+	with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+		json.dump({'mods': mods, 'dep_file': dep_file, 'stdout': stdout, 'stderr': stderr, 'created': time.time()}, f)
+	try:
+		os.rename(tmp, entry)
+	except OSError:
+		# 并行编译时其它进程已经保存了同一结果
+		shutil.rmtree(tmp, ignore_errors=True)
+
+
+def compile_cached(cache_dir, real, args):
+	"""执行一次编译，可缓存时先查找缓存，返回编译器返回码"""
+	command = parse_command(args)
+	key = None
+	mod_outputs = []
+	if command is not None and os.path.isfile(command['source']):
+		key, mod_outputs = cache_key(real, command)
+	if key is None:
+		_record(cache_dir, 'uncacheable')
+		return subprocess.run([real] + args).returncode
+
+	entry = entry_dir(cache_dir, key)
+	if os.path.isdir(entry):
+		try:
+			if _restore(entry, command, mod_outputs):
+				_record(cache_dir, 'hit')
+				return 0
+		except (OSError, ValueError, KeyError):
+			pass
+		shutil.rmtree(entry, ignore_errors=True)
+
+	result = subprocess.run([real] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	stdout = result.stdout.decode('utf-8', errors='replace')
+	stderr = result.stderr.decode('utf-8', errors='replace')
+	sys.stdout.write(stdout)
+	sys.stderr.write(stderr)
+	_record(cache_dir, 'miss')
+	if result.returncode == 0 and os.path.exists(command['object']):
+		os.makedirs(os.path.dirname(entry), exist_ok=True)
+		try:
+			_store(entry, command, mod_outputs, stdout, stderr)
+		except OSError:
+			pass
+	return result.returncode
+
+
+def stats_offset(cache_dir):
+	"""返回统计文件当前的大小，之后的统计只计算这之后的记录"""
+	try:
+		return os.path.getsize(os.path.join(cache_dir, STATS_FILE))
+	except OSError:
+		return 0
+
+
+def read_stats(cache_dir, offset=0):
+	"""返回 offset 之后的命中统计 {'hit': n, 'miss': n, 'uncacheable': n}"""
+	stats = {'hit': 0, 'miss': 0, 'uncacheable': 0}
+	try:
+		with open(os.path.join(cache_dir, STATS_FILE)) as f:
+			f.seek(offset)
+			for line in f:
+				result = line.strip()
+				if result in stats:
+					stats[result] += 1
+	except OSError:
+		pass
+	return stats
+
+
+def evict(cache_dir, max_size):
+	"""按最近使用时间删除缓存条目，直到总大小不超过 max_size（字节），返回删除的条目数"""
+	entries = []
+	total = 0
+	for prefix in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+		prefix_dir = os.path.join(cache_dir, prefix)
+		if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+			continue
+		for name in os.listdir(prefix_dir):
+			path = os.path.join(prefix_dir, name)
+			size = sum(os.path.getsize(os.path.join(root, file))
+					   for root, _, files in os.walk(path) for file in files)
+			entries.append((os.path.getmtime(path), size, path))
+			total += size
+	removed = 0
+	for _, size, path in sorted(entries):
+		if total <= max_size:
+			break
+		shutil.rmtree(path, ignore_errors=True)
+		total -= size
+		removed += 1
+	return removed
+
+
+def main(argv):
+	if len(argv) < 2:
+		sys.stderr.write("usage: compiler_cache.py <compiler> [args...]\n")
+		return 2
+	compiler, args = argv[1], argv[2:]
+	# 查找真实编译器时跳过包装脚本目录，真实编译器及其子进程也看不到包装脚本
+	shim_dir = os.path.abspath(os.environ.get(SHIM_DIR_ENV, ''))
+	path = os.pathsep.join(p for p in os.environ.get('PATH', '').split(os.pathsep)
+						   if p and os.path.abspath(p) != shim_dir)
+	os.environ['PATH'] = path
+	real = shutil.which(compiler, path=path)
+	if real is None:
+		sys.stderr.write(f"compiler_cache: {compiler} not found in PATH\n")
+		return 127
+	cache_dir = os.environ.get(CACHE_DIR_ENV)
+	if not cache_dir:
+		os.execv(real, [real] + args)
+	os.makedirs(cache_dir, exist_ok=True)
+	return compile_cached(cache_dir, real, args)
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
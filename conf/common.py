@@ -11,5 +11,103 @@ import os
 class Common(object):
 	base_dir =os.path.dirname(os.path.abspath(__name__))
 	intel_file_path = os.path.join(base_dir, 'src','intel')
-	dep_list = ['zlib', 'libpng', 'jasper', 'netcdf-c', 'netcdf-fortran']
-	# dep_list = []
\ No newline at end of file
+	dep_list = ['zlib', 'libpng', 'jasper', 'hdf5', 'netcdf-c', 'netcdf-fortran']
+	# 依赖关系图：包 -> 直接依赖的包，用于并行调度依赖编译
+	dep_graph = {
+		'zlib': [],
+		'libpng': ['zlib'],
+		'jasper': ['libpng'],
+		'hdf5': ['zlib'],
+		'netcdf-c': ['hdf5'],
+		'netcdf-fortran': ['netcdf-c'],
+	}
+	# 后台预取下载的并发数
+	download_workers = 4
+	# 下载重试次数（每个地址）、超时秒数和读写块大小
+	download_retries = 3
+	download_timeout = 60
+	download_chunk_size = 1024 * 1024
+	# 重试前等待的秒数，每次重试翻倍
+	download_backoff = 2
+	# 超过该大小且服务器支持 Range 的文件分段并行下载
+	download_segments = 4
+	segment_min_size = 64 * 1024 * 1024
+	# 全主机共享的下载缓存目录及大小上限（字节）
+	cache_dir = os.environ.get('WRF_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'wrf_auto_install'))
+	cache_max_size = 20 * 1024 ** 3
+	# 二进制编译缓存目录（可放在共享文件系统上供多个节点使用）
+	bundle_dir = os.environ.get('WRF_BUNDLE_DIR', os.path.join(cache_dir, 'bundles'))
+	# 主机级包存储：每个依赖包的每次构建安装在独立的前缀下，安装目录的 deps 由链接组合而成
+	store_dir = os.environ.get('WRF_STORE_DIR', os.path.join(cache_dir, 'store'))
+	view_mode = 'symlink'
+	# 工具链环境（setvars.sh 对环境变量的修改）的缓存目录，按 oneAPI 安装区分
+	toolchain_cache_dir = os.path.join(cache_dir, 'toolchain')
+	# 各阶段耗时历史（按主机区分，用于 --plan 的耗时估计）及每个阶段保留的次数；--plan 写出的锁定文件名
+	history_file = os.path.join(cache_dir, 'history.json')
+	history_samples = 5
+	lock_file = 'install_lock.json'
+	# 编译器缓存（--ccache）目录、大小上限（字节）以及被包装的编译器
+	ccache_dir = os.environ.get('WRF_CCACHE_DIR', os.path.join(cache_dir, 'ccache'))
+	ccache_max_size = 5 * 1024 ** 3
+	ccache_compilers = ['icc', 'icpc', 'ifort']
+	# 解压源码包时并发写文件的线程数，以及内存中待写入数据的上限（字节）
+	extract_workers = min(8, os.cpu_count() or 1)
+	extract_buffer_size = 64 * 1024 * 1024
+	extract_batch_files = 32
+	# Intel 编译器的编译环境变量
+	compiler_env = {
+		'CC': 'icc',
+		'CXX': 'icpc',
+		'FC': 'ifort',
+		'F90': 'ifort',
+		'F77': 'ifort',
+		'CFLAGS': '-O3 -fPIC',
+		'CXXFLAGS': '-O3 -fPIC',
+	}
+	# 每个编译任务预计占用的内存（MB）：依赖包和 WRF（ifort 编译部分模块需要数 GB）
+	dep_job_memory_mb = 512
+	wrf_job_memory_mb = 2048
+	# 与 WRF 同时编译的 WPS 从共用预算中占用的任务数（WPS 的 compile 串行编译）
+	wps_jobs = 1
+	# 编译期间保留的可用内存（MB），低于该值时减少并行任务；内存检查间隔（秒）
+	memory_reserve_mb = 1024
+	memory_poll_interval = 5
+	# WRF ./configure 中 Intel (ifort/icc) 各并行方式的选项号，以及嵌套选项（1 为基本嵌套）
+	wrf_variants = {'serial': 13, 'smpar': 14, 'dmpar': 15, 'dm+sm': 16}
+	wrf_default_variant = 'dmpar'
+	wrf_nesting = 1
+	# WPS ./configure 中 Intel 的选项号，WPS 只有串行和 dmpar 两种
+	wps_variants = {'serial': 17, 'dmpar': 19}
+	# 按优先顺序检测的指令集：名称 -> /proc/cpuinfo 中的 CPU 特性，以及对应的 Intel 编译参数
+	isa_cpu_flags = [('avx512', 'avx512f'), ('avx2', 'avx2'), ('avx', 'avx')]
+	isa_flags = {'avx512': '-xCORE-AVX512', 'avx2': '-xCORE-AVX2', 'avx': '-xAVX'}
+	# WPS 需要的 WRF 外部 I/O 库（相对 WRF 源码目录），全部生成且稳定后即可开始编译 WPS
+	wrf_io_libs = [
+		'external/io_netcdf/libwrfio_nf.a',
+		'external/io_grib1/libio_grib1.a',
+		'external/io_grib_share/libio_grib_share.a',
+		'external/io_int/libwrfio_int.a',
+		'frame/module_internal_header_util.o',
+		'frame/pack_utils.o',
+	]
+	# 上述文件在多少秒内没有变化视为编译完成，以及检查间隔（秒）
+	wrf_io_stable_secs = 10
+	wrf_io_poll_interval = 2
+	# 依赖包测试（make check）的执行策略：serial、parallel、deferred 或 skip
+	check_policy = 'parallel'
+	# 依赖包测试失败时只报告（warn）还是中止安装（fail）
+	check_failure = 'warn'
+	# 性能测试（--benchmark）：不需要外部数据的理想算例、每次运行的时间步数、MPI 启动命令和运行环境变量
+	bench_cases = ['em_quarter_ss', 'em_b_wave']
+	bench_steps = 30
+	bench_mpirun = 'mpirun'
+	bench_env = {'OMP_STACKSIZE': '512M'}
+	# 整理运行环境（--finalize）：不复制的系统库目录、设置 RPATH 的工具，以及测量库加载耗时的次数
+	finalize_system_dirs = ['/lib', '/lib64', '/usr/lib', '/usr/lib64']
+	finalize_patchelf = 'patchelf'
+	finalize_timing_runs = 5
+	# 测量动态库加载时每次运行的超时秒数
+	finalize_timeout = 30
+	# 编译失败时输出的日志行数（内存中只保留这么多行）
+	log_tail_lines = 50
+	# dep_list = []
\ No newline at end of file
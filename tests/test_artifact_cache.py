@@ -0,0 +1,98 @@
+import hashlib
+import os
+
+import pytest
+
+import wrf_auto_install as wai
+
+CONTENT = {
+	'http://a/zlib.tar.gz': b'z' * 100,
+	'http://a/hdf5.tar.gz': b'h' * 100,
+	'http://a/netcdf.tar.gz': b'n' * 100,
+	'http://mirror/zlib.tar.gz': b'z' * 100,
+}
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+	fetched = []
+
+	def fake_download(url, dest, mirrors=None):
+		fetched.append(url)
+		with open(dest, 'wb') as f:
+			f.write(CONTENT[url])
+
+	monkeypatch.setattr(wai, 'download_file', fake_download)
+	return fetched
+
+
+def _set_last_used(cache, **ages):
+	with cache._index() as index:
+		for url, entry in index.items():
+			entry['last_used'] = ages[os.path.basename(url).split('.')[0]]
+
+
+def test_least_recently_used_object_is_evicted(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path), max_size=250)
+	cache.store('http://a/zlib.tar.gz')
+	cache.store('http://a/hdf5.tar.gz')
+	_set_last_used(cache, zlib=200, hdf5=100)
+	cache.store('http://a/netcdf.tar.gz')
+	assert cache.lookup('http://a/hdf5.tar.gz') is None
+	assert cache.lookup('http://a/zlib.tar.gz') is not None
+	assert cache.lookup('http://a/netcdf.tar.gz') is not None
+	assert not os.path.exists(cache.object_path(hashlib.sha256(CONTENT['http://a/hdf5.tar.gz']).hexdigest()))
+
+
+def test_newly_stored_object_is_kept_even_over_the_limit(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path), max_size=50)
+	path = cache.store('http://a/zlib.tar.gz')
+	assert os.path.exists(path)
+	cache.store('http://a/hdf5.tar.gz')
+	assert cache.lookup('http://a/zlib.tar.gz') is None
+	assert cache.lookup('http://a/hdf5.tar.gz') is not None
+
+
+def test_urls_with_identical_content_share_one_object(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path), max_size=250)
+	first = cache.store('http://a/zlib.tar.gz')
+	assert cache.store('http://mirror/zlib.tar.gz') == first
+	cache.store('http://a/hdf5.tar.gz')
+	# 两个地址共用的对象只计算一次大小，不触发淘汰
+	assert cache.lookup('http://a/hdf5.tar.gz') is not None
+	_set_last_used(cache, zlib=100, hdf5=200)
+	cache.store('http://a/netcdf.tar.gz')
+	assert cache.lookup('http://a/zlib.tar.gz') is None
+	assert cache.lookup('http://mirror/zlib.tar.gz') is None
+	assert not os.path.exists(first)
+
+
+def test_truncated_object_is_dropped_from_the_index(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path), max_size=1000)
+	path = cache.store('http://a/zlib.tar.gz')
+	with open(path, 'wb') as f:
+		f.write(b'z')
+	assert cache.lookup('http://a/zlib.tar.gz') is None
+	assert cache.known_digest('http://a/zlib.tar.gz') is None
+
+
+def test_cache_hit_does_not_download_again(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path / 'cache'), max_size=1000)
+	cache.fetch('http://a/zlib.tar.gz', str(tmp_path / 'one' / 'zlib.tar.gz'))
+	cache.fetch('http://a/zlib.tar.gz', str(tmp_path / 'two' / 'zlib.tar.gz'))
+	assert downloads == ['http://a/zlib.tar.gz']
+	assert (tmp_path / 'two' / 'zlib.tar.gz').read_bytes() == CONTENT['http://a/zlib.tar.gz']
+
+
+def test_checksum_mismatch_is_rejected(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path), max_size=1000)
+	with pytest.raises(ValueError, match='Checksum mismatch'):
+		cache.store('http://a/zlib.tar.gz', sha256='0' * 64)
+	assert cache.lookup('http://a/zlib.tar.gz') is None
+
+
+def test_offline_miss_does_not_download(tmp_path, downloads):
+	cache = wai.ArtifactCache(str(tmp_path / 'cache'), max_size=1000, offline=True)
+	with pytest.raises(RuntimeError, match='Offline mode'):
+		cache.fetch('http://a/zlib.tar.gz', str(tmp_path / 'zlib.tar.gz'))
+	assert downloads == []
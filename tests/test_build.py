@@ -0,0 +1,42 @@
+import io
+import tarfile
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+def _write_package(path, configure):
+	with tarfile.open(path, 'w:gz') as tar:
+		for name, text in (('pkg-1.0/configure', configure), ('pkg-1.0/Makefile', 'all:\n\ttouch built\ninstall:\n\ttouch installed\n')):
+			data = text.encode()
+			info = tarfile.TarInfo(name)
+			info.size = len(data)
+			info.mode = 0o755
+			tar.addfile(info, io.BytesIO(data))
+
+
+def test_configure_failure_stops_the_build(tmp_path, monkeypatch):
+	monkeypatch.setattr(wai, 'CHECKS', wai.CheckRunner('skip'))
+	src_dir = tmp_path / 'src'
+	src_dir.mkdir()
+	src_file = src_dir / 'pkg-1.0.tar.gz'
+	_write_package(src_file, '#!/bin/sh\nexit 3\n')
+	with pytest.raises(RuntimeError, match='configure failed'):
+		wai.compile_dependency('pkg', '1.0', 'http://127.0.0.1/pkg-1.0.tar.gz', 1, str(src_dir), str(src_file),
+							   str(tmp_path / 'prefix'), [], str(tmp_path / 'logs'))
+	assert not (src_dir / 'pkg-1.0' / 'built').exists()
+
+
+def test_failed_dependency_is_fatal_and_skips_dependents():
+	built = []
+
+	def build(dep, jobs):
+		if dep == 'zlib':
+			raise RuntimeError('zlib-1.2 install failed with code 2')
+		built.append(dep)
+
+	graph = {'hdf5': ['zlib'], 'netcdf-c': ['hdf5']}
+	with pytest.raises(RuntimeError, match='Build failed: zlib'):
+		wai.run_dependency_graph(['zlib', 'hdf5', 'netcdf-c'], graph, build, 2)
+	assert built == []
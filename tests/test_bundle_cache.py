@@ -0,0 +1,85 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+def _make_prefix(prefix):
+	os.makedirs(os.path.join(prefix, 'lib', 'pkgconfig'))
+	os.makedirs(os.path.join(prefix, 'bin'))
+	with open(os.path.join(prefix, 'lib', 'libnetcdf.la'), 'w') as f:
+		f.write(f"libdir='{prefix}/lib'\ndependency_libs=' -L{prefix}/lib -lhdf5'\n")
+	with open(os.path.join(prefix, 'lib', 'pkgconfig', 'netcdf.pc'), 'w') as f:
+		f.write(f"prefix={prefix}\nlibdir=${{prefix}}/lib\n")
+	with open(os.path.join(prefix, 'bin', 'nc-config'), 'w') as f:
+		f.write(f"#!/bin/sh\necho {prefix}\n")
+	os.chmod(os.path.join(prefix, 'bin', 'nc-config'), 0o755)
+	# 二进制文件中的路径不做文本替换
+	with open(os.path.join(prefix, 'lib', 'libnetcdf.a'), 'wb') as f:
+		f.write(b'!<arch>\n\0' + prefix.encode())
+	os.symlink('libnetcdf.a', os.path.join(prefix, 'lib', 'libnetcdf_c.a'))
+
+
+def test_bundle_round_trip_relocates_text_files(tmp_path):
+	old_prefix = str(tmp_path / 'store' / 'netcdf-c-4.7.4-old')
+	new_prefix = str(tmp_path / 'other' / 'netcdf-c-4.7.4-new')
+	_make_prefix(old_prefix)
+	cache = wai.BundleCache(str(tmp_path / 'bundles'))
+	cache.toolchain = 'ifort 2021.10'
+	cache.save('netcdf-c', '4.7.4', 'f' * 64, old_prefix)
+	shutil.rmtree(old_prefix)
+
+	assert cache.restore('netcdf-c', '4.7.4', 'f' * 64, new_prefix)
+	with open(os.path.join(new_prefix, 'lib', 'libnetcdf.la')) as f:
+		assert f.read() == f"libdir='{new_prefix}/lib'\ndependency_libs=' -L{new_prefix}/lib -lhdf5'\n"
+	with open(os.path.join(new_prefix, 'lib', 'pkgconfig', 'netcdf.pc')) as f:
+		assert f.read().startswith(f"prefix={new_prefix}\n")
+	assert subprocess.run([os.path.join(new_prefix, 'bin', 'nc-config')], capture_output=True, text=True).stdout.strip() == new_prefix
+	with open(os.path.join(new_prefix, 'lib', 'libnetcdf.a'), 'rb') as f:
+		assert f.read() == b'!<arch>\n\0' + old_prefix.encode()
+	assert os.readlink(os.path.join(new_prefix, 'lib', 'libnetcdf_c.a')) == 'libnetcdf.a'
+	assert not os.path.exists(os.path.join(new_prefix, wai.BUNDLE_MANIFEST))
+
+
+def test_restore_miss_returns_false(tmp_path):
+	cache = wai.BundleCache(str(tmp_path / 'bundles'))
+	assert not cache.restore('zlib', '1.2.11', 'a' * 64, str(tmp_path / 'prefix'))
+	assert not os.path.exists(tmp_path / 'prefix')
+
+
+def test_bundles_are_keyed_by_the_detected_compiler(tmp_path):
+	prefix = str(tmp_path / 'zlib')
+	_make_prefix(prefix)
+	cache = wai.BundleCache(str(tmp_path / 'bundles'))
+	cache.toolchain = 'ifort (IFORT) 2021.10.0 20230609'
+	cache.save('zlib', '1.2.11', 'a' * 64, prefix)
+	assert cache.has('zlib', '1.2.11', 'a' * 64)
+	cache.toolchain = 'ifort (IFORT) 2021.13.0 20240602'
+	assert not cache.has('zlib', '1.2.11', 'a' * 64)
+
+
+def _fake_compiler(path, version):
+	with open(path, 'w') as f:
+		f.write(f"#!/bin/sh\necho '{version}'\n")
+	os.chmod(path, 0o755)
+	return str(path)
+
+
+def test_compiler_identity_follows_version_output(tmp_path):
+	first = _fake_compiler(tmp_path / 'ifort-a', 'ifort (IFORT) 2021.10.0 20230609')
+	other = _fake_compiler(tmp_path / 'ifort-c', 'ifort (IFORT) 2021.13.0 20240602')
+	env = dict(os.environ, CC='', CXX='')
+	assert wai.compiler_identity(dict(env, FC=first)) != wai.compiler_identity(dict(env, FC=other))
+	# 同一个命令名在 PATH 中对应不同安装时同样可以区分
+	os.makedirs(tmp_path / 'a')
+	os.makedirs(tmp_path / 'c')
+	os.symlink(first, tmp_path / 'a' / 'ifort')
+	os.symlink(other, tmp_path / 'c' / 'ifort')
+	path = os.environ.get('PATH', '')
+	assert (wai.compiler_identity(dict(env, FC='ifort', PATH=f"{tmp_path / 'a'}:{path}"))
+			!= wai.compiler_identity(dict(env, FC='ifort', PATH=f"{tmp_path / 'c'}:{path}")))
+	assert wai.compiler_identity(dict(env, FC='ifort', PATH=f"{tmp_path / 'a'}:{path}")) == \
+		wai.compiler_identity(dict(env, FC='ifort', PATH=f"{tmp_path / 'a'}:{path}"))
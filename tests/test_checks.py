@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+def _make_package(path, passing):
+	os.makedirs(path)
+	with open(os.path.join(path, 'Makefile'), 'w') as f:
+		f.write(f"check:\n\t@echo running tests\n\t@{'true' if passing else 'false'}\n")
+	return str(path)
+
+
+@pytest.mark.parametrize('policy', ['serial', 'parallel'])
+def test_inline_check_failure_is_fatal_only_in_fail_mode(tmp_path, policy):
+	src = _make_package(tmp_path / 'zlib', passing=False)
+	logs = str(tmp_path / 'logs')
+
+	warn = wai.CheckRunner(policy, 'warn')
+	assert warn.inline
+	assert not warn.run('zlib', '1.2.11', src, 2, logs)
+	assert warn.results['zlib-1.2.11']['status'] == 'failed'
+	warn.wait()
+
+	fail = wai.CheckRunner(policy, 'fail')
+	with pytest.raises(RuntimeError, match='zlib-1.2.11 check failed'):
+		fail.run('zlib', '1.2.11', src, 2, logs)
+	assert fail.results['zlib-1.2.11']['status'] == 'failed'
+
+
+def test_inline_check_pass_is_not_fatal(tmp_path):
+	src = _make_package(tmp_path / 'zlib', passing=True)
+	runner = wai.CheckRunner('serial', 'fail')
+	assert runner.run('zlib', '1.2.11', src, 1, str(tmp_path / 'logs'))
+	runner.wait()
+	assert runner.results['zlib-1.2.11']['status'] == 'passed'
+
+
+@pytest.mark.parametrize('on_failure', ['warn', 'fail'])
+def test_deferred_check_failure_is_raised_after_wait(tmp_path, on_failure):
+	runner = wai.CheckRunner('deferred', on_failure)
+	assert not runner.inline
+	runner.submit('hdf5', '1.10.4', _make_package(tmp_path / 'hdf5', passing=False), 2, str(tmp_path / 'logs'))
+	runner.submit('zlib', '1.2.11', _make_package(tmp_path / 'zlib', passing=True), 2, str(tmp_path / 'logs'))
+	try:
+		if on_failure == 'fail':
+			with pytest.raises(RuntimeError, match='hdf5-1.10.4'):
+				runner.wait()
+		else:
+			runner.wait()
+	finally:
+		runner.shutdown()
+	assert runner.results['hdf5-1.10.4']['status'] == 'failed'
+	assert runner.results['zlib-1.2.11']['status'] == 'passed'
+
+
+def test_skip_policy_records_without_running(tmp_path):
+	runner = wai.CheckRunner('skip', 'fail')
+	assert not runner.inline
+	runner.skip('netcdf-c', '4.7.4', 'skipped by --check skip')
+	runner.wait()
+	runner.report(str(tmp_path / 'logs'))
+	with open(tmp_path / 'logs' / 'check-results.json') as f:
+		report = json.load(f)
+	assert report['policy'] == 'skip' and report['on_failure'] == 'fail'
+	assert report['results']['netcdf-c-4.7.4'] == {'version': '4.7.4', 'status': 'skipped', 'reason': 'skipped by --check skip'}
@@ -0,0 +1,121 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+import compiler_cache
+
+# Fortran 源码不需要预处理时不会调用编译器，只用它的文件信息计算缓存键
+FAKE_COMPILER = sys.executable
+
+
+def _write(path, text):
+	os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+	with open(path, 'w') as f:
+		f.write(text)
+
+
+def _key(args):
+	return compiler_cache.cache_key(FAKE_COMPILER, compiler_cache.parse_command(args))
+
+
+def test_single_source_compile_is_parsed():
+	command = compiler_cache.parse_command(['-O3', '-c', 'module_io.f90', '-o', 'obj/module_io.o', '-module', 'mods', '-Iinc', '-MD'])
+	assert command['source'] == 'module_io.f90'
+	assert command['object'] == 'obj/module_io.o'
+	assert command['module_dir'] == 'mods'
+	assert command['include_dirs'] == ['inc']
+	assert command['dep_file'] == 'obj/module_io.d'
+	assert command['fortran']
+	assert '-MD' not in command['key_args'] and '-o' not in command['key_args']
+
+
+@pytest.mark.parametrize('args', [
+	['a.o', 'b.o', '-o', 'wrf.exe'],
+	['-c', 'a.f90', 'b.f90'],
+	['-E', 'a.F90'],
+	['-c', 'a.f90', '-o'],
+	['@args.rsp'],
+])
+def test_link_multi_source_and_preprocess_commands_are_not_cached(args):
+	assert compiler_cache.parse_command(args) is None
+
+
+def test_uncacheable_command_runs_the_real_compiler(tmp_path):
+	cache_dir = str(tmp_path / 'cache')
+	os.makedirs(cache_dir)
+	assert compiler_cache.compile_cached(cache_dir, shutil.which('true'), ['a.o', 'b.o', '-o', 'wrf.exe']) == 0
+	assert compiler_cache.read_stats(cache_dir) == {'hit': 0, 'miss': 0, 'uncacheable': 1}
+
+
+def test_use_statements_are_recognized_but_not_assignments():
+	text = '\n'.join([
+		'module module_domain',
+		'  use module_driver_constants',
+		'  USE, INTRINSIC :: iso_c_binding',
+		'  use::module_state_description',
+		'  use module_configure, only: grid_config_rec_type',
+		'  useful = 1',
+		'  user_flag = .true.',
+		'  module procedure alloc',
+		'end module module_domain',
+	])
+	defined, used = compiler_cache._fortran_modules(text)
+	assert defined == ['module_domain']
+	assert used == ['iso_c_binding', 'module_configure', 'module_driver_constants', 'module_state_description']
+
+
+def test_key_follows_included_files(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	_write('inc/params.inc', "include 'nested.inc'\ninteger, parameter :: n = 1\n")
+	_write('inc/nested.inc', 'integer, parameter :: m = 1\n')
+	_write('solve.f90', "subroutine solve\ninclude 'params.inc'\nend subroutine\n")
+	args = ['-c', 'solve.f90', '-Iinc']
+	key, _ = _key(args)
+	assert _key(args)[0] == key
+	_write('inc/nested.inc', 'integer, parameter :: m = 2\n')
+	changed, _ = _key(args)
+	assert changed != key
+	_write('inc/params.inc', "include 'nested.inc'\ninteger, parameter :: n = 2\n")
+	assert _key(args)[0] != changed
+
+
+def test_key_follows_used_module_files(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	_write('solve_em.f90', 'module module_solve\nuse module_domain\nend module module_solve\n')
+	args = ['-c', 'solve_em.f90', '-module', 'mods']
+	missing, mods = _key(args)
+	assert mods == [os.path.join('mods', 'module_solve.mod')]
+	_write('mods/module_domain.mod', 'v1')
+	built, _ = _key(args)
+	assert built != missing
+	_write('mods/module_domain.mod', 'v2')
+	rebuilt, _ = _key(args)
+	assert rebuilt != built
+	# 自己生成的 .mod 不参与键
+	_write('mods/module_solve.mod', 'anything')
+	assert _key(args)[0] == rebuilt
+
+
+@pytest.mark.skipif(shutil.which('gfortran') is None, reason='gfortran not installed')
+def test_cache_hit_restores_object_and_module_files(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	cache_dir = str(tmp_path / 'cache')
+	os.makedirs(cache_dir)
+	gfortran = shutil.which('gfortran')
+	_write('module_kinds.f90', 'module module_kinds\ninteger, parameter :: dp = kind(1.d0)\nend module module_kinds\n')
+	args = ['-c', 'module_kinds.f90', '-o', 'module_kinds.o']
+	assert compiler_cache.compile_cached(cache_dir, gfortran, args) == 0
+	with open('module_kinds.mod', 'rb') as f:
+		mod = f.read()
+	with open('module_kinds.o', 'rb') as f:
+		obj = f.read()
+	os.remove('module_kinds.mod')
+	os.remove('module_kinds.o')
+	assert compiler_cache.compile_cached(cache_dir, gfortran, args) == 0
+	assert compiler_cache.read_stats(cache_dir) == {'hit': 1, 'miss': 1, 'uncacheable': 0}
+	with open('module_kinds.mod', 'rb') as f:
+		assert f.read() == mod
+	with open('module_kinds.o', 'rb') as f:
+		assert f.read() == obj
@@ -0,0 +1,141 @@
+import http.server
+import os
+import re
+import threading
+
+import pytest
+
+import wrf_auto_install as wai
+from conf.common import Common
+
+PAYLOAD = bytes(range(256)) * 64
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+	"""按 server 上的设置返回 PAYLOAD：支持 Range、416、首次请求中途断开和 404"""
+
+	def log_message(self, *args):
+		pass
+
+	def do_HEAD(self):
+		self._reply(body=False)
+
+	def do_GET(self):
+		self._reply(body=True)
+
+	def _reply(self, body):
+		server = self.server
+		server.requests.append((self.command, self.headers.get('Range')))
+		if server.missing:
+			self.send_error(404)
+			return
+		size = len(PAYLOAD)
+		start, end = 0, size - 1
+		match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+		if match:
+			start = int(match.group(1))
+			end = int(match.group(2) or end)
+			if start >= size:
+				self.send_response(416)
+				self.send_header('Content-Range', f'bytes */{size}')
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+				return
+			self.send_response(206)
+			self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+		else:
+			self.send_response(200)
+		self.send_header('Content-Length', str(end - start + 1))
+		self.send_header('Accept-Ranges', 'bytes')
+		self.end_headers()
+		if not body:
+			return
+		data = PAYLOAD[start:end + 1]
+		if server.drop_after and self.command == 'GET':
+			# 只发送一部分后断开连接
+			self.wfile.write(data[:server.drop_after])
+			self.wfile.flush()
+			server.drop_after = 0
+			self.close_connection = True
+			return
+		self.wfile.write(data)
+
+
+@pytest.fixture
+def make_server():
+	servers = []
+
+	def make(missing=False, drop_after=0):
+		server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+		server.requests = []
+		server.missing = missing
+		server.drop_after = drop_after
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		servers.append(server)
+		return server
+
+	yield make
+	for server in servers:
+		server.shutdown()
+		server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+	monkeypatch.setattr(Common, 'download_backoff', 0)
+	monkeypatch.setattr(Common, 'download_retries', 3)
+	monkeypatch.setattr(Common, 'download_timeout', 5)
+
+
+def _url(server, name='pkg.tar.gz'):
+	return f"http://127.0.0.1:{server.server_address[1]}/{name}"
+
+
+def test_resume_after_dropped_connection(tmp_path, make_server):
+	server = make_server(drop_after=5000)
+	dest = str(tmp_path / 'pkg.tar.gz')
+	wai.download_file(_url(server), dest, mirrors={})
+	with open(dest, 'rb') as f:
+		assert f.read() == PAYLOAD
+	assert not os.path.exists(dest + '.part')
+	gets = [rng for method, rng in server.requests if method == 'GET']
+	assert gets == [None, 'bytes=5000-']
+
+
+def test_complete_partial_file_is_accepted_on_416(tmp_path, make_server):
+	server = make_server()
+	dest = str(tmp_path / 'pkg.tar.gz')
+	with open(dest + '.part', 'wb') as f:
+		f.write(PAYLOAD)
+	wai.download_file(_url(server), dest, mirrors={})
+	with open(dest, 'rb') as f:
+		assert f.read() == PAYLOAD
+	assert [rng for method, rng in server.requests if method == 'GET'] == [f'bytes={len(PAYLOAD)}-']
+
+
+def test_oversized_partial_file_is_discarded_on_416(tmp_path, make_server):
+	server = make_server()
+	dest = str(tmp_path / 'pkg.tar.gz')
+	with open(dest + '.part', 'wb') as f:
+		f.write(PAYLOAD + b'garbage')
+	wai.download_file(_url(server), dest, mirrors={})
+	with open(dest, 'rb') as f:
+		assert f.read() == PAYLOAD
+
+
+def test_not_found_fails_over_to_mirror_without_retrying(tmp_path, make_server):
+	origin = make_server(missing=True)
+	mirror = make_server()
+	origin_host = f"127.0.0.1:{origin.server_address[1]}"
+	mirror_prefix = f"http://127.0.0.1:{mirror.server_address[1]}"
+	dest = str(tmp_path / 'pkg.tar.gz')
+	wai.download_file(_url(origin), dest, mirrors={origin_host: [mirror_prefix]})
+	with open(dest, 'rb') as f:
+		assert f.read() == PAYLOAD
+	assert [method for method, _ in origin.requests].count('GET') == 1
+
+
+def test_all_mirrors_failing_exits(tmp_path, make_server):
+	origin = make_server(missing=True)
+	with pytest.raises(SystemExit):
+		wai.download_file(_url(origin), str(tmp_path / 'pkg.tar.gz'), mirrors={})
@@ -0,0 +1,153 @@
+import io
+import os
+import stat
+import tarfile
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+def _add(tar, name, data=None, mode=0o644, mtime=1000, kind=tarfile.REGTYPE, linkname=''):
+	info = tarfile.TarInfo(name)
+	info.type = kind
+	info.mode = mode
+	info.mtime = mtime
+	info.linkname = linkname
+	if data is not None:
+		info.size = len(data)
+	tar.addfile(info, io.BytesIO(data) if data is not None else None)
+
+
+@pytest.fixture
+def make_tar(tmp_path):
+	def make(build, name='pkg.tar.gz'):
+		path = tmp_path / name
+		with tarfile.open(path, 'w:gz') as tar:
+			build(tar)
+		return str(path)
+	return make
+
+
+def _make_dest(tmp_path, name='out'):
+	dest = tmp_path / name
+	dest.mkdir()
+	return dest
+
+
+def test_parallel_extract_creates_directories_before_their_files(tmp_path, make_tar):
+	def build(tar):
+		_add(tar, 'WRF-4.5/', kind=tarfile.DIRTYPE, mode=0o755)
+		_add(tar, 'WRF-4.5/run/', kind=tarfile.DIRTYPE, mode=0o555, mtime=1234)
+		_add(tar, 'WRF-4.5/run/README', b'run\n')
+		# 没有目录条目的深层文件
+		_add(tar, 'WRF-4.5/phys/module/a.F', b'a\n')
+	dest = _make_dest(tmp_path)
+	try:
+		wai.extract_file(make_tar(build), str(dest), strip_top=True, workers=4)
+		assert (dest / 'run' / 'README').read_bytes() == b'run\n'
+		assert (dest / 'phys' / 'module' / 'a.F').read_bytes() == b'a\n'
+		run_stat = os.stat(dest / 'run')
+		assert stat.S_IMODE(run_stat.st_mode) == 0o555
+		assert run_stat.st_mtime == 1234
+	finally:
+		os.chmod(dest / 'run', 0o755)
+
+
+def _single_top(tar):
+	_add(tar, 'netcdf-c-4.7.4/', kind=tarfile.DIRTYPE, mode=0o755)
+	_add(tar, 'netcdf-c-4.7.4/configure', b'#!/bin/sh\n', mode=0o755)
+	_add(tar, 'netcdf-c-4.7.4/include/netcdf.h', b'/* h */\n')
+	_add(tar, 'netcdf-c-4.7.4/include/netcdf_meta.h', kind=tarfile.LNKTYPE, linkname='netcdf-c-4.7.4/include/netcdf.h')
+	_add(tar, 'netcdf-c-4.7.4/lib', kind=tarfile.SYMTYPE, linkname='include')
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_single_top_level_directory_is_stripped(tmp_path, make_tar, workers):
+	dest = _make_dest(tmp_path)
+	wai.extract_file(make_tar(_single_top), str(dest), strip_top=True, workers=workers)
+	assert sorted(os.listdir(dest)) == ['configure', 'include', 'lib']
+	assert os.access(dest / 'configure', os.X_OK)
+	assert (dest / 'include' / 'netcdf_meta.h').read_bytes() == b'/* h */\n'
+	assert os.path.islink(dest / 'lib')
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_second_top_level_entry_undoes_stripping(tmp_path, make_tar, workers):
+	def build(tar):
+		_single_top(tar)
+		_add(tar, 'README', b'top\n')
+	dest = _make_dest(tmp_path)
+	wai.extract_file(make_tar(build), str(dest), strip_top=True, workers=workers)
+	assert sorted(os.listdir(dest)) == ['README', 'netcdf-c-4.7.4']
+	top = dest / 'netcdf-c-4.7.4'
+	assert sorted(os.listdir(top)) == ['configure', 'include', 'lib']
+	assert (top / 'include' / 'netcdf_meta.h').read_bytes() == b'/* h */\n'
+
+
+def test_non_empty_destination_is_not_stripped(tmp_path, make_tar):
+	dest = _make_dest(tmp_path)
+	(dest / 'existing').write_text('keep')
+	wai.extract_file(make_tar(_single_top), str(dest), strip_top=True)
+	assert sorted(os.listdir(dest)) == ['existing', 'netcdf-c-4.7.4']
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_unsafe_member_is_rejected_and_rolled_back(tmp_path, make_tar, workers):
+	def build(tar):
+		_add(tar, 'pkg/ok.txt', b'ok\n')
+		_add(tar, 'pkg/../../evil.txt', b'evil\n')
+	dest = _make_dest(tmp_path)
+	(dest / 'existing').write_text('keep')
+	with pytest.raises(Exception):
+		wai.extract_file(make_tar(build), str(dest), workers=workers)
+	assert os.listdir(dest) == ['existing']
+	assert not (tmp_path / 'evil.txt').exists()
+
+
+@pytest.mark.parametrize('suffix, opener', [('.tar.bz2', 'w:bz2'), ('.tar.xz', 'w:xz'), ('.tgz', 'w:gz'), ('.tar', 'w')])
+def test_format_is_detected_from_content_not_name(tmp_path, suffix, opener):
+	# 扩展名与实际格式不符时按文件头识别
+	path = tmp_path / f"pkg{suffix}.download"
+	with tarfile.open(path, opener) as tar:
+		_single_top(tar)
+	dest = _make_dest(tmp_path)
+	wai.extract_file(str(path), str(dest), strip_top=True)
+	assert (dest / 'include' / 'netcdf.h').exists()
+
+
+def test_zip_archive_is_stripped(tmp_path):
+	import zipfile
+	path = tmp_path / 'jasper.zip'
+	with zipfile.ZipFile(path, 'w') as zipf:
+		zipf.writestr('jasper-1.900.1/configure', '#!/bin/sh\n')
+		zipf.writestr('jasper-1.900.1/src/jas.c', 'int x;\n')
+	dest = _make_dest(tmp_path)
+	wai.extract_file(str(path), str(dest), strip_top=True)
+	assert sorted(os.listdir(dest)) == ['configure', 'src']
+
+
+def test_single_compressed_file_is_decompressed(tmp_path):
+	import gzip
+	path = tmp_path / 'namelist.input.gz'
+	with gzip.open(path, 'wb') as f:
+		f.write(b'&time_control\n/\n')
+	dest = _make_dest(tmp_path)
+	wai.extract_file(str(path), str(dest))
+	assert (dest / 'namelist.input').read_bytes() == b'&time_control\n/\n'
+
+
+def test_stream_input_is_extracted(tmp_path, make_tar):
+	dest = _make_dest(tmp_path)
+	with open(make_tar(_single_top), 'rb') as f:
+		wai.extract_file(io.BufferedReader(f), str(dest), strip_top=True, workers=4)
+	assert (dest / 'include' / 'netcdf.h').exists()
+
+
+def test_unsupported_format_raises(tmp_path):
+	path = tmp_path / 'WRF.tar.gz'
+	path.write_bytes(b'<html>404 Not Found</html>')
+	dest = _make_dest(tmp_path)
+	with pytest.raises(ValueError):
+		wai.extract_file(str(path), str(dest))
+	assert os.listdir(dest) == []
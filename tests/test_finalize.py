@@ -0,0 +1,23 @@
+import os
+import sys
+
+import wrf_auto_install as wai
+
+
+def test_elf_interpreter_detection(tmp_path):
+	script = tmp_path / 'run.sh'
+	script.write_text('#!/bin/sh\nexit 0\n')
+	assert wai.has_elf_interpreter(os.path.realpath(sys.executable))
+	assert not wai.has_elf_interpreter(str(script))
+	assert not wai.has_elf_interpreter(str(tmp_path / 'missing'))
+
+
+def test_load_timing_does_not_run_non_elf_programs(tmp_path):
+	marker = tmp_path / 'ran'
+	script = tmp_path / 'wrf.exe'
+	script.write_text(f'#!/bin/sh\ntouch {marker}\n')
+	script.chmod(0o755)
+	report = wai.measure_library_loading([str(script), os.path.realpath(sys.executable)], dict(os.environ), runs=1)
+	assert not marker.exists()
+	assert list(report) == [os.path.basename(os.path.realpath(sys.executable))]
+	assert report[os.path.basename(os.path.realpath(sys.executable))]['libraries'] >= 1
@@ -0,0 +1,64 @@
+import argparse
+import logging
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+def test_parse_matrix_targets_defaults_and_modes():
+	targets = wai.parse_matrix_targets(['3.9', '4.0:4.0.1:dmpar,dm+sm', '4.1::serial'], ['dmpar'])
+	assert targets == [
+		{'name': 'WRF-3.9_WPS-3.9', 'wrf': '3.9', 'wps': '3.9', 'modes': ['dmpar']},
+		{'name': 'WRF-4.0_WPS-4.0.1', 'wrf': '4.0', 'wps': '4.0.1', 'modes': ['dmpar', 'dm+sm']},
+		{'name': 'WRF-4.1_WPS-4.1', 'wrf': '4.1', 'wps': '4.1', 'modes': ['serial']},
+	]
+
+
+def test_parse_matrix_targets_merges_same_versions():
+	# 版本相同的项合并为一个目标，并行方式去重后按出现顺序排列
+	targets = wai.parse_matrix_targets(['3.9:3.9:dmpar', '3.9::smpar,dmpar', '3.9'], ['serial'])
+	assert targets == [{'name': 'WRF-3.9_WPS-3.9', 'wrf': '3.9', 'wps': '3.9', 'modes': ['dmpar', 'smpar', 'serial']}]
+
+
+@pytest.mark.parametrize('spec, message', [
+	('', 'Invalid matrix target'),
+	(':3.9', 'Invalid matrix target'),
+	('3.9:3.9:dmpar:extra', 'Invalid matrix target'),
+	('3.9::mpi', 'Unknown WRF parallel mode mpi'),
+	('3.9::dmpar,', 'Unknown WRF parallel mode'),
+])
+def test_parse_matrix_targets_rejects_malformed_specs(spec, message):
+	with pytest.raises(ValueError, match=message):
+		wai.parse_matrix_targets([spec], ['dmpar'])
+
+
+def test_matrix_plan_shares_identical_dependencies(tmp_path, monkeypatch, caplog):
+	ver_config = tmp_path / 'version_config.ini'
+	ver_config.write_text(
+		"[compatibility]\n"
+		"3.9=intel-base:2022.3 intel-hpc:2022.1 netcdf-c:4.4.1 netcdf-fortran:4.4.4 hdf5:1_10_4 jasper:1.900.1 libpng:1.2.50 zlib:1.2.8\n"
+		"4.0=intel-base:2022.3 intel-hpc:2022.1 netcdf-c:4.7.4 netcdf-fortran:4.5.3 hdf5:1_10_4 jasper:1.900.1 libpng:1.2.50 zlib:1.2.8\n"
+		"\n[NAME]\nname=intel-base:base_%v.sh intel-hpc:hpc_%v.sh\n")
+	url_config = tmp_path / 'url_config.ini'
+	url_config.write_text(
+		"[compiler]\nintel-base=http://mirror/base-%v.sh\nintel-hpc=http://mirror/hpc-%v.sh\n\n[dep_common]\n"
+		+ ''.join(f"{dep}=http://mirror/{dep}-%v.tar.gz\n" for dep in wai.dep_list)
+		+ "\n[wrf_url]\nwrf=http://mirror/WRF-%v.tar.gz\nwps=http://mirror/WPS-%v.tar.gz\n")
+	monkeypatch.setattr(wai, 'VER_CONFIG', str(ver_config))
+	monkeypatch.setattr(wai, 'URL_CONFIG', str(url_config))
+	args = argparse.Namespace(isa='none', ipo=False, plan=True)
+	targets = wai.parse_matrix_targets(['3.9', '4.0::dmpar,smpar'], ['dmpar'])
+	with caplog.at_level(logging.INFO):
+		wai.run_matrix(args, targets, str(tmp_path / 'install'), 'intel', 2)
+
+	# zlib、libpng、jasper、hdf5 两个目标完全相同，只编译一次；netcdf 版本不同各编译一次
+	assert 'Matrix: 2 targets, 8 distinct dependency builds' in caplog.text
+	summary = [line for line in caplog.text.splitlines() if 'distinct dependency builds' in line][0]
+	shared = summary.split('shared: ')[1].split(', ')
+	assert sorted(node.split('@')[0] for node in shared) == ['hdf5-1_10_4', 'jasper-1.900.1', 'libpng-1.2.50', 'zlib-1.2.8']
+	assert [variant['tag'] for variant in targets[1]['variants']] == ['dmpar', 'smpar']
+	for dep in ('zlib', 'hdf5'):
+		assert targets[0]['dep_nodes'][dep] == targets[1]['dep_nodes'][dep]
+	for dep in ('netcdf-c', 'netcdf-fortran'):
+		assert targets[0]['dep_nodes'][dep] != targets[1]['dep_nodes'][dep]
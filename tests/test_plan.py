@@ -0,0 +1,147 @@
+import pytest
+
+import wrf_auto_install as wai
+
+STAGES = ['compiler', 'zlib', 'hdf5', 'netcdf-c', 'netcdf-fortran', 'wrf:dmpar', 'wps']
+
+
+def _fingerprints(inputs):
+	graph = wai.build_stage_graph(STAGES)
+	fingerprints = {}
+	for stage in STAGES:
+		fingerprints[stage] = wai.stage_fingerprint(stage, inputs.get(stage, {}), [fingerprints[up] for up in graph[stage]])
+	return fingerprints
+
+
+def _versions(inputs):
+	return {stage: inputs.get(stage, {}).get('version') for stage in STAGES}
+
+
+def _record_all(journal, fingerprints, versions):
+	for stage, fingerprint in fingerprints.items():
+		journal.record(stage, fingerprint, version=versions[stage])
+
+
+BASE = {
+	'zlib': {'version': '1.2.11'},
+	'hdf5': {'version': '1.10.5', 'configure': '--enable-fortran'},
+	'netcdf-c': {'version': '4.7.4'},
+	'netcdf-fortran': {'version': '4.5.3'},
+	'wrf:dmpar': {'version': '4.5', 'flags': ''},
+	'wps': {'version': '4.5'},
+}
+
+
+def test_fresh_install_builds_everything(tmp_path):
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	plan = wai.plan_rebuild(_fingerprints(BASE), journal, _versions(BASE))
+	assert plan == [(stage, 'not built') for stage in STAGES]
+
+
+def test_unchanged_install_is_a_no_op(tmp_path):
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	_record_all(journal, _fingerprints(BASE), _versions(BASE))
+	reloaded = wai.StageJournal(journal.path)
+	assert wai.plan_rebuild(_fingerprints(BASE), reloaded, _versions(BASE)) == []
+
+
+def test_version_change_rebuilds_only_downstream_stages(tmp_path):
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	_record_all(journal, _fingerprints(BASE), _versions(BASE))
+	changed = dict(BASE, hdf5={'version': '1.12.0', 'configure': '--enable-fortran'})
+	plan = dict(wai.plan_rebuild(_fingerprints(changed), journal, _versions(changed)))
+	assert list(plan) == ['hdf5', 'netcdf-c', 'netcdf-fortran', 'wrf:dmpar', 'wps']
+	assert plan['hdf5'] == 'version 1.10.5 -> 1.12.0'
+	assert plan['netcdf-c'] == 'upstream changed: hdf5'
+	assert plan['netcdf-fortran'] == 'upstream changed: netcdf-c'
+	assert plan['wps'] == 'upstream changed: wrf:dmpar'
+
+
+def test_option_change_without_version_change(tmp_path):
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	_record_all(journal, _fingerprints(BASE), _versions(BASE))
+	changed = dict(BASE, **{'wrf:dmpar': {'version': '4.5', 'flags': '-xHost'}})
+	plan = wai.plan_rebuild(_fingerprints(changed), journal, _versions(changed))
+	assert plan == [('wrf:dmpar', 'build options changed'), ('wps', 'upstream changed: wrf:dmpar')]
+
+
+def test_missing_stage_with_unchanged_fingerprint_keeps_dependents(tmp_path):
+	# 重新编译得到的指纹不变，下游阶段仍然有效
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	fingerprints = _fingerprints(BASE)
+	_record_all(journal, fingerprints, _versions(BASE))
+	journal.invalidate('netcdf-fortran')
+	assert wai.plan_rebuild(fingerprints, journal, _versions(BASE)) == [('netcdf-fortran', 'not built')]
+
+
+def test_corrupted_journal_is_ignored(tmp_path):
+	path = tmp_path / 'install_journal.json'
+	path.write_text('{"stages": ')
+	journal = wai.StageJournal(str(path))
+	assert journal.stages == {}
+	assert len(wai.plan_rebuild(_fingerprints(BASE), journal, _versions(BASE))) == len(STAGES)
+
+
+def test_lockfile_round_trip(tmp_path):
+	path = str(tmp_path / 'locks' / 'install_lock.json')
+	fingerprints = _fingerprints(BASE)
+	lock = {'lock_version': wai.LOCK_VERSION, 'wrf_version': '4.5', 'fingerprints': fingerprints,
+			'variants': wai.build_variants(['dmpar'], isa='none')}
+	wai.write_lockfile(path, lock)
+	assert wai.read_lockfile(path) == lock
+	assert not (tmp_path / 'locks' / 'install_lock.json.tmp').exists()
+
+
+def test_lockfile_with_other_version_is_rejected(tmp_path):
+	path = str(tmp_path / 'install_lock.json')
+	wai.write_lockfile(path, {'lock_version': wai.LOCK_VERSION + 1, 'fingerprints': {}})
+	with pytest.raises(SystemExit) as e:
+		wai.read_lockfile(path)
+	assert e.value.code == 1
+	(tmp_path / 'broken.json').write_text('{"lock_version": 1,')
+	with pytest.raises(SystemExit):
+		wai.read_lockfile(str(tmp_path / 'broken.json'))
+
+
+TIMES = {'compiler': 100, 'zlib': 10, 'hdf5': 50, 'netcdf-c': 30, 'netcdf-fortran': 20, 'wrf:dmpar': 600, 'wps': 700}
+
+
+def test_estimate_plan_from_recorded_history(tmp_path):
+	history_file = str(tmp_path / 'cache' / 'history.json')
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	fingerprints = _fingerprints(BASE)
+	versions = _versions(BASE)
+	_record_all(journal, fingerprints, versions)
+	for wrf_time in (900, 500, 600):
+		wai.record_history(history_file, dict(TIMES, **{'wrf:dmpar': wrf_time}), journal, fingerprints, versions)
+	history = wai.load_history(history_file)
+	assert history['wrf:dmpar@4.5'] == [900, 500, 600]
+	assert history['zlib@1.2.11'] == [10, 10, 10]
+
+	plan = wai.plan_rebuild(fingerprints, wai.StageJournal(str(tmp_path / 'fresh.json')), versions)
+	estimates, critical_path, unknown = wai.estimate_plan(plan, fingerprints, versions, history)
+	# 取中位数；WPS 与 WRF 同时开始，依赖按 zlib -> hdf5 -> netcdf-c -> netcdf-fortran 串行
+	assert estimates['wrf:dmpar'] == 600
+	assert critical_path == 100 + 10 + 50 + 30 + 20 + 700
+	assert unknown == []
+
+	# 可以直接复用的依赖按 0 计；没有历史的版本不计入并单独列出
+	new_versions = dict(versions, wps='4.6')
+	estimates, critical_path, unknown = wai.estimate_plan(plan, fingerprints, new_versions, history, reused={'hdf5'})
+	assert estimates['hdf5'] == 0.0 and estimates['wps'] is None
+	assert critical_path == 100 + 10 + 30 + 20 + 600
+	assert unknown == ['wps']
+
+
+def test_history_skips_reused_and_unfinished_stages(tmp_path):
+	history_file = str(tmp_path / 'history.json')
+	journal = wai.StageJournal(str(tmp_path / 'install_journal.json'))
+	fingerprints = _fingerprints(BASE)
+	versions = _versions(BASE)
+	journal.record('compiler', fingerprints['compiler'])
+	journal.record('zlib', fingerprints['zlib'], version='1.2.11', source='store')
+	journal.record('hdf5', fingerprints['hdf5'], version='1.10.5')
+	wai.record_history(history_file, TIMES, journal, fingerprints, versions)
+	assert sorted(wai.load_history(history_file)) == ['compiler', 'hdf5@1.10.5']
+	(tmp_path / 'history.json').write_text('not json')
+	assert wai.load_history(history_file) == {}
@@ -0,0 +1,63 @@
+import json
+import os
+
+import wrf_auto_install as wai
+
+
+def _make_package(prefix, files):
+	for rel_path, content in files.items():
+		path = os.path.join(prefix, rel_path)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'w') as f:
+			f.write(content)
+	open(os.path.join(prefix, wai.STORE_COMPLETE), 'w').close()
+
+
+def _read(path):
+	with open(path) as f:
+		return f.read()
+
+
+def test_compose_view_two_packages_collision_and_rebuild(tmp_path):
+	view = str(tmp_path / 'deps')
+	hdf5_old = str(tmp_path / 'store' / 'hdf5-old')
+	netcdf = str(tmp_path / 'store' / 'netcdf-c')
+	hdf5_new = str(tmp_path / 'store' / 'hdf5-new')
+	_make_package(hdf5_old, {'lib/libhdf5.a': 'hdf5 old', 'include/hdf5.h': 'hdf5 old', 'share/COPYING': 'hdf5'})
+	_make_package(netcdf, {'lib/libnetcdf.a': 'netcdf', 'include/netcdf.h': 'netcdf', 'share/COPYING': 'netcdf'})
+	_make_package(hdf5_new, {'lib/libhdf5.a': 'hdf5 new', 'include/hdf5.h': 'hdf5 new', 'share/COPYING': 'hdf5'})
+
+	wai.compose_view(view, 'hdf5', hdf5_old)
+	wai.compose_view(view, 'netcdf-c', netcdf)
+	assert os.readlink(os.path.join(view, 'lib', 'libhdf5.a')) == os.path.join(hdf5_old, 'lib', 'libhdf5.a')
+	assert _read(os.path.join(view, 'lib', 'libnetcdf.a')) == 'netcdf'
+	assert not os.path.lexists(os.path.join(view, wai.STORE_COMPLETE))
+	# 冲突的文件由后链接的包提供
+	assert _read(os.path.join(view, 'share', 'COPYING')) == 'netcdf'
+
+	# 换成新前缀重建时删除旧链接，但不动已经归属其他包的冲突文件
+	os.remove(os.path.join(hdf5_new, 'share', 'COPYING'))
+	wai.compose_view(view, 'hdf5', hdf5_new)
+	assert _read(os.path.join(view, 'lib', 'libhdf5.a')) == 'hdf5 new'
+	assert _read(os.path.join(view, 'include', 'hdf5.h')) == 'hdf5 new'
+	assert _read(os.path.join(view, 'share', 'COPYING')) == 'netcdf'
+	assert _read(os.path.join(view, 'lib', 'libnetcdf.a')) == 'netcdf'
+
+	with open(os.path.join(view, wai.VIEW_MANIFEST)) as f:
+		manifest = json.load(f)
+	assert manifest['hdf5']['prefix'] == hdf5_new
+	assert sorted(manifest['hdf5']['files']) == ['include/hdf5.h', 'lib/libhdf5.a']
+	assert 'share/COPYING' in manifest['netcdf-c']['files']
+
+
+def test_compose_view_hardlink_mode(tmp_path):
+	view = str(tmp_path / 'deps')
+	prefix = str(tmp_path / 'store' / 'zlib')
+	_make_package(prefix, {'lib/libz.a': 'zlib'})
+	os.symlink('libz.a', os.path.join(prefix, 'lib', 'libz.so'))
+	wai.compose_view(view, 'zlib', prefix, mode='hardlink')
+	dest = os.path.join(view, 'lib', 'libz.a')
+	assert not os.path.islink(dest)
+	assert os.path.samefile(dest, os.path.join(prefix, 'lib', 'libz.a'))
+	# 包内的符号链接仍以符号链接进入视图
+	assert os.path.islink(os.path.join(view, 'lib', 'libz.so'))
@@ -0,0 +1,93 @@
+import os
+import subprocess
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+def _write_setvars(oneapi, extra=''):
+	# 每次 source 都在 oneAPI 目录外的 calls 文件中记一行，用来判断是否重新执行了脚本
+	with open(os.path.join(oneapi, 'setvars.sh'), 'w') as f:
+		f.write(f'echo x >> "{oneapi}.calls"\n'
+				f'export PATH="{oneapi}/compiler/bin:$PATH"\n'
+				f'export LD_LIBRARY_PATH="{oneapi}/compiler/lib"\n'
+				'export SETVARS_COMPLETED=1\n'
+				f'{extra}')
+
+
+def _calls(oneapi):
+	with open(f"{oneapi}.calls") as f:
+		return len(f.read().split())
+
+
+@pytest.fixture
+def oneapi(tmp_path, monkeypatch):
+	root = tmp_path / 'oneapi'
+	os.makedirs(root / 'compiler' / 'bin')
+	_write_setvars(str(root))
+	monkeypatch.setattr(wai.Common, 'toolchain_cache_dir', str(tmp_path / 'cache'))
+	monkeypatch.setattr(wai, '_DELTA_MEMO', {})
+	monkeypatch.delenv('LD_LIBRARY_PATH', raising=False)
+	monkeypatch.setenv('SETVARS_COMPLETED', '1')
+	return str(root)
+
+
+def test_capture_env_delta(oneapi):
+	delta = wai.capture_env_delta(os.path.join(oneapi, 'setvars.sh'))
+	assert delta['prepend']['PATH'] == [f'{oneapi}/compiler/bin']
+	# 原来没有设置的路径变量也按前置处理
+	assert delta['prepend']['LD_LIBRARY_PATH'] == [f'{oneapi}/compiler/lib']
+	# 已加载过的标记不影响重新捕获
+	assert delta['set']['SETVARS_COMPLETED'] == '1'
+	assert 'PWD' not in delta['set'] and 'SHLVL' not in delta['set']
+
+	env = wai.apply_env_delta({'PATH': '/usr/bin', 'LD_LIBRARY_PATH': '/opt/lib'}, delta)
+	assert env['PATH'] == f'{oneapi}/compiler/bin:/usr/bin'
+	assert env['LD_LIBRARY_PATH'] == f'{oneapi}/compiler/lib:/opt/lib'
+
+
+def test_capture_env_delta_failure_raises(tmp_path):
+	script = tmp_path / 'setvars.sh'
+	script.write_text('return 3\n')
+	with pytest.raises(RuntimeError):
+		wai.capture_env_delta(str(script))
+
+
+def test_toolchain_delta_cache_reused_and_invalidated(oneapi, monkeypatch):
+	setvars = os.path.join(oneapi, 'setvars.sh')
+	first = wai.load_toolchain_delta(setvars)
+	assert _calls(oneapi) == 1
+	# 同一进程内直接返回，新进程从磁盘缓存读取，都不再 source
+	assert wai.load_toolchain_delta(setvars) is first
+	monkeypatch.setattr(wai, '_DELTA_MEMO', {})
+	assert wai.load_toolchain_delta(setvars) == first
+	assert _calls(oneapi) == 1
+
+	# 修改 setvars.sh 后重新 source
+	_write_setvars(oneapi, 'export MKLROOT=/opt/mkl\n')
+	changed = wai.load_toolchain_delta(setvars)
+	assert _calls(oneapi) == 2
+	assert changed['set']['MKLROOT'] == '/opt/mkl'
+
+	# oneAPI 目录下新增组件同样使缓存失效
+	os.makedirs(os.path.join(oneapi, 'mpi'))
+	wai.load_toolchain_delta(setvars)
+	assert _calls(oneapi) == 3
+	assert len(os.listdir(wai.Common.toolchain_cache_dir)) == 3
+
+
+def test_missing_setvars_gives_empty_delta(tmp_path):
+	assert wai.load_toolchain_delta(str(tmp_path / 'setvars.sh')) == {'set': {}, 'prepend': {}}
+
+
+def test_generate_env_reproduces_build_env(oneapi, tmp_path):
+	install_dir = str(tmp_path / 'install')
+	os.makedirs(install_dir)
+	delta = wai.load_toolchain_delta(os.path.join(oneapi, 'setvars.sh'))
+	wai.generate_env(delta, install_dir)
+	script = f'source {install_dir}/env_set.sh; echo "$PATH"; echo "${{LD_LIBRARY_PATH-}}"; echo "$WRF_BASE"'
+	env = {'PATH': '/usr/bin:/bin'}
+	lines = subprocess.run(['bash', '-c', script], env=env, capture_output=True, text=True, check=True).stdout.splitlines()
+	expected = wai.apply_env_delta(env, delta)
+	assert lines == [expected['PATH'], expected['LD_LIBRARY_PATH'], install_dir]
@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+
+import wrf_auto_install as wai
+
+
+CONFIGURE_WRF = """\
+# configure.wrf
+#FCOPTIM = -O2
+FCOPTIM         =       -O3
+
+# optimization for reduced-precision files
+FCREDUCEDOPT	=       $(FCOPTIM)
+FCNOOPT		=       -O0 -fno-inline -no-ip
+FCBASEOPTS      =       -w -ftz -fno-alias -align all $(FORMAT_FREE) $(BYTESWAPIO)
+CFLAGS_LOCAL    =       -w -O3 -ip #-xHost -fp-model fast=2 -no-prec-div -no-prec-sqrt -ftz -no-multiple-processes
+LDFLAGS_LOCAL   =       -ip #-xHost -fp-model fast=2 -no-prec-div -no-prec-sqrt -ftz -align all -fno-alias -fno-common
+CFLAGS          =    $(CFLAGS_LOCAL) -DDM_PARALLEL
+"""
+
+
+def test_apply_wrf_flags_rewrites_only_optimization_lines(tmp_path):
+	path = tmp_path / 'configure.wrf'
+	path.write_text(CONFIGURE_WRF)
+	wai.apply_wrf_flags(str(path), ['-xCORE-AVX2', '-ipo'])
+	expected = CONFIGURE_WRF.replace(
+		"FCOPTIM         =       -O3\n", "FCOPTIM         =       -O3 -xCORE-AVX2 -ipo\n").replace(
+		"CFLAGS_LOCAL    =       -w -O3 -ip #-xHost", "CFLAGS_LOCAL    =       -w -O3 -ip -xCORE-AVX2 -ipo #-xHost").replace(
+		"LDFLAGS_LOCAL   =       -ip #-xHost", "LDFLAGS_LOCAL   =       -ip -xCORE-AVX2 -ipo #-xHost")
+	assert path.read_text() == expected
+
+
+def test_apply_wrf_flags_without_flags_leaves_file_alone(tmp_path):
+	path = tmp_path / 'configure.wrf'
+	path.write_text(CONFIGURE_WRF)
+	wai.apply_wrf_flags(str(path), [])
+	assert path.read_text() == CONFIGURE_WRF
+
+
+def test_apply_wrf_flags_warns_about_missing_lines(tmp_path, caplog):
+	path = tmp_path / 'configure.wrf'
+	path.write_text("FCOPTIM = -O3\n")
+	with caplog.at_level(logging.INFO):
+		wai.apply_wrf_flags(str(path), ['-xAVX'])
+	assert path.read_text() == "FCOPTIM = -O3 -xAVX\n"
+	assert 'CFLAGS_LOCAL not found' in caplog.text
+	assert 'LDFLAGS_LOCAL not found' in caplog.text
+
+
+def test_build_variants_tags_and_flags(monkeypatch):
+	variants = wai.build_variants(['dmpar', 'dm+sm', 'dmpar'], isa='avx512', ipo=True)
+	assert [variant['tag'] for variant in variants] == ['dmpar-avx512-ipo', 'dmsm-avx512-ipo']
+	assert variants[0]['flags'] == ['-xCORE-AVX512', '-ipo']
+	assert variants[0]['wrf_input'] == '15 1\n'
+	assert variants[1]['wps_input'] == '19 \n'
+
+	serial = wai.build_variants(['serial'], isa='none')
+	assert serial[0]['tag'] == 'serial' and serial[0]['flags'] == [] and serial[0]['isa'] is None
+	assert serial[0]['wps_input'] == '17 \n'
+
+
+@pytest.mark.parametrize('cpu_flags, isa', [
+	('fpu sse2 avx avx2 avx512f', 'avx512'),
+	('fpu sse2 avx avx2', 'avx2'),
+	('fpu sse2', None),
+])
+def test_build_variants_detects_isa(tmp_path, monkeypatch, cpu_flags, isa):
+	cpuinfo = tmp_path / 'cpuinfo'
+	cpuinfo.write_text(f"processor\t: 0\nflags\t\t: {cpu_flags}\n")
+	assert wai.detect_isa(str(cpuinfo)) == isa
+	monkeypatch.setattr(wai, 'detect_isa', lambda: isa)
+	variant = wai.build_variants(['dmpar'], isa='auto')[0]
+	assert variant['isa'] == isa
+	assert variant['flags'] == ([wai.Common.isa_flags[isa]] if isa else [])
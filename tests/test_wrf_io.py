@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+
+import pytest
+
+import wrf_auto_install as wai
+from conf.common import Common
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+	monkeypatch.setattr(Common, 'wrf_io_stable_secs', 0.2)
+	monkeypatch.setattr(Common, 'wrf_io_poll_interval', 0.05)
+
+
+def _write_libs(wrf_src, mtime=None):
+	for path in Common.wrf_io_libs:
+		path = os.path.join(wrf_src, path)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'wb') as f:
+			f.write(b'lib')
+		if mtime is not None:
+			os.utime(path, (mtime, mtime))
+
+
+def _start_waiter(wrf_src, finished, not_before):
+	result = []
+	thread = threading.Thread(target=lambda: result.append(wai.wait_for_wrf_io(str(wrf_src), finished, not_before)))
+	thread.start()
+	return thread, result
+
+
+def test_stale_libraries_from_a_previous_build_are_not_accepted(tmp_path):
+	_write_libs(str(tmp_path), mtime=time.time() - 3600)
+	finished = threading.Event()
+	thread, result = _start_waiter(tmp_path, finished, time.time())
+	thread.join(1)
+	assert thread.is_alive() and result == []
+	# WRF 编译结束时库仍是旧的
+	finished.set()
+	thread.join(5)
+	assert result == [False]
+
+
+def test_libraries_rebuilt_after_the_start_are_accepted(tmp_path):
+	_write_libs(str(tmp_path), mtime=time.time() - 3600)
+	finished = threading.Event()
+	thread, result = _start_waiter(tmp_path, finished, time.time())
+	time.sleep(0.2)
+	_write_libs(str(tmp_path))
+	thread.join(5)
+	assert result == [True]
+	assert not finished.is_set()
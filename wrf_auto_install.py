@@ -10,10 +10,26 @@ import os
 import sys
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+from urllib.parse import urlsplit
 import tarfile
+import tempfile
 import argparse
-from collections import defaultdict
+import re
+import shlex
+from collections import deque
+import io
+import struct
+import fcntl
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from conf.common import Common
+import compiler_cache
 import tarfile
 import zipfile
 import gzip
@@ -54,43 +70,828 @@ def check_version(WRF_VERSION, compat_map):
 	except KeyError:
 		logging.error(f"错误代码100, {WRF_VERSION} is not a valid WRF version")
 		sys.exit(100)
+class BuildProfiler(object):
+	"""
+	记录安装过程中每个阶段的耗时和资源使用，生成 JSON 报告和 Chrome trace 时间线。
+
+	每个阶段记录墙钟时间、本线程 CPU 时间、子进程 CPU 时间和峰值内存（来自 wait4）、
+	下载字节数和解压字节数。计数记到当前线程最内层的阶段上，阶段结束时累加到同一线程的外层阶段。
+	"""
+
+	COUNTERS = ('cpu_children', 'max_rss_kb', 'bytes_downloaded', 'bytes_extracted')
+
+	def __init__(self):
+		self.started = time.time()
+		self.events = []
+		self.totals = dict.fromkeys(self.COUNTERS, 0)
+		self._local = threading.local()
+		self._lock = threading.Lock()
+
+	def _stack(self):
+		if not hasattr(self._local, 'stack'):
+			self._local.stack = []
+		return self._local.stack
+
+	@contextmanager
+	def stage(self, name, category='stage'):
+		"""记录一个阶段，可以嵌套"""
+		event = dict.fromkeys(self.COUNTERS, 0)
+		event.update(name=name, cat=category, tid=threading.get_ident(),
+					 thread=threading.current_thread().name, start=time.time())
+		cpu_start = time.thread_time()
+		stack = self._stack()
+		stack.append(event)
+		try:
+			yield event
+		finally:
+			stack.pop()
+			event['end'] = time.time()
+			event['wall'] = event['end'] - event['start']
+			event['cpu_self'] = time.thread_time() - cpu_start
+			if stack:
+				parent = stack[-1]
+				for key in ('cpu_children', 'bytes_downloaded', 'bytes_extracted'):
+					parent[key] += event[key]
+				parent['max_rss_kb'] = max(parent['max_rss_kb'], event['max_rss_kb'])
+			with self._lock:
+				self.events.append(event)
+
+	def add(self, counter, value):
+		"""累加计数到当前阶段和总计"""
+		stack = self._stack()
+		if stack:
+			stack[-1][counter] += value
+		with self._lock:
+			self.totals[counter] += value
+
+	def add_child_usage(self, rusage):
+		"""记录一个已结束子进程的资源使用"""
+		cpu = rusage.ru_utime + rusage.ru_stime
+		stack = self._stack()
+		if stack:
+			stack[-1]['cpu_children'] += cpu
+			stack[-1]['max_rss_kb'] = max(stack[-1]['max_rss_kb'], rusage.ru_maxrss)
+		with self._lock:
+			self.totals['cpu_children'] += cpu
+			self.totals['max_rss_kb'] = max(self.totals['max_rss_kb'], rusage.ru_maxrss)
+
+	def stage_times(self, categories):
+		"""返回指定类别中已结束阶段的墙钟时间，同名阶段取最后一次"""
+		with self._lock:
+			return {event['name']: event['wall'] for event in self.events if event['cat'] in categories}
+
+	def write(self, log_dir):
+		"""在 log_dir 下写出 profile.json 和 Chrome trace 格式的 trace.json"""
+		os.makedirs(log_dir, exist_ok=True)
+		finished = time.time()
+		with self._lock:
+			events = sorted(self.events, key=lambda e: e['start'])
+			totals = dict(self.totals)
+		report = {
+			'started': self.started,
+			'finished': finished,
+			'wall': finished - self.started,
+			'totals': totals,
+			'stages': events,
+		}
+		with open(os.path.join(log_dir, 'profile.json'), 'w') as f:
+			json.dump(report, f, indent=2)
+
+		pid = os.getpid()
+		trace = []
+		threads = {}
+		for event in events:
+			threads.setdefault(event['tid'], event['thread'])
+			trace.append({
+				'name': event['name'],
+				'cat': event['cat'],
+				'ph': 'X',
+				'ts': int((event['start'] - self.started) * 1e6),
+				'dur': int(event['wall'] * 1e6),
+				'pid': pid,
+				'tid': event['tid'],
+				'args': {key: event[key] for key in self.COUNTERS + ('cpu_self',)},
+			})
+		for tid, thread_name in threads.items():
+			trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+		with open(os.path.join(log_dir, 'trace.json'), 'w') as f:
+			json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+		logging.info(f"Profile written to {os.path.join(log_dir, 'profile.json')} and {os.path.join(log_dir, 'trace.json')}")
+
+
+# 全局性能记录
+PROFILER = BuildProfiler()
+
+
+# 每个主机一个复用连接池的会话
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+# 镜像配置：主机名 -> 镜像地址前缀列表，来自 url_config.ini 的 [mirrors] 段
+MIRROR_MAP = {}
+
+
+def get_session(url):
+	"""获取 url 所在主机的会话，同一主机的下载复用连接"""
+	host = urlsplit(url).netloc
+	with _SESSIONS_LOCK:
+		session = _SESSIONS.get(host)
+		if session is None:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=4, pool_maxsize=Common.download_segments * 2)
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+			_SESSIONS[host] = session
+		return session
+
+
+def mirror_urls(url, mirrors):
+	"""
+	返回原始地址及其所有镜像地址。
+
+	参数:
+	- url: 原始下载地址
+	- mirrors: 主机名 -> 镜像地址前缀列表
+
+	返回:
+	- list: 按尝试顺序排列的地址
+	"""
+	parts = urlsplit(url)
+	origin = f"{parts.scheme}://{parts.netloc}"
+	urls = [url]
+	for prefix in mirrors.get(parts.netloc, []):
+		urls.append(prefix.rstrip('/') + url[len(origin):])
+	return urls
+
+
+def _content_total(response):
+	"""从响应头中得到文件总大小，未知时返回 None"""
+	content_range = response.headers.get('Content-Range', '')
+	if '/' in content_range and not content_range.endswith('/*'):
+		return int(content_range.rsplit('/', 1)[1])
+	if response.status_code == 200 and response.headers.get('Content-Length'):
+		return int(response.headers['Content-Length'])
+	return None
+
+
+def _write_response(response, path, append):
+	"""
+	把响应体原样（不做内容解码）写入文件，返回写入的字节数。
+	传输中途断开时 urllib3 抛出的异常转换为 IOError，已写入的部分保留用于续传。
+	"""
+	written = 0
+	with open(path, 'ab' if append else 'wb') as f:
+		try:
+			for chunk in response.raw.stream(Common.download_chunk_size, decode_content=False):
+				f.write(chunk)
+				written += len(chunk)
+		except Urllib3Error as e:
+			PROFILER.add('bytes_downloaded', written)
+			raise IOError(f"connection dropped after {written} bytes: {e}") from e
+	return written
+
+
+def _download_stream(session, url, part):
+	"""单连接下载到临时文件，临时文件已存在时用 Range 请求续传"""
+	offset = os.path.getsize(part) if os.path.exists(part) else 0
+	headers = {'Range': f'bytes={offset}-'} if offset else {}
+	with session.get(url, headers=headers, stream=True, timeout=Common.download_timeout) as response:
+		if response.status_code == 416 and offset:
+			# 临时文件已完整或比远端文件更大
+			if _content_total(response) == offset:
+				return
+			os.remove(part)
+			raise IOError(f"stale partial file {part} removed")
+		response.raise_for_status()
+		if response.status_code != 206:
+			# 服务器不支持续传，从头开始
+			offset = 0
+		total = _content_total(response)
+		PROFILER.add('bytes_downloaded', _write_response(response, part, append=offset > 0))
+	if total is not None and os.path.getsize(part) != total:
+		raise IOError(f"incomplete download: {os.path.getsize(part)} of {total} bytes")
+
+
+def _download_segmented(session, url, part, size):
+	"""把大文件切成多个字节区间并行下载，每段单独续传，最后合并为临时文件"""
+	step = -(-size // Common.download_segments)
+	ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+	def fetch_range(byte_range):
+		start, end = byte_range
+		written = 0
+		seg_path = f"{part}.{start}-{end}"
+		done = os.path.getsize(seg_path) if os.path.exists(seg_path) else 0
+		if done > end - start + 1:
+			done = 0
+		if start + done <= end:
+			headers = {'Range': f'bytes={start + done}-{end}'}
+			with session.get(url, headers=headers, stream=True, timeout=Common.download_timeout) as response:
+				response.raise_for_status()
+				if response.status_code != 206:
+					raise IOError(f"server ignored range request for {url}")
+				written = _write_response(response, seg_path, append=done > 0)
+		if os.path.getsize(seg_path) != end - start + 1:
+			raise IOError(f"incomplete segment {seg_path}")
+		return seg_path, written
+
+	with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+		results = list(executor.map(fetch_range, ranges))
+	PROFILER.add('bytes_downloaded', sum(written for _, written in results))
+	seg_paths = [seg_path for seg_path, _ in results]
+	with open(part, 'wb') as out:
+		for seg_path in seg_paths:
+			with open(seg_path, 'rb') as f:
+				shutil.copyfileobj(f, out, Common.download_chunk_size)
+	for seg_path in seg_paths:
+		os.remove(seg_path)
+
+
+def _download_once(url, dest):
+	"""从单个地址下载到 dest.part，完成后原子重命名为 dest"""
+	session = get_session(url)
+	part = dest + '.part'
+	size = None
+	ranged = False
+	head = session.head(url, allow_redirects=True, timeout=Common.download_timeout)
+	if head.ok:
+		size = int(head.headers.get('Content-Length') or 0) or None
+		ranged = head.headers.get('Accept-Ranges', '').lower() == 'bytes'
+		url = head.url
+	if ranged and size and size >= Common.segment_min_size and Common.download_segments > 1 and not os.path.exists(part):
+		_download_segmented(session, url, part, size)
+	else:
+		_download_stream(session, url, part)
+	os.replace(part, dest)
+
+
+def _is_permanent_error(error):
+	"""4xx（除超时和限流外）说明该地址本身不可用，不必重试"""
+	response = getattr(error, 'response', None)
+	if not isinstance(error, requests.HTTPError) or response is None:
+		return False
+	return 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
 # 下载组件
-def download_file_with_wget(url, dest):
+def download_file(url, dest, mirrors=None):
+	"""
+	下载文件到 dest。复用每个主机的连接，支持断点续传和大文件分段并行下载，
+	先写入 dest.part 再原子重命名，原始地址失败时依次尝试镜像地址。
+	临时错误按指数退避重试，4xx 错误直接切换到下一个镜像。
+
+	参数:
+	- url: 下载地址
+	- dest: 保存路径
+	- mirrors: 主机名 -> 镜像地址前缀列表，默认使用 MIRROR_MAP
+	"""
+	mirrors = MIRROR_MAP if mirrors is None else mirrors
+	os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+	for candidate in mirror_urls(url, mirrors):
+		for attempt in range(1, Common.download_retries + 1):
+			try:
+				_download_once(candidate, dest)
+				logging.info(f"Downloaded successfully: {dest}")
+				return
+			except (requests.RequestException, Urllib3Error, OSError) as e:
+				logging.info(f"Error: Download failed - {candidate} (attempt {attempt}) | {e}")
+				if _is_permanent_error(e):
+					# 4xx 重试也不会成功，直接换下一个镜像
+					break
+				if attempt < Common.download_retries:
+					time.sleep(Common.download_backoff * 2 ** (attempt - 1))
+	logging.info(f"Error: Download failed - {url}")
+	sys.exit(1)
+
+
+class ArtifactCache(object):
+	"""
+	主机级别的内容寻址下载缓存，供所有安装目录共享。
+
+	文件按 SHA-256 保存在 objects/ 下，index.json 记录 url -> sha256、大小和最近使用时间，
+	总大小超过上限时按最近最少使用淘汰。离线模式下只从缓存取文件，从不访问网络。
+
+	参数:
+	- root: 缓存目录
+	- max_size: 缓存大小上限（字节）
+	- offline: 是否离线模式
+	"""
+
+	def __init__(self, root, max_size, offline=False):
+		self.root = root
+		self.max_size = max_size
+		self.offline = offline
+		self.objects_dir = os.path.join(root, 'objects')
+		self.tmp_dir = os.path.join(root, 'tmp')
+		self.index_path = os.path.join(root, 'index.json')
+		self._lock = threading.Lock()
+		os.makedirs(self.objects_dir, exist_ok=True)
+		os.makedirs(self.tmp_dir, exist_ok=True)
+
+	@contextmanager
+	def _index(self):
+		"""加锁读取索引（线程锁 + 文件锁，可跨进程共享），退出时写回"""
+		with self._lock, open(os.path.join(self.root, 'index.lock'), 'a') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			index = {}
+			if os.path.exists(self.index_path):
+				with open(self.index_path, 'r') as f:
+					index = json.load(f)
+			yield index
+			tmp_path = f"{self.index_path}.{os.getpid()}"
+			with open(tmp_path, 'w') as f:
+				json.dump(index, f, indent=1)
+			os.replace(tmp_path, self.index_path)
+
+	def known_digest(self, url):
+		"""缓存中 url 对应文件的 SHA-256，没有缓存时返回 None"""
+		with self._index() as index:
+			entry = index.get(url)
+		return entry['sha256'] if entry else None
+
+	def object_path(self, sha256):
+		return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+	def lookup(self, url, sha256=None):
+		"""返回缓存中 url 对应的文件路径，不存在、校验值不符或大小不对时返回 None"""
+		with self._index() as index:
+			entry = index.get(url)
+			if entry is None or (sha256 and entry['sha256'] != sha256):
+				return None
+			path = self.object_path(entry['sha256'])
+			if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+				del index[url]
+				return None
+			entry['last_used'] = time.time()
+			return path
+
+	def store(self, url, sha256=None):
+		"""下载 url 并校验后存入缓存，返回缓存文件路径"""
+		key = hashlib.sha1(url.encode()).hexdigest()
+		tmp_path = os.path.join(self.tmp_dir, key)
+		# 同一地址在多个进程中只下载一次
+		with open(tmp_path + '.lock', 'a') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			cached = self.lookup(url, sha256)
+			if cached:
+				return cached
+			download_file(url, tmp_path)
+			digest = file_sha256(tmp_path)
+			if sha256 and digest != sha256:
+				os.remove(tmp_path)
+				raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+			path = self.object_path(digest)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			os.replace(tmp_path, path)
+		with self._index() as index:
+			index[url] = {'sha256': digest, 'size': os.path.getsize(path), 'last_used': time.time()}
+			self._evict(index, keep=digest)
+		logging.info(f"Cached {url} as {digest}")
+		return path
+
+	def _evict(self, index, keep):
+		"""总大小超过上限时，按最近使用时间从旧到新删除对象"""
+		objects = {}
+		for url, entry in index.items():
+			last = objects.get(entry['sha256'], (0, 0, []))
+			objects[entry['sha256']] = (max(last[0], entry['last_used']), entry['size'], last[2] + [url])
+		total = sum(size for _, size, _ in objects.values())
+		for digest, (_, size, urls) in sorted(objects.items(), key=lambda item: item[1][0]):
+			if total <= self.max_size:
+				break
+			if digest == keep:
+				continue
+			logging.info(f"Evict cached {', '.join(urls)}")
+			for url in urls:
+				del index[url]
+			if os.path.exists(self.object_path(digest)):
+				os.remove(self.object_path(digest))
+			total -= size
+
+	def fetch(self, url, dest, sha256=None):
+		"""从缓存取得 url 对应文件放到 dest（优先硬链接），缓存未命中时下载"""
+		path = self.lookup(url, sha256)
+		if path is None:
+			if self.offline:
+				raise RuntimeError(f"Offline mode: {url} is not in cache {self.root}")
+			path = self.store(url, sha256)
+		else:
+			logging.info(f"Cache hit: {url}")
+		link_or_copy(path, dest)
+
+
+def file_sha256(path):
+	"""计算文件的 SHA-256"""
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(Common.download_chunk_size), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def link_or_copy(src, dest):
+	"""把 src 硬链接到 dest，跨文件系统时复制"""
+	os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+	tmp_dest = f"{dest}.{os.getpid()}.{threading.get_ident()}"
 	try:
-		subprocess.run(["wget", url, "-O", dest], check=True)
-		logging.info(f"Downloaded successfully: {dest}")
-	except subprocess.CalledProcessError as e:
-		logging.info(f"Error: Download failed - {url} | {e}")
-		sys.exit(1)
+		os.link(src, tmp_dest)
+	except OSError:
+		shutil.copyfile(src, tmp_dest)
+	os.replace(tmp_dest, dest)
 
 
-def extract_file(src_path, dest_dir):
-	"""自动检测并解压文件到指定目录"""
-	# 记录原始目录内容用于后续清理
-	original_files = set(os.listdir(dest_dir))
+# 预取下载任务：目标文件路径 -> Future
+PREFETCH_FUTURES = {}
+# 下载缓存，未启用时为 None
+ARTIFACT_CACHE = None
+# 下载地址 -> 期望的 SHA-256，来自 url_config.ini 的 [checksums] 段
+ARTIFACT_CHECKSUMS = {}
 
-	# 尝试用不同tar格式解压
-	tar_formats = ['r:gz', 'r:bz2', 'r:xz', 'r']
-	for fmt in tar_formats:
-		try:
-			with tarfile.open(src_path, fmt) as tar:
-				tar.extractall(dest_dir)
-				return True
-		except tarfile.TarError:
+
+def dependency_archive(install_dir, dep, version):
+	"""依赖源码包的本地保存路径"""
+	return os.path.join(install_dir, "src", f"{dep}-{version}.tar.gz")
+
+
+def collect_downloads(URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP, name_map, compat_map, intel_file_path, install_dir, wrf_version, wps_version, variants, done_stages=()):
+	"""
+	预先解析本次安装需要下载的全部文件，按使用先后排序，已完成的阶段不再下载。
+
+	返回:
+	- list: (url, 目标路径, 版本键) 列表，版本键形如 name:version，用于查找校验值
+	"""
+	downloads = []
+	# 编译器已安装时不需要安装包
+	if 'compiler' not in done_stages and not os.path.exists(os.path.join(install_dir, 'compiler', 'setvars.sh')):
+		for key in ['intel-base', 'intel-hpc']:
+			if key in URL_COMP_MAP and key in name_map:
+				downloads.append((URL_COMP_MAP[key], os.path.join(intel_file_path, name_map[key]), f"{key}:{compat_map.get(key)}"))
+	for dep in dep_list:
+		if dep in done_stages:
+			continue
+		if dep in compat_map and URL_DEP_MAP.get(dep):
+			version = compat_map[dep]
+			downloads.append((URL_DEP_MAP[dep].replace("%v", version), dependency_archive(install_dir, dep, version), f"{dep}:{version}"))
+	# 任何一个需要编译的 WRF 变体还没有源码目录时才需要下载 WRF
+	wrf_needed = any(wrf_stage(variant) not in done_stages and not os.path.isdir(wrf_source_dir(install_dir, wrf_version, variant))
+					 for variant in variants)
+	wps_needed = 'wps' not in done_stages and not os.path.isdir(os.path.join(install_dir, "src", f"WPS-{wps_version}"))
+	for key, tar_name, version, needed in [('wrf', 'WRF.tar.gz', wrf_version, wrf_needed), ('wps', 'WPS.tar.gz', wps_version, wps_needed)]:
+		if key in URL_WRF_MAP and needed:
+			downloads.append((URL_WRF_MAP[key], os.path.join(install_dir, "src", tar_name), f"{key}:{version}"))
+	return downloads
+
+
+def prefetch_downloads(downloads, workers):
+	"""
+	在后台线程池中并发下载所有文件，与编译器安装和依赖编译过程重叠进行。
+
+	参数:
+	- downloads: (url, 目标路径, 版本键) 列表
+	- workers: 并发下载数
+
+	返回:
+	- ThreadPoolExecutor: 下载线程池，出错时可用于取消剩余任务
+	"""
+	executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='prefetch')
+	for url, dest, _ in downloads:
+		if dest in PREFETCH_FUTURES or (ARTIFACT_CACHE is None and os.path.exists(dest)):
 			continue
+		logging.info(f"Prefetch: {url}")
+		PREFETCH_FUTURES[dest] = executor.submit(fetch_artifact, url, dest)
+	executor.shutdown(wait=False)
+	return executor
+
+
+def fetch_artifact(url, dest):
+	"""通过下载缓存（启用时）获取文件"""
+	with PROFILER.stage(f"download {os.path.basename(dest)}", 'download'):
+		if ARTIFACT_CACHE is not None:
+			ARTIFACT_CACHE.fetch(url, dest, ARTIFACT_CHECKSUMS.get(url))
+		else:
+			download_file(url, dest)
+
+
+def fetch_file(url, dest):
+	"""获取文件：已在预取中则等待其完成，否则同步获取；启用缓存时总是经过缓存校验"""
+	future = PREFETCH_FUTURES.get(dest)
+	if future is not None:
+		future.result()
+	elif ARTIFACT_CACHE is not None or not os.path.exists(dest):
+		fetch_artifact(url, dest)
+
+
+# 压缩/归档格式的文件头魔数
+ARCHIVE_MAGIC = [
+	(b'\x1f\x8b', 'gz'),
+	(b'BZh', 'bz2'),
+	(b'\xfd7zXZ\x00', 'xz'),
+	(b'PK\x03\x04', 'zip'),
+]
+# 支持 extraction filter 的 Python 中使用 tar 过滤规则（拒绝绝对路径和目录外路径）
+TAR_EXTRACT_KWARGS = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+
+class _PrefixedReader(object):
+	"""把已读出的文件头重新拼回数据流前面，使流式读取不需要回退"""
+
+	def __init__(self, prefix, fileobj):
+		self.prefix = prefix
+		self.fileobj = fileobj
+
+	def read(self, size=-1):
+		if not self.prefix:
+			return self.fileobj.read(size)
+		if size is None or size < 0:
+			data, self.prefix = self.prefix + self.fileobj.read(), b''
+			return data
+		data, self.prefix = self.prefix[:size], self.prefix[size:]
+		if len(data) < size:
+			data += self.fileobj.read(size - len(data))
+		return data
+
 
-	# 尝试解压ZIP
+def detect_archive_format(header):
+	"""
+	根据文件头判断格式。
+
+	参数:
+	- header: 文件开头的字节（至少 512 字节才能识别未压缩的 tar）
+
+	返回:
+	- str: 'gz'、'bz2'、'xz'、'zip'、'tar' 之一，无法识别时返回 None
+	"""
+	for magic, fmt in ARCHIVE_MAGIC:
+		if header.startswith(magic):
+			return fmt
+	if header[257:262] == b'ustar':
+		return 'tar'
+	return None
+
+
+def _read_header(fileobj, size=512):
+	header = b''
+	while len(header) < size:
+		chunk = fileobj.read(size - len(header))
+		if not chunk:
+			break
+		header += chunk
+	return header
+
+
+def _split_member_path(name):
+	return [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+
+
+class _TopLevelStripper(object):
+	"""
+	解压时去掉唯一的顶层目录（等价于解压后把该目录的内容移到目标目录），源码包解压后不需要再整理目录结构。
+	遇到不在该顶层目录下的条目时，把已解压的内容移回顶层目录并停止剥离。
+	"""
+
+	def __init__(self, dest_dir, enabled, before_restore=None):
+		self.dest_dir = dest_dir
+		self.enabled = enabled
+		self.prefix = None
+		self.written = set()
+		# 撤销剥离前的回调（并发解压时用于等待未完成的写入）
+		self.before_restore = before_restore
+
+	def rename(self, parts, is_dir):
+		"""返回条目在目标目录中的相对路径部件，返回 None 表示跳过该条目"""
+		if self.enabled:
+			if self.prefix is None and (len(parts) > 1 or is_dir):
+				self.prefix = parts[0]
+			if parts and parts[0] == self.prefix:
+				if len(parts) == 1:
+					return None
+				self.written.add(parts[1])
+				return parts[1:]
+			self.restore()
+		return parts
+
+	def strip_link(self, linkname):
+		"""硬链接目标同样需要去掉顶层目录"""
+		parts = _split_member_path(linkname)
+		if self.enabled and parts and parts[0] == self.prefix:
+			return '/'.join(parts[1:])
+		return linkname
+
+	def restore(self):
+		"""顶层不止一个条目：撤销剥离"""
+		self.enabled = False
+		if self.prefix is None:
+			return
+		if self.before_restore is not None:
+			self.before_restore(self.prefix)
+		tmp_dir = os.path.join(self.dest_dir, f".{self.prefix}.unstrip")
+		os.makedirs(tmp_dir)
+		for name in self.written:
+			# 并发解压时链接延后创建，此时可能还不存在
+			if os.path.lexists(os.path.join(self.dest_dir, name)):
+				shutil.move(os.path.join(self.dest_dir, name), os.path.join(tmp_dir, name))
+		os.rename(tmp_dir, os.path.join(self.dest_dir, self.prefix))
+
+
+def _extract_tar_stream(fileobj, dest_dir, strip_top):
+	"""单遍流式解压 tar 数据流"""
+	stripper = _TopLevelStripper(dest_dir, strip_top)
+	with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+		for member in tar:
+			parts = stripper.rename(_split_member_path(member.name), member.isdir())
+			if not parts:
+				continue
+			member.name = '/'.join(parts)
+			if member.islnk():
+				member.linkname = stripper.strip_link(member.linkname)
+			tar.extract(member, dest_dir, **TAR_EXTRACT_KWARGS)
+			if member.isreg():
+				PROFILER.add('bytes_extracted', member.size)
+
+
+def _safe_member_parts(parts, name):
+	"""拒绝指向解压目录之外的条目"""
+	if '..' in parts or name.startswith('/'):
+		raise ValueError(f"Unsafe path in archive: {name}")
+	return parts
+
+
+def _write_member(path, data, mode, mtime):
+	with open(path, 'wb') as f:
+		f.write(data)
+	# 与 tar 过滤规则一致：去掉 setuid/setgid 位和组/其他用户写权限
+	os.chmod(path, mode & 0o755)
+	os.utime(path, (mtime, mtime))
+
+
+def _extract_tar_parallel(fileobj, dest_dir, strip_top, workers):
+	"""
+	单遍解压 tar 数据流，普通文件的写入按批交给线程池并发进行。
+
+	解压只在当前线程进行一次；目录条目和文件的上级目录在分发文件写入之前由当前线程依次创建（每个目录只创建一次），
+	写线程只负责创建和写入文件，每批最多 Common.extract_batch_files 个文件以减少调度开销。
+	链接在所有文件写完后再创建，目录的权限和修改时间最后设置（只读目录中的文件也能写入）。内存中待写入的数据量不超过 Common.extract_buffer_size，
+	超过该大小的单个文件直接在当前线程写入。
+	"""
+	made_dirs = {dest_dir}
+	dirs = []
+	links = []
+	futures = []
+	batch = []
+	pending = [0]
+	cond = threading.Condition()
+
+	def make_dirs(path):
+		if path not in made_dirs:
+			os.makedirs(path, exist_ok=True)
+			made_dirs.add(path)
+
+	def write_batch(members, size):
+		try:
+			for path, data, mode, mtime in members:
+				_write_member(path, data, mode, mtime)
+		finally:
+			with cond:
+				pending[0] -= size
+				cond.notify_all()
+
+	def flush():
+		if not batch:
+			return
+		size = sum(len(item[1]) for item in batch)
+		with cond:
+			while pending[0] and pending[0] + size > Common.extract_buffer_size:
+				cond.wait()
+			pending[0] += size
+		futures.append(pool.submit(write_batch, list(batch), size))
+		del batch[:]
+
+	def before_restore(prefix):
+		# 等待已分发的写入完成，已记录的链接改回带顶层目录的路径
+		flush()
+		for future in futures:
+			future.result()
+		made_dirs.clear()
+		made_dirs.add(dest_dir)
+		for member in dirs:
+			member.name = f"{prefix}/{member.name}"
+		for member in links:
+			member.name = f"{prefix}/{member.name}"
+			if member.islnk():
+				member.linkname = f"{prefix}/{member.linkname}"
+
+	stripper = _TopLevelStripper(dest_dir, strip_top, before_restore)
+	with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extract') as pool, \
+			tarfile.open(fileobj=fileobj, mode='r|') as tar:
+		for member in tar:
+			parts = stripper.rename(_split_member_path(member.name), member.isdir())
+			if not parts:
+				continue
+			_safe_member_parts(parts, member.name)
+			member.name = '/'.join(parts)
+			path = os.path.join(dest_dir, *parts)
+			if member.isdir():
+				make_dirs(path)
+				dirs.append(member)
+			elif member.isreg():
+				make_dirs(os.path.dirname(path))
+				data = tar.extractfile(member).read()
+				PROFILER.add('bytes_extracted', len(data))
+				if len(data) > Common.extract_buffer_size:
+					_write_member(path, data, member.mode, member.mtime)
+					continue
+				batch.append((path, data, member.mode, member.mtime))
+				if len(batch) >= Common.extract_batch_files:
+					flush()
+			else:
+				if member.islnk():
+					member.linkname = stripper.strip_link(member.linkname)
+				make_dirs(os.path.dirname(path))
+				links.append(member)
+		flush()
+		for future in futures:
+			future.result()
+		# 硬链接的目标此时都已写入，不需要回读数据流
+		for member in links:
+			tar.extract(member, dest_dir, **TAR_EXTRACT_KWARGS)
+	# 先设置深层目录，上层目录的修改时间不会再被改变
+	for member in sorted(dirs, key=lambda m: m.name, reverse=True):
+		path = os.path.join(dest_dir, member.name)
+		os.chmod(path, member.mode & 0o755)
+		os.utime(path, (member.mtime, member.mtime))
+
+
+def _extract_zip(fileobj, dest_dir, strip_top):
+	"""解压 zip（需要可随机访问的文件，数据流会先落到临时文件）"""
+	if not hasattr(fileobj, 'seek') or not fileobj.seekable():
+		spool = tempfile.TemporaryFile()
+		shutil.copyfileobj(fileobj, spool, Common.download_chunk_size)
+		spool.seek(0)
+		fileobj = spool
+	with zipfile.ZipFile(fileobj, 'r') as zipf:
+		infos = zipf.infolist()
+		tops = {_split_member_path(info.filename)[0] for info in infos if _split_member_path(info.filename)}
+		nested = all(len(_split_member_path(info.filename)) > 1 or info.is_dir() for info in infos)
+		strip = strip_top and len(tops) == 1 and nested
+		for info in infos:
+			parts = _split_member_path(info.filename)
+			if strip:
+				parts = parts[1:]
+			if not parts:
+				continue
+			info.filename = '/'.join(parts) + ('/' if info.is_dir() else '')
+			zipf.extract(info, dest_dir)
+			PROFILER.add('bytes_extracted', info.file_size)
+
+
+def extract_file(src_path, dest_dir, strip_top=False, workers=None):
+	"""
+	自动检测并解压文件到指定目录。
+
+	根据文件头魔数识别格式，每个压缩包只解压一遍；也可以直接传入下载数据流等可读对象。
+
+	参数:
+	- src_path: 压缩包路径或二进制可读对象
+	- dest_dir: 解压目标目录
+	- strip_top: 为 True 且目标目录为空时，压缩包中唯一的顶层目录在解压时直接去掉
+	- workers: tar 包的并发写文件线程数，默认 Common.extract_workers，1 表示单线程解压
+	"""
+	workers = Common.extract_workers if workers is None else workers
+	# 记录原始目录内容用于后续清理
+	original_files = set(os.listdir(dest_dir))
+	strip_top = strip_top and not original_files
+	is_path = isinstance(src_path, (str, bytes, os.PathLike))
+	fileobj = open(src_path, 'rb') if is_path else src_path
 	try:
-		with zipfile.ZipFile(src_path, 'r') as zipf:
-			zipf.extractall(dest_dir)
+		header = _read_header(fileobj)
+		fmt = detect_archive_format(header)
+		if fmt == 'zip':
+			if is_path:
+				fileobj.seek(0)
+			else:
+				fileobj = _PrefixedReader(header, fileobj)
+			_extract_zip(fileobj, dest_dir, strip_top)
+			return True
+		stream = _PrefixedReader(header, fileobj)
+		if fmt == 'gz':
+			stream = gzip.GzipFile(fileobj=stream, mode='rb')
+		elif fmt == 'bz2':
+			stream = bz2.BZ2File(stream, 'rb')
+		elif fmt == 'xz':
+			stream = lzma.LZMAFile(stream, 'rb')
+		elif fmt != 'tar':
+			raise ValueError(f"无法解压文件：不支持的文件格式 '{src_path}'")
+		# 解压后的数据再判断是否为 tar
+		inner_header = _read_header(stream)
+		stream = _PrefixedReader(inner_header, stream)
+		if detect_archive_format(inner_header) == 'tar':
+			if workers > 1:
+				_extract_tar_parallel(stream, dest_dir, strip_top, workers)
+			else:
+				_extract_tar_stream(stream, dest_dir, strip_top)
 			return True
-	except zipfile.BadZipFile:
-		pass
 
-	# 处理单独压缩文件
-	try:
-		# 获取基础文件名（不带路径）
-		base_name = os.path.basename(src_path)
+		# 处理单独压缩文件
+		base_name = os.path.basename(src_path) if is_path else 'data'
 		# 去除所有已知压缩扩展名
 		for ext in ['.gz', '.bz2', '.xz', '.zip',
 					'.tar.gz', '.tgz', '.tar.bz2',
@@ -98,232 +899,1492 @@ def extract_file(src_path, dest_dir):
 			if base_name.lower().endswith(ext):
 				base_name = base_name[:-len(ext)]
 				break
+		with open(os.path.join(dest_dir, base_name), 'wb') as f_out:
+			shutil.copyfileobj(stream, f_out, Common.download_chunk_size)
+			PROFILER.add('bytes_extracted', f_out.tell())
+		return True
+	except Exception:
+		# 解压失败，回滚并报错
+		new_files = set(os.listdir(dest_dir)) - original_files
+		for f in new_files:
+			f_path = os.path.join(dest_dir, f)
+			if os.path.isfile(f_path) or os.path.islink(f_path):
+				os.remove(f_path)
+			else:
+				shutil.rmtree(f_path)
+		raise
+	finally:
+		if is_path:
+			fileobj.close()
 
-		output_path = os.path.join(dest_dir, base_name)
 
-		# 尝试不同压缩格式
-		openers = [
-			(gzip.open, 'rb'),
-			(bz2.open, 'rb'),
-			(lzma.open, 'rb')
-		]
+class StageJournal(object):
+	"""
+	安装阶段日志，保存在安装目录下的 install_journal.json。
 
-		for opener, mode in openers:
+	记录每个已完成阶段（compiler、各依赖、各 WRF 变体、wps）的指纹，重复安装时指纹一致的阶段直接跳过，
+	从第一个缺失或过期的阶段继续。
+
+	参数:
+	- path: 日志文件路径
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self.stages = {}
+		if os.path.exists(path):
 			try:
-				with opener(src_path, mode) as f_in:
-					with open(output_path, 'wb') as f_out:
-						shutil.copyfileobj(f_in, f_out)
-				return True
-			except Exception:
-				continue
+				with open(path, 'r') as f:
+					self.stages = json.load(f).get('stages', {})
+			except ValueError:
+				logging.info(f"Error: Journal {path} is corrupted, ignore it.")
+
+	def is_done(self, stage, fingerprint):
+		entry = self.stages.get(stage)
+		return entry is not None and entry['fingerprint'] == fingerprint
+
+	def record(self, stage, fingerprint, **info):
+		"""记录阶段完成，立即写回磁盘"""
+		with self._lock:
+			self.stages[stage] = dict(info, fingerprint=fingerprint, finished=time.strftime('%Y-%m-%d %H:%M:%S'))
+			self._save()
+
+	def invalidate(self, stage):
+		with self._lock:
+			if self.stages.pop(stage, None) is not None:
+				self._save()
+
+	def _save(self):
+		tmp_path = f"{self.path}.tmp"
+		with open(tmp_path, 'w') as f:
+			json.dump({'stages': self.stages}, f, indent=2, sort_keys=True)
+		os.replace(tmp_path, self.path)
+
+
+def stage_fingerprint(stage, inputs, upstream):
+	"""
+	计算阶段指纹。
 
-	except Exception:
-		pass
+	参数:
+	- stage: 阶段名
+	- inputs: 影响该阶段结果的配置（版本、下载地址、编译参数等）
+	- upstream: 上游阶段的指纹列表
+
+	返回:
+	- str: SHA-256 十六进制字符串
+	"""
+	payload = json.dumps({'stage': stage, 'inputs': inputs, 'upstream': sorted(upstream)}, sort_keys=True)
+	return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def dependency_configure_args(dep, prefix, upstream_prefixes=()):
+	"""
+	依赖包 ./configure 的参数。
+
+	参数:
+	- dep: 包名
+	- prefix: 安装前缀
+	- upstream_prefixes: 所有上游依赖的安装前缀，用于头文件和库的搜索路径
+	"""
+	args = f"--prefix={prefix}"
+	# 库和程序带上自身及上游依赖的 RPATH，运行时不依赖 LD_LIBRARY_PATH
+	rpath = ' '.join(f"-Wl,-rpath,{path}/lib" for path in [prefix] + list(upstream_prefixes))
+	if upstream_prefixes:
+		cppflags = ' '.join(f"-I{up}/include" for up in upstream_prefixes)
+		ldflags = ' '.join(f"-L{up}/lib" for up in upstream_prefixes)
+		args += f' CPPFLAGS="{cppflags}" LDFLAGS="{ldflags} {rpath}"'
+	else:
+		args += f' LDFLAGS="{rpath}"'
+	if 'netcdf' in dep:
+		args += " --disable-dap"
+	elif 'hdf5' in dep:
+		args += " --enable-fortran"
+	return args
+
+
+def detect_isa(cpuinfo='/proc/cpuinfo'):
+	"""从 /proc/cpuinfo 的 CPU 特性中检测可用的最高指令集，返回 Common.isa_flags 中的键，无法识别时返回 None"""
+	try:
+		with open(cpuinfo) as f:
+			for line in f:
+				if line.startswith('flags'):
+					flags = set(line.split(':', 1)[1].split())
+					break
+			else:
+				return None
+	except OSError:
+		return None
+	for isa, cpu_flag in Common.isa_cpu_flags:
+		if cpu_flag in flags:
+			return isa
+	return None
+
+
+def build_variants(modes, isa='auto', ipo=False):
+	"""
+	生成 WRF 编译变体列表，第一个变体是主变体，WPS 以它为基础编译。
+
+	参数:
+	- modes: 并行方式列表，取值为 Common.wrf_variants 的键（serial、smpar、dmpar、dm+sm）
+	- isa: 指令集，'auto' 时按本机 CPU 检测，'none' 时不加指令集参数
+	- ipo: 是否启用过程间优化（-ipo）
 
-	# 如果所有方法都失败，回滚并报错
-	new_files = set(os.listdir(dest_dir)) - original_files
-	for f in new_files:
-		f_path = os.path.join(dest_dir, f)
-		if os.path.isfile(f_path):
-			os.remove(f_path)
+	返回:
+	- list: 变体 dict，包含 mode、tag、isa、flags、wrf_input、wps_input
+	"""
+	if isa == 'auto':
+		isa = detect_isa()
+		logging.info(f"Detected CPU instruction set: {isa or 'generic'}")
+	elif isa == 'none':
+		isa = None
+	flags = []
+	if isa:
+		flags.append(Common.isa_flags[isa])
+	if ipo:
+		flags.append('-ipo')
+	variants = []
+	for mode in dict.fromkeys(modes):
+		tag = '-'.join([mode.replace('+', '')] + ([isa] if isa else []) + (['ipo'] if ipo else []))
+		wps_mode = 'dmpar' if mode.startswith('dm') else 'serial'
+		variants.append({
+			'mode': mode,
+			'tag': tag,
+			'isa': isa,
+			'flags': flags,
+			'wrf_input': f"{Common.wrf_variants[mode]} {Common.wrf_nesting}\n",
+			'wps_input': f"{Common.wps_variants[wps_mode]} \n",
+		})
+	return variants
+
+
+def wrf_stage(variant):
+	"""变体对应的安装阶段名"""
+	return f"wrf:{variant['tag']}"
+
+
+def wrf_source_dir(install_dir, wrf_version, variant):
+	"""变体的 WRF 源码（编译）目录，不同变体并列存放"""
+	return os.path.join(install_dir, "src", f"WRF-{wrf_version}-{variant['tag']}")
+
+
+def apply_wrf_flags(configure_wrf, flags):
+	"""把变体的优化参数加到 configure.wrf 的 FCOPTIM、CFLAGS_LOCAL 和 LDFLAGS_LOCAL（-ipo 链接时也需要）"""
+	if not flags:
+		return
+	with open(configure_wrf) as f:
+		text = f.read()
+	extra = ' '.join(flags)
+	for name in ('FCOPTIM', 'CFLAGS_LOCAL', 'LDFLAGS_LOCAL'):
+		# 行尾注释之前追加参数，只匹配本行，不能把下一行的注释或空行并进来
+		text, count = re.subn(rf"^({name}[ \t]*=[^#\n]*?)[ \t]*(#.*)?$", lambda m: f"{m.group(1)} {extra}" + (f" {m.group(2)}" if m.group(2) else ''),
+							  text, count=1, flags=re.M)
+		if not count:
+			# 没有找到变量时编译出的 WRF 不带变体的指令集参数，需要提示
+			logging.info(f"Warning: {name} not found in {configure_wrf}, {extra} not applied to it")
+	with open(configure_wrf, 'w') as f:
+		f.write(text)
+	logging.info(f"Added {extra} to {configure_wrf}")
+
+
+def build_stage_graph(stages):
+	"""
+	阶段依赖关系：compiler -> 各依赖（按 Common.dep_graph）-> 各 WRF 变体（wrf:<变体>）-> wps。
+	WPS 依赖第一个（主）WRF 变体。
+
+	参数:
+	- stages: 本次安装包含的阶段名
+
+	返回:
+	- dict: 阶段名 -> 直接上游阶段列表
+	"""
+	wrf_stages = [stage for stage in stages if stage.startswith('wrf:')]
+	deps = [stage for stage in stages if stage not in ('compiler', 'wps') and stage not in wrf_stages]
+	graph = {}
+	for stage in stages:
+		if stage == 'compiler':
+			graph[stage] = []
+		elif stage in wrf_stages:
+			graph[stage] = ['compiler'] + deps
+		elif stage == 'wps':
+			graph[stage] = wrf_stages[:1]
 		else:
-			shutil.rmtree(f_path)
-	raise ValueError(f"无法解压文件：不支持的文件格式 '{src_path}'")
+			graph[stage] = ['compiler'] + [up for up in Common.dep_graph.get(stage, []) if up in deps]
+	return graph
 
 
-def normalize_extracted_dir(target_dir):
-	"""整理解压目录结构，避免嵌套"""
-	while True:
-		entries = os.listdir(target_dir)
-		# 如果只有一个目录且没有其他文件
-		if len(entries) == 1 and os.path.isdir(os.path.join(target_dir, entries[0])):
-			nested_dir = os.path.join(target_dir, entries[0])
-			# 移动嵌套目录内容到父目录
-			for item in os.listdir(nested_dir):
-				shutil.move(
-					os.path.join(nested_dir, item),
-					os.path.join(target_dir, item)
-				)
-			os.rmdir(nested_dir)
+def compute_stage_fingerprints(compat_map, URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP, compiler_type, wrf_version, wps_version, variants):
+	"""
+	根据配置计算所有阶段的指纹，上游阶段的指纹参与下游阶段指纹的计算，
+	因此任何一个阶段变化时，其所有下游阶段都会过期。
+
+	返回:
+	- dict: 阶段名 -> 指纹，按编译顺序排列
+	"""
+	inputs = {'compiler': {
+		'type': compiler_type,
+		'versions': {key: compat_map.get(key) for key in ['intel-base', 'intel-hpc']},
+		'urls': URL_COMP_MAP,
+		'env': Common.compiler_env,
+	}}
+	for dep in dep_list:
+		if dep not in compat_map or not URL_DEP_MAP.get(dep):
+			continue
+		inputs[dep] = {
+			'version': compat_map[dep],
+			'url': URL_DEP_MAP[dep].replace("%v", compat_map[dep]),
+			# 安装路径不参与指纹计算
+			'configure': dependency_configure_args(dep, '@PREFIX@', [f"@{up}@" for up in dependency_closure(dep, Common.dep_graph)]),
+		}
+	for variant in variants:
+		inputs[wrf_stage(variant)] = {
+			'version': wrf_version,
+			'url': URL_WRF_MAP.get('wrf'),
+			'configure': variant['wrf_input'],
+			'flags': variant['flags'],
+		}
+	inputs['wps'] = {
+		'version': wps_version,
+		'url': URL_WRF_MAP.get('wps'),
+		'configure': variants[0]['wps_input'],
+	}
+	graph = build_stage_graph(list(inputs))
+	fingerprints = {}
+	for stage in inputs:
+		fingerprints[stage] = stage_fingerprint(stage, inputs[stage], [fingerprints[up] for up in graph[stage]])
+	return fingerprints
+
+
+def plan_rebuild(fingerprints, journal, versions):
+	"""
+	计算需要重新编译的最小阶段集合：配置变化的阶段及其所有下游阶段。
+
+	参数:
+	- fingerprints: 阶段名 -> 当前指纹
+	- journal: StageJournal
+	- versions: 阶段名 -> 当前版本号
+
+	返回:
+	- list: (阶段名, 原因) 列表，按编译顺序排列
+	"""
+	graph = build_stage_graph(list(fingerprints))
+	plan = []
+	rebuilt = set()
+	for stage, fingerprint in fingerprints.items():
+		if journal.is_done(stage, fingerprint):
+			continue
+		changed_upstream = [up for up in graph[stage] if up in rebuilt]
+		entry = journal.stages.get(stage)
+		if entry is None:
+			reason = "not built"
+		elif changed_upstream:
+			reason = f"upstream changed: {', '.join(changed_upstream)}"
+		elif entry.get('version') and entry.get('version') != versions.get(stage):
+			reason = f"version {entry.get('version')} -> {versions.get(stage)}"
 		else:
-			break
+			reason = "build options changed"
+		plan.append((stage, reason))
+		rebuilt.add(stage)
+	return plan
+
+
+def show_plan(plan, fingerprints, estimates=None):
+	"""输出重新编译计划，estimates 为 estimate_plan 的结果时同时输出各阶段的估计耗时"""
+	logging.info(f"Rebuild plan: {len(plan)} of {len(fingerprints)} stages")
+	for stage, reason in plan:
+		if estimates is None:
+			logging.info(f"  {stage:<16} {reason}")
+		else:
+			logging.info(f"  {stage:<16} {format_duration(estimates[0][stage]):>8}  {reason}")
+	planned = {stage for stage, _ in plan}
+	up_to_date = [stage for stage in fingerprints if stage not in planned]
+	if up_to_date:
+		logging.info(f"Up to date: {', '.join(up_to_date)}")
+	if estimates is not None:
+		stage_estimates, total, unknown = estimates
+		if len(unknown) < len(stage_estimates):
+			logging.info(f"Estimated wall time: {format_duration(total)} (critical path, from previous runs on {os.uname().nodename})")
+		if unknown:
+			logging.info(f"No timing history for {', '.join(unknown)}, not included in the estimate")
+
+
+def format_duration(seconds):
+	"""把秒数格式化为 1h02m、5m30s 或 12s，None 显示为 ?"""
+	if seconds is None:
+		return '?'
+	seconds = int(round(seconds))
+	if seconds >= 3600:
+		return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+	if seconds >= 60:
+		return f"{seconds // 60}m{seconds % 60:02d}s"
+	return f"{seconds}s"
+
+
+def history_key(stage, version):
+	"""耗时历史中阶段的键：阶段名@版本"""
+	return f"{stage}@{version}" if version else stage
+
+
+def load_history(path):
+	"""读取本机的阶段耗时历史，返回 {阶段名@版本: [秒数, ...]}"""
+	if not os.path.exists(path):
+		return {}
+	try:
+		with open(path, 'r') as f:
+			return json.load(f).get(os.uname().nodename, {})
+	except ValueError:
+		logging.info(f"Error: Timing history {path} is corrupted, ignore it.")
+		return {}
+
+
+def record_history(path, times, journal, fingerprints, versions):
+	"""
+	把本次运行完成的阶段耗时追加到耗时历史（按主机区分，每个阶段保留最近 Common.history_samples 次）。
+
+	只记录已写入安装日志、指纹与本次一致的阶段；从包存储或二进制缓存取得的依赖不是编译耗时，不记录。
+
+	参数:
+	- path: 历史文件路径，多个安装可以同时写入
+	- times: 阶段名 -> 墙钟秒数（BuildProfiler.stage_times）
+	- journal: StageJournal
+	- fingerprints: 阶段名 -> 指纹
+	- versions: 阶段名 -> 版本号
+	"""
+	samples = {}
+	for stage, wall in times.items():
+		if stage not in fingerprints or not journal.is_done(stage, fingerprints[stage]):
+			continue
+		if journal.stages[stage].get('source', 'build') != 'build':
+			continue
+		samples[history_key(stage, versions.get(stage))] = round(wall, 1)
+	if not samples:
+		return
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(f"{path}.lock", 'a') as lock_file:
+		fcntl.flock(lock_file, fcntl.LOCK_EX)
+		history = {}
+		if os.path.exists(path):
+			try:
+				with open(path, 'r') as f:
+					history = json.load(f)
+			except ValueError:
+				history = {}
+		host = history.setdefault(os.uname().nodename, {})
+		for key, wall in samples.items():
+			host[key] = (host.get(key, []) + [wall])[-Common.history_samples:]
+		with open(f"{path}.tmp", 'w') as f:
+			json.dump(history, f, indent=1, sort_keys=True)
+		os.replace(f"{path}.tmp", path)
+
+
+def estimate_plan(plan, fingerprints, versions, history, reused=()):
+	"""
+	按本机历史耗时（中位数）估计计划中各阶段和整体的墙钟时间。
+
+	整体时间取关键路径：依赖按依赖关系并行；WRF 各变体在同一个线程中依次编译；
+	WPS 与主变体同时开始，历史耗时中已包含等待 WRF I/O 库的时间。
+
+	参数:
+	- plan: plan_rebuild 的结果
+	- fingerprints: 阶段名 -> 指纹，按编译顺序排列
+	- versions: 阶段名 -> 版本号
+	- history: load_history 的结果
+	- reused: 可以直接从包存储或二进制缓存取得的依赖，耗时按 0 计
+
+	返回:
+	- tuple: (阶段名 -> 估计秒数，没有历史的阶段为 None；关键路径秒数；没有历史的阶段列表)
+	"""
+	estimates = {}
+	for stage, _ in plan:
+		samples = sorted(history.get(history_key(stage, versions.get(stage)), []))
+		if stage in reused:
+			estimates[stage] = 0.0
+		else:
+			estimates[stage] = samples[len(samples) // 2] if samples else None
+	graph = build_stage_graph(list(fingerprints))
+	wrf_stages = [stage for stage in fingerprints if stage.startswith('wrf:')]
+	for previous, stage in zip(wrf_stages, wrf_stages[1:]):
+		graph[stage] = graph[stage] + [previous]
+	if 'wps' in graph and wrf_stages:
+		graph['wps'] = graph[wrf_stages[0]]
+	finish = {}
+	for stage in fingerprints:
+		start = max((finish[up] for up in graph[stage]), default=0.0)
+		finish[stage] = start + (estimates.get(stage) or 0.0)
+	unknown = [stage for stage, estimate in estimates.items() if estimate is None]
+	return estimates, max(finish.values(), default=0.0), unknown
+
+
+def resolve_artifacts(URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP, compat_map, wrf_version, wps_version, checksums):
+	"""
+	锁定文件中的下载文件。SHA-256 取自 [checksums]，没有配置时取下载缓存中已有文件的值。
+
+	返回:
+	- dict: 版本键（name:version）-> {'url': 下载地址, 'sha256': 校验值或 None}
+	"""
+	urls = {f"{key}:{compat_map.get(key)}": url for key, url in list(URL_COMP_MAP.items()) + list(URL_DEP_MAP.items())}
+	for key, version in (('wrf', wrf_version), ('wps', wps_version)):
+		if key in URL_WRF_MAP:
+			urls[f"{key}:{version}"] = URL_WRF_MAP[key]
+	artifacts = {}
+	for key, url in urls.items():
+		sha256 = checksums.get(key)
+		if sha256 is None and ARTIFACT_CACHE is not None:
+			sha256 = ARTIFACT_CACHE.known_digest(url)
+		artifacts[key] = {'url': url, 'sha256': sha256}
+	return artifacts
+
+
+# 锁定文件的格式版本
+LOCK_VERSION = 1
+
+
+def write_lockfile(path, lock):
+	"""写出安装计划锁定文件"""
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	with open(f"{path}.tmp", 'w') as f:
+		json.dump(lock, f, indent=2)
+	os.replace(f"{path}.tmp", path)
+	logging.info(f"Install plan locked in {path}")
+
+
+def read_lockfile(path):
+	"""读取 --plan 写出的锁定文件，格式版本不符时退出"""
+	try:
+		with open(path, 'r') as f:
+			lock = json.load(f)
+	except (OSError, ValueError) as e:
+		logging.info(f"Error: Cannot read lockfile {path} - {e}")
+		sys.exit(1)
+	if lock.get('lock_version') != LOCK_VERSION:
+		logging.info(f"Error: Lockfile {path} has format {lock.get('lock_version')}, expected {LOCK_VERSION}. Re-run with --plan.")
+		sys.exit(1)
+	return lock
+
+
+def set_compiler_env(compiler_type):
+	"""设置编译器相关的环境变量"""
+	if compiler_type == "intel":
+		os.environ.update(Common.compiler_env)
+
+
+# 捕获 setvars.sh 环境时忽略的 shell 内部变量
+_ENV_IGNORE = {'PWD', 'OLDPWD', 'SHLVL', '_'}
+# 当前安装的完整编译环境，解析工具链后由 main 设置，作为 env= 传给所有编译步骤
+BUILD_ENV = None
+_DELTA_LOCK = threading.Lock()
+_DELTA_MEMO = {}
+
+
+def _toolchain_key(setvars):
+	"""由 setvars.sh 的路径、修改时间和 oneAPI 安装目录下各组件的修改时间计算缓存键"""
+	root = os.path.dirname(os.path.realpath(setvars))
+	stat = os.stat(setvars)
+	components = sorted((name, os.stat(os.path.join(root, name)).st_mtime_ns) for name in os.listdir(root))
+	payload = json.dumps([os.path.realpath(setvars), stat.st_mtime_ns, stat.st_size, components])
+	return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def capture_env_delta(script):
+	"""
+	在干净的 bash 中 source 脚本，返回它对环境变量的修改。
+
+	返回:
+	- dict: {'set': {变量: 值}, 'prepend': {变量: [加在原值之前的路径]}}
+	"""
+	base_env = dict(os.environ)
+	# setvars.sh 发现已加载过时会直接返回
+	base_env.pop('SETVARS_COMPLETED', None)
+	result = subprocess.run(["bash", "-c", f'source "{script}" >/dev/null 2>&1 && env -0'],
+							env=base_env, capture_output=True)
+	if result.returncode != 0:
+		raise RuntimeError(f"source {script} failed with code {result.returncode}")
+	delta = {'set': {}, 'prepend': {}}
+	for item in result.stdout.decode('utf-8', errors='replace').split('\0'):
+		key, sep, value = item.partition('=')
+		if not sep or key in _ENV_IGNORE or base_env.get(key) == value:
+			continue
+		old = base_env.get(key)
+		if old and value.endswith(':' + old):
+			delta['prepend'][key] = value[:-len(old) - 1].split(':')
+		elif not old and key.endswith('PATH'):
+			# 原来没有设置的路径列表变量同样按前置处理，加载时保留用户已有的值
+			delta['prepend'][key] = value.rstrip(':').split(':')
+		else:
+			delta['set'][key] = value
+	return delta
+
+
+def load_toolchain_delta(setvars):
+	"""
+	返回 setvars.sh 对环境变量的修改，按 oneAPI 安装缓存在磁盘上，只在安装变化后重新 source。
+
+	参数:
+	- setvars: setvars.sh 路径，不存在时返回空修改
+	"""
+	if not os.path.exists(setvars):
+		return {'set': {}, 'prepend': {}}
+	key = _toolchain_key(setvars)
+	with _DELTA_LOCK:
+		if key in _DELTA_MEMO:
+			return _DELTA_MEMO[key]
+		cache_path = os.path.join(Common.toolchain_cache_dir, f"{key}.json")
+		if os.path.exists(cache_path):
+			with open(cache_path) as f:
+				delta = json.load(f)
+			logging.info(f"Using cached toolchain environment {cache_path}")
+		else:
+			started = time.time()
+			delta = capture_env_delta(setvars)
+			logging.info(f"Captured toolchain environment from {setvars} in {time.time() - started:.1f}s")
+			os.makedirs(Common.toolchain_cache_dir, exist_ok=True)
+			tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+			with open(tmp_path, 'w') as f:
+				json.dump(delta, f, indent=2)
+			os.replace(tmp_path, cache_path)
+		_DELTA_MEMO[key] = delta
+		return delta
+
+
+def apply_env_delta(env, delta):
+	"""返回在 env 上应用修改后的新环境变量 dict"""
+	env = dict(env)
+	env.update(delta['set'])
+	for key, paths in delta['prepend'].items():
+		env[key] = ':'.join(paths + ([env[key]] if env.get(key) else []))
+	return env
+
+
+def toolchain_env_delta(compiler_type, install_dir, wrf_dir, wps_dir):
+	"""
+	计算编译和运行 WRF 需要的全部环境变量修改，与 set_env.sh 的内容一致：
+	编译器环境、setvars.sh 的修改、依赖库路径以及 NETCDF/JASPER/WRF_DIR 等变量。
+
+	返回:
+	- dict: 与 capture_env_delta 相同的格式
+	"""
+	delta = {'set': {}, 'prepend': {}}
+	if compiler_type == "intel":
+		intel_delta = load_toolchain_delta(os.path.join(install_dir, 'compiler', 'setvars.sh'))
+		delta['set'].update(Common.compiler_env)
+		delta['set'].update(intel_delta['set'])
+		delta['prepend'].update({key: list(paths) for key, paths in intel_delta['prepend'].items()})
+	dep_dir = os.path.join(install_dir, 'deps')
+	# 依赖库目录排在最前面
+	for key, sub in (('PATH', 'bin'), ('LD_LIBRARY_PATH', 'lib'), ('CPATH', 'include')):
+		delta['prepend'][key] = [os.path.join(dep_dir, sub)] + delta['prepend'].get(key, [])
+	delta['set'].update({
+		'NETCDF': dep_dir,
+		'JASPERLIB': os.path.join(dep_dir, 'lib'),
+		'JASPERINC': os.path.join(dep_dir, 'include'),
+		'WRF_DIR': wrf_dir,
+		'WPS_DIR': wps_dir,
+	})
+	return delta
+
+
+def generate_env(delta, install_dir):
+	"""把环境变量修改写成用户可以 source 的 env_set.sh，加载时不需要再执行 setvars.sh"""
+	env_file = os.path.join(install_dir, "env_set.sh")
+	with open(env_file, 'w') as f:
+		f.write("# Generated by wrf_auto_install.py\n")
+		f.write(f'export WRF_BASE={shlex.quote(install_dir)}\n')
+		for key, value in sorted(delta['set'].items()):
+			f.write(f'export {key}={shlex.quote(value)}\n')
+		for key, paths in sorted(delta['prepend'].items()):
+			f.write(f'export {key}={shlex.quote(":".join(paths))}"${{{key}:+:${key}}}"\n')
+	logging.info(f"Environment file written to {env_file}")
 
 
 # 安装编译器
 def install_compiler(URL_COMP_MAP, intel_file_path,INTEL_PATH,name_map, compiler_type, install_dir):
 	if compiler_type == "intel":
 		logging.info("Installing compiler: ")
-		result = subprocess.run(["bash", "-c", f"source {os.path.join(install_dir, 'compiler', 'setvars.sh')} && ifort -v && icc -v"],capture_output=True, text=True)
-		os.environ["CC"] = "icc"
-		os.environ["CXX"] = "icpc"
-		os.environ["FC"] = "ifort"
-		os.environ['F90'] = "ifort"
-		os.environ['F77'] = "ifort"
-		os.environ["CFLAGS"] = "-O3 -fPIC"
-		os.environ["CXXFLAGS"] = "-O3 -fPIC"
-		if result.returncode == 0:
+		setvars = os.path.join(install_dir, 'compiler', 'setvars.sh')
+		set_compiler_env(compiler_type)
+		result = None
+		if os.path.exists(setvars):
+			env = apply_env_delta(os.environ, load_toolchain_delta(setvars))
+			result = subprocess.run(["bash", "-c", "ifort -v && icc -v"], env=env, capture_output=True, text=True)
+		if result is not None and result.returncode == 0:
 			logging.info("Command executed successfully.")
 		else:
 			logging.info(f"{compiler_type} compiler is not found.")
 
 			installer_base = os.path.join(intel_file_path, name_map['intel-base'])
 			installer_hpc = os.path.join(intel_file_path, name_map['intel-hpc'])
-			if not os.path.exists(installer_base):
-				download_file_with_wget(URL_COMP_MAP['intel-base'], installer_base)
-				subprocess.run(["chmod", "+x", installer_base])
-			if not os.path.exists(installer_hpc):
-				download_file_with_wget(URL_COMP_MAP['intel-hpc'], installer_hpc)
-				subprocess.run(["chmod", "+x", installer_hpc])
+			fetch_file(URL_COMP_MAP['intel-base'], installer_base)
+			subprocess.run(["chmod", "+x", installer_base])
+			fetch_file(URL_COMP_MAP['intel-hpc'], installer_hpc)
+			subprocess.run(["chmod", "+x", installer_hpc])
 
 			# subprocess.run(
 				# ["bash", "-c", f"{installer_base} -a --install-dir {INTEL_PATH} --silent --components intel.oneapi.lin.dpcpp-cpp-compiler --eula accept"])
 			# subprocess.run(["bash", "-c", f"source {os.path.join(install_dir, 'compiler', 'setvars.sh')}"])
-			subprocess.run(
-				["bash", "-c", f"{installer_hpc} -a --install-dir {INTEL_PATH} --silent --components intel.oneapi.lin.mpi.devel:intel.oneapi.lin.ifort-compiler:intel.oneapi.lin.dpcpp-cpp-compiler-pro --eula accept"])
-			subprocess.run(["bash", "-c", f"source {os.path.join(install_dir, 'compiler', 'setvars.sh')}"])
-			os.environ["CC"] = "icc"
-			os.environ["CXX"] = "icpc"
-			os.environ["FC"] = "ifort"
-			os.environ['F90'] = "ifort"
-			os.environ['F77'] = "ifort"
-			os.environ["CFLAGS"] = "-O3 -fPIC"
-			os.environ["CXXFLAGS"] = "-O3 -fPIC"
+			log_path = os.path.join(install_dir, "logs", "compiler-install.log.gz")
+			with PROFILER.stage("intel oneapi install", 'install'):
+				returncode, tail = run_logged(f"{installer_hpc} -a --install-dir {INTEL_PATH} --silent --components intel.oneapi.lin.mpi.devel:intel.oneapi.lin.ifort-compiler:intel.oneapi.lin.dpcpp-cpp-compiler-pro --eula accept", log_path)
+			report_command("Intel oneAPI install", returncode, tail, log_path)
+			if returncode != 0:
+				logging.info("Error: Intel oneAPI installation failed.")
+				sys.exit(1)
 	# elif compiler_type == "gcc":
 	# 	subprocess.run(["sudo", "apt-get", "install", "-y", "gcc", "g++", "gfortran"])
 	# 	os.environ["CC"] = "gcc"
 	# 	os.environ["CXX"] = "g++"
 	# 	os.environ["FC"] = "gfortran"
-def log_command_result(result):
-	if result.returncode != 0:
-		logging.info("Error occurred during execution:")
-		logging.info("STDOUT: %s", result.stdout)
-		logging.info("STDERR: %s", result.stderr)
+# 从编译输出中识别当前编译目标：automake 的 "Making all in dir"、make 进入目录、单个源文件的编译命令
+PROGRESS_PATTERNS = [
+	re.compile(r"^Making (\w+) in (\S+)"),
+	re.compile(r"^make\[\d+\]: Entering directory [`'](.+)'"),
+	re.compile(r"^\s*(?:CC|CXX|FC|F77|CCLD|FCLD)\s+(\S+)"),
+	re.compile(r"\s-c\s.*?(\S+\.(?:c|f|F|f90|F90|cc|cpp))\b"),
+]
+_CONSOLE_LOCK = threading.Lock()
+
+
+def build_progress(line):
+	"""从一行编译输出中提取当前编译目标，无法识别时返回 None"""
+	for pattern in PROGRESS_PATTERNS:
+		match = pattern.search(line)
+		if match:
+			return ' '.join(match.groups())
+	return None
+
+
+def run_logged(cmd, log_path, cwd=None, input=None, env=None, label=None):
+	"""
+	执行 bash 命令，输出逐行写入 gzip 压缩的日志文件，内存中只保留最后 Common.log_tail_lines 行。
+	当前编译目标实时输出到终端。
+
+	参数:
+	- cmd: bash 命令
+	- log_path: 日志文件路径（.log.gz）
+	- cwd: 工作目录
+	- input: 写入标准输入的字符串
+	- env: 环境变量，默认继承当前进程
+	- label: 终端进度输出的前缀，默认使用日志文件名
+
+	返回:
+	- tuple: (返回码, 最后若干行输出的列表)
+	"""
+	label = label or os.path.basename(log_path).split('.')[0]
+	tail = deque(maxlen=Common.log_tail_lines)
+	os.makedirs(os.path.dirname(log_path), exist_ok=True)
+	proc = subprocess.Popen(["bash", "-c", cmd], cwd=cwd, env=env,
+							stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+							stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	if input is not None:
+		proc.stdin.write(input.encode())
+		proc.stdin.close()
+	last_progress = None
+	with gzip.open(log_path, 'wt', encoding='utf-8') as log_file:
+		log_file.write(f"$ {cmd}\n")
+		for raw in proc.stdout:
+			line = raw.decode('utf-8', errors='replace').rstrip('\n')
+			log_file.write(line + '\n')
+			tail.append(line)
+			progress = build_progress(line)
+			if progress and progress != last_progress:
+				last_progress = progress
+				with _CONSOLE_LOCK:
+					sys.stdout.write(f"[{label}] {progress}\n")
+					sys.stdout.flush()
+		# 用 wait4 取得子进程（含其等待过的后代进程）的 CPU 时间和峰值内存
+		_, status, rusage = os.wait4(proc.pid, 0)
+		proc.returncode = returncode = os.waitstatus_to_exitcode(status)
+		PROFILER.add_child_usage(rusage)
+		log_file.write(f"# exit code {returncode}\n")
+	return returncode, list(tail)
+
+
+def report_command(name, returncode, tail, log_path):
+	"""记录命令执行结果，失败时输出最后若干行"""
+	if returncode != 0:
+		logging.info(f"Error occurred during {name} (exit code {returncode}), full log: {log_path}")
+		for line in tail:
+			logging.info(f"  | {line}")
 	else:
-		logging.info("Command executed successfully.")
-		logging.info("STDOUT: %s", result.stdout)
+		logging.info(f"{name} executed successfully, log: {log_path}")
+
+
+def read_meminfo():
+	"""读取 /proc/meminfo，返回 {字段: kB}，不支持时返回空 dict"""
+	meminfo = {}
+	try:
+		with open('/proc/meminfo') as f:
+			for line in f:
+				key, _, value = line.partition(':')
+				meminfo[key] = int(value.split()[0])
+	except (OSError, ValueError, IndexError):
+		return {}
+	return meminfo
+
+
+def available_memory_mb():
+	"""返回可用内存（MB），无法获取时返回 None"""
+	meminfo = read_meminfo()
+	if 'MemAvailable' not in meminfo:
+		return None
+	return meminfo['MemAvailable'] // 1024
+
+
+def memory_job_limit(per_job_mb):
+	"""按当前可用内存计算可以同时运行的编译任务数，无法获取内存信息时返回 None"""
+	available = available_memory_mb()
+	if available is None:
+		return None
+	return max(1, (available - Common.memory_reserve_mb) // per_job_mb)
+
+
+def default_jobs():
+	"""按 CPU 核数减去当前负载计算默认的总编译任务数"""
+	cpus = os.cpu_count() or 1
+	try:
+		load = os.getloadavg()[0]
+	except OSError:
+		load = 0.0
+	jobs = max(1, min(cpus, int(cpus - load + 0.5)))
+	logging.info(f"Auto jobs: {jobs} (cores {cpus}, load {load:.2f}, MemAvailable {available_memory_mb()} MB)")
+	return jobs
+
+
+def looks_out_of_memory(returncode, tail):
+	"""根据返回码和输出判断编译是否因内存不足失败"""
+	if returncode in (137, -9):
+		return True
+	return any(OOM_PATTERN.search(line) for line in tail)
+
+
+# 编译器或系统因内存不足终止编译时的输出
+OOM_PATTERN = re.compile(r"Killed signal terminated program|virtual memory exhausted|Cannot allocate memory|out of memory|fatal error: Killed", re.I)
+
+
+class JobPool(object):
+	"""
+	全局并行任务预算（make -j 的总数），由同时进行的多个依赖编译共享。
+
+	参数:
+	- total: 总任务数，通常来自 -n/--mpinum
+	"""
+
+	def __init__(self, total):
+		self.total = max(1, int(total))
+		self.available = self.total
+		self._cond = threading.Condition()
+
+	def acquire(self, want):
+		"""阻塞直到至少有一个空闲任务槽，返回实际分配到的任务数"""
+		with self._cond:
+			while self.available < 1:
+				self._cond.wait()
+			got = max(1, min(int(want), self.available))
+			self.available -= got
+			return got
+
+	def release(self, count):
+		with self._cond:
+			self.available += count
+			self._cond.notify_all()
+
+	def resize(self, total):
+		"""调整总任务数；缩小时已分配的任务不收回，归还后才按新的总数分配"""
+		with self._cond:
+			total = max(1, int(total))
+			self.available += total - self.total
+			self.total = total
+			self._cond.notify_all()
+
+
+class MemoryGovernor(object):
+	"""
+	编译期间定时读取 /proc/meminfo，按内存压力调整任务预算：
+	可用内存低于保留值时减半，仍有两个任务以上的空闲内存时逐个恢复，最多到 limit。
+
+	参数:
+	- pool: 被调整的 JobPool
+	- per_job_mb: 每个编译任务预计占用的内存（MB）
+	- limit: 任务数上限
+	"""
+
+	def __init__(self, pool, per_job_mb, limit):
+		self.pool = pool
+		self.per_job_mb = per_job_mb
+		self.limit = max(1, int(limit))
+		self._stop = threading.Event()
+		self._thread = None
+
+	def _resize(self, total, available):
+		if total != self.pool.total:
+			logging.info(f"Memory governor: MemAvailable {available} MB, make jobs {self.pool.total} -> {total}")
+			self.pool.resize(total)
+
+	def adjust(self):
+		"""按当前可用内存调整一次，返回是否能读取内存信息"""
+		available = available_memory_mb()
+		if available is None:
+			return False
+		reserve = Common.memory_reserve_mb
+		if available < reserve:
+			self._resize(max(1, self.pool.total // 2), available)
+		elif available > reserve + 2 * self.per_job_mb and self.pool.total < self.limit:
+			self._resize(self.pool.total + 1, available)
+		return True
+
+	def start(self):
+		# 开始前按可用内存确定初始任务数
+		limit = memory_job_limit(self.per_job_mb)
+		if limit is None:
+			return self
+		self._resize(min(self.limit, limit), available_memory_mb())
+		self._thread = threading.Thread(target=self._run, name="memory-governor", daemon=True)
+		self._thread.start()
+		return self
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc_info):
+		self.stop()
+
+	def _run(self):
+		while not self._stop.wait(Common.memory_poll_interval):
+			if not self.adjust():
+				return
+
+	def stop(self):
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+
+
+def run_dependency_graph(deps, graph, build_func, mpinum):
+	"""
+	按依赖关系图并行编译依赖，互不依赖的分支同时编译，共享同一个任务预算。
+	矩阵模式下图中还包含各 WRF/WPS 目标。
+
+	参数:
+	- deps: 需要编译的包列表（按优先顺序）
+	- graph: 包 -> 直接依赖的包
+	- build_func: build_func(dep, jobs)，编译单个包
+	- mpinum: 全局任务预算
+	"""
+	pool = JobPool(mpinum)
+	governor = MemoryGovernor(pool, Common.dep_job_memory_mb, mpinum).start()
+	pending = list(deps)
+	done = set()
+	running = {}
+	errors = []
+
+	def build_with_jobs(dep, jobs):
+		try:
+			logging.info(f"Building {dep} with {jobs} jobs.")
+			build_func(dep, jobs)
+		finally:
+			pool.release(jobs)
+
+	try:
+		with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+			while pending or running:
+				if not errors:
+					# 依赖不在本次编译列表中的视为已满足
+					ready = [dep for dep in pending
+							 if all(up in done or up not in deps for up in graph.get(dep, []))]
+					width = len(running) + len(ready)
+					for dep in ready:
+						pending.remove(dep)
+						jobs = pool.acquire(pool.total // max(1, width))
+						running[executor.submit(build_with_jobs, dep, jobs)] = dep
+				if not running:
+					break
+				finished, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					dep = running.pop(future)
+					try:
+						future.result()
+						done.add(dep)
+					except BaseException as e:
+						logging.info(f"Error: {dep} failed - {e}")
+						errors.append((dep, e))
+	finally:
+		governor.stop()
+
+	if errors:
+		raise RuntimeError(f"Build failed: {', '.join(dep for dep, _ in errors)}")
+	if pending:
+		raise RuntimeError(f"Unresolvable dependencies: {', '.join(pending)}")
+
+
+class BundleCache(object):
+	"""
+	二进制编译缓存：把编译好的依赖包的安装文件保存为压缩包，按依赖阶段指纹索引。
+
+	阶段指纹包含包名、版本、下载地址、configure 参数以及配置的编译器版本和编译参数，
+	缓存键另外包含实际编译器报告的版本（toolchain，见 compiler_identity），
+	配置的版本号相同但实际安装不同的编译器不会共用缓存。
+	键相同的包可以直接解压使用，不需要重新编译。缓存目录可以放在共享文件系统上，
+	由一台编译服务器生成后供其他节点使用。
+
+	参数:
+	- root: 缓存目录
+	"""
+
+	def __init__(self, root):
+		self.root = root
+		# 编译器 --version 输出的摘要，工具链环境确定后由 main 设置
+		self.toolchain = None
+		os.makedirs(root, exist_ok=True)
+
+	def bundle_path(self, dep, version, fingerprint):
+		key = hashlib.sha256(f"{fingerprint}:{self.toolchain}".encode()).hexdigest()
+		return os.path.join(self.root, f"{dep}-{version}-{key[:16]}.tar.gz")
+
+	def has(self, dep, version, fingerprint):
+		return os.path.exists(self.bundle_path(dep, version, fingerprint))
+
+	def save(self, dep, version, fingerprint, prefix):
+		"""
+		把包的安装前缀目录打包，记录原始前缀，恢复到其他路径时用于替换文本文件中的路径。
+		"""
+		path = self.bundle_path(dep, version, fingerprint)
+		manifest = json.dumps({'dep': dep, 'version': version, 'fingerprint': fingerprint,
+							   'toolchain': self.toolchain, 'prefix': prefix}).encode()
+		tmp_path = f"{path}.{os.getpid()}.tmp"
+		with tarfile.open(tmp_path, 'w:gz') as tar:
+			info = tarfile.TarInfo(BUNDLE_MANIFEST)
+			info.size = len(manifest)
+			info.mtime = time.time()
+			tar.addfile(info, io.BytesIO(manifest))
+			for name in sorted(os.listdir(prefix)):
+				if name != STORE_COMPLETE:
+					tar.add(os.path.join(prefix, name), arcname=name)
+		os.replace(tmp_path, path)
+		logging.info(f"Saved binary bundle {path}")
+
+	def restore(self, dep, version, fingerprint, prefix):
+		"""
+		把缓存的包解压到 prefix，返回是否命中。
+		解压到与打包时不同的前缀时，替换文本文件中的路径，并用 patchelf 改写 ELF 文件中指向原前缀的 RPATH；
+		没有 patchelf 时 RPATH 保持原样，需要通过 LD_LIBRARY_PATH 找到库。
+		"""
+		path = self.bundle_path(dep, version, fingerprint)
+		if not os.path.exists(path):
+			return False
+		old_prefix = None
+		elf_files = []
+		with tarfile.open(path, 'r:gz') as tar:
+			for member in tar:
+				if member.name == BUNDLE_MANIFEST:
+					old_prefix = json.load(tar.extractfile(member))['prefix']
+					continue
+				tar.extract(member, prefix, **TAR_EXTRACT_KWARGS)
+				if member.isreg() and old_prefix and old_prefix != prefix:
+					member_path = os.path.join(prefix, member.name)
+					relocate_file(member_path, old_prefix, prefix)
+					if is_elf(member_path):
+						elf_files.append(member_path)
+		if elf_files:
+			relocate_rpaths(elf_files, old_prefix, prefix)
+		logging.info(f"Restored {dep}-{version} from binary bundle {path}")
+		return True
+
+	def export_to(self, dest_dir):
+		"""把所有缓存的包复制到 dest_dir"""
+		return _copy_bundles(self.root, dest_dir)
+
+	def import_from(self, src_dir):
+		"""把 src_dir 中的包导入缓存"""
+		return _copy_bundles(src_dir, self.root)
+
+
+# 二进制包中的描述文件名
+BUNDLE_MANIFEST = '.bundle_manifest.json'
+
+
+def compiler_identity(env):
+	"""
+	返回环境中 C/C++/Fortran 编译器（CC、CXX、FC，如 icc/icx、icpc、ifort）--version 输出的摘要，
+	用于区分配置的版本号相同但实际安装不同的编译器。
+	"""
+	digest = hashlib.sha256()
+	for var in ('CC', 'CXX', 'FC'):
+		compiler = env.get(var)
+		if not compiler:
+			continue
+		try:
+			result = subprocess.run([compiler, '--version'], env=env, capture_output=True, text=True, timeout=60)
+			output = result.stdout.strip() if result.returncode == 0 else f"exit {result.returncode}"
+		except (OSError, subprocess.TimeoutExpired) as e:
+			output = f"unavailable: {e.__class__.__name__}"
+		digest.update(f"{var}={compiler}\n{output}\n".encode())
+	return digest.hexdigest()
+
+
+def _copy_bundles(src_dir, dest_dir):
+	os.makedirs(dest_dir, exist_ok=True)
+	copied = 0
+	for name in sorted(os.listdir(src_dir)):
+		dest = os.path.join(dest_dir, name)
+		if not name.endswith('.tar.gz') or os.path.exists(dest):
+			continue
+		shutil.copyfile(os.path.join(src_dir, name), f"{dest}.tmp")
+		os.replace(f"{dest}.tmp", dest)
+		copied += 1
+	logging.info(f"Copied {copied} bundles from {src_dir} to {dest_dir}")
+	return copied
+
+
+def relocate_file(path, old_prefix, new_prefix):
+	"""替换文本文件（libtool .la、pkg-config .pc、*-config 脚本等）中的安装前缀，二进制文件保持不变"""
+	with open(path, 'rb') as f:
+		data = f.read()
+	old = old_prefix.encode()
+	if old not in data or b'\0' in data[:8192]:
+		return
+	with open(path, 'wb') as f:
+		f.write(data.replace(old, new_prefix.encode()))
+
+
+def relocate_rpaths(paths, old_prefix, new_prefix):
+	"""把 ELF 文件 RPATH/RUNPATH 中的安装前缀替换为新前缀，没有 patchelf 时只给出提示"""
+	patchelf = shutil.which(Common.finalize_patchelf)
+	if not patchelf:
+		stale = [path for path in paths if _contains(path, old_prefix.encode())]
+		if stale:
+			logging.info(f"Warning: {Common.finalize_patchelf} not found, RPATH of {len(stale)} files still points to "
+						 f"{old_prefix}; add {new_prefix}/lib to LD_LIBRARY_PATH.")
+		return
+	for path in paths:
+		result = subprocess.run([patchelf, "--print-rpath", path], capture_output=True, text=True)
+		rpath = result.stdout.strip()
+		if result.returncode != 0 or old_prefix not in rpath:
+			continue
+		os.chmod(path, os.stat(path).st_mode | 0o200)
+		subprocess.run([patchelf, "--set-rpath", rpath.replace(old_prefix, new_prefix), path], check=True)
+
+
+def _contains(path, data):
+	with open(path, 'rb') as f:
+		return data in f.read()
+
+
+# 包存储中表示安装完成的标记文件
+STORE_COMPLETE = '.complete'
+# 组合视图中记录各包来源的文件
+VIEW_MANIFEST = '.view.json'
+_VIEW_LOCK = threading.Lock()
+
+
+def store_prefix(dep, version, fingerprint):
+	"""依赖包在主机级包存储中的独立安装前缀"""
+	return os.path.join(Common.store_dir, f"{dep}-{version}-{fingerprint[:16]}")
+
+
+def store_complete(prefix):
+	return os.path.exists(os.path.join(prefix, STORE_COMPLETE))
+
+
+def dependency_closure(dep, graph):
+	"""dep 的所有直接和间接依赖"""
+	closure = []
+	stack = list(graph.get(dep, []))
+	while stack:
+		up = stack.pop()
+		if up not in closure:
+			closure.append(up)
+			stack.extend(graph.get(up, []))
+	return closure
+
+
+def compose_view(view_dir, dep, prefix, mode='symlink'):
+	"""
+	把包存储中的安装前缀链接到组合视图目录（安装目录下的 deps），
+	同一个包换成新的前缀时先删除指向旧前缀的链接。
+	两个包提供同一个文件时后链接的包覆盖，文件归属转给后者，之后重建前者时不会删除它。
+
+	参数:
+	- view_dir: 视图目录
+	- dep: 包名
+	- prefix: 包的安装前缀
+	- mode: 'symlink' 或 'hardlink'，硬链接跨文件系统时退回符号链接
+	"""
+	with _VIEW_LOCK:
+		manifest_path = os.path.join(view_dir, VIEW_MANIFEST)
+		manifest = {}
+		if os.path.exists(manifest_path):
+			with open(manifest_path, 'r') as f:
+				manifest = json.load(f)
+		old_prefix = manifest.get(dep, {}).get('prefix')
+		for rel_path in manifest.get(dep, {}).get('files', []) if old_prefix != prefix else []:
+			path = os.path.join(view_dir, rel_path)
+			if os.path.islink(path) or os.path.isfile(path):
+				os.remove(path)
+
+		files = []
+		owners = {rel_path: other for other, entry in manifest.items() if other != dep for rel_path in entry['files']}
+		for root, dirs, names in os.walk(prefix):
+			rel_root = os.path.relpath(root, prefix)
+			os.makedirs(os.path.join(view_dir, rel_root), exist_ok=True)
+			# 指向目录的符号链接按文件处理
+			names = names + [name for name in dirs if os.path.islink(os.path.join(root, name))]
+			dirs[:] = [name for name in dirs if not os.path.islink(os.path.join(root, name))]
+			for name in names:
+				if rel_root == '.' and name == STORE_COMPLETE:
+					continue
+				rel_path = os.path.normpath(os.path.join(rel_root, name))
+				src = os.path.join(root, name)
+				dest = os.path.join(view_dir, rel_path)
+				if os.path.lexists(dest):
+					os.remove(dest)
+				if rel_path in owners:
+					logging.info(f"Warning: {rel_path} in view {view_dir} is provided by both {owners[rel_path]} and {dep}, using {dep}")
+					manifest[owners[rel_path]]['files'].remove(rel_path)
+					del owners[rel_path]
+				if mode == 'hardlink' and not os.path.islink(src):
+					try:
+						os.link(src, dest)
+					except OSError:
+						os.symlink(src, dest)
+				else:
+					os.symlink(src, dest)
+				files.append(rel_path)
+
+		manifest[dep] = {'prefix': prefix, 'files': files}
+		with open(f"{manifest_path}.tmp", 'w') as f:
+			json.dump(manifest, f, indent=1)
+		os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+# 二进制编译缓存，未启用时为 None
+BUNDLE_CACHE = None
+
+
+class CheckRunner(object):
+	"""
+	依赖包测试（make check）的执行策略和结果汇总。测试结果与编译结果分开报告。
+
+	策略:
+	- serial: make install 之前串行执行
+	- parallel: make install 之前以 make -j 并行执行
+	- deferred: make install 之后在后台以低优先级执行，下游的包同时继续编译
+	- skip: 不执行
+	从包存储或二进制缓存恢复的包不执行测试。
+
+	测试失败时:
+	- warn: 只在汇总中报告，包照常安装
+	- fail: serial/parallel 下在 make install 之前中止安装，deferred 下等待后台测试结束后中止
+	"""
+
+	POLICIES = ('serial', 'parallel', 'deferred', 'skip')
+	ON_FAILURE = ('warn', 'fail')
+
+	def __init__(self, policy, on_failure='warn'):
+		self.policy = policy
+		self.on_failure = on_failure
+		self.results = {}
+		self._lock = threading.Lock()
+		self._executor = None
+		self._futures = []
+
+	@property
+	def inline(self):
+		return self.policy in ('serial', 'parallel')
+
+	def _record(self, dep, version, status, **info):
+		# 矩阵模式下同一个包可能有多个版本，按 包名-版本 区分
+		with self._lock:
+			self.results[f"{dep}-{version}"] = dict(info, version=version, status=status)
+
+	def skip(self, dep, version, reason):
+		"""记录未执行的测试"""
+		self._record(dep, version, 'skipped', reason=reason)
+
+	def run(self, dep, version, src_dir, jobs, log_dir):
+		"""执行测试并记录结果，返回是否通过。fail 模式下 make install 之前的测试失败时抛出 RuntimeError"""
+		log_path = os.path.join(log_dir, f"{dep}-check.log.gz")
+		cmd = "make check" if self.policy == 'serial' else f"make -j{jobs} check"
+		if self.policy == 'deferred':
+			# 后台测试让出 CPU 给关键路径上的编译
+			cmd = f"nice -n 10 {cmd}"
+		started = time.time()
+		with PROFILER.stage(f"{dep} check", 'check'):
+			returncode, tail = run_logged(cmd, log_path, cwd=src_dir, env=BUILD_ENV, label=f"{dep}-check")
+		report_command(f"{dep}-{version} check", returncode, tail, log_path)
+		status = 'passed' if returncode == 0 else 'failed'
+		self._record(dep, version, status, returncode=returncode, log=log_path, duration=round(time.time() - started, 1))
+		if returncode != 0 and self.inline and self.on_failure == 'fail':
+			raise RuntimeError(f"{dep}-{version} check failed, see {log_path}")
+		return returncode == 0
+
+	def submit(self, dep, version, src_dir, jobs, log_dir):
+		"""deferred 策略下把测试放到后台执行"""
+		with self._lock:
+			if self._executor is None:
+				self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="check")
+			self.results[f"{dep}-{version}"] = {'version': version, 'status': 'pending'}
+			self._futures.append(self._executor.submit(self.run, dep, version, src_dir, jobs, log_dir))
+
+	def wait(self):
+		"""等待所有后台测试结束，fail 模式下有测试失败时抛出 RuntimeError"""
+		if self._futures:
+			logging.info(f"Waiting for {sum(not f.done() for f in self._futures)} deferred checks...")
+			wait(self._futures)
+		with self._lock:
+			failed = [name for name, result in self.results.items() if result['status'] == 'failed']
+		if failed and self.on_failure == 'fail':
+			raise RuntimeError(f"Tests failed for {', '.join(failed)}")
+
+	def shutdown(self):
+		"""取消还没有开始的后台测试"""
+		if self._executor is not None:
+			self._executor.shutdown(wait=False, cancel_futures=True)
+
+	def report(self, log_dir):
+		"""输出测试结果汇总并写入 logs/check-results.json"""
+		with self._lock:
+			results = dict(self.results)
+		if not results:
+			return
+		logging.info(f"Dependency test results (policy {self.policy}):")
+		for name, result in results.items():
+			detail = result.get('reason') or result.get('log', '')
+			logging.info(f"  {name}: {result['status']} {detail}")
+		failed = [name for name, result in results.items() if result['status'] == 'failed']
+		if failed:
+			logging.info(f"Tests failed for {', '.join(failed)}; the packages are installed, see the check logs.")
+		os.makedirs(log_dir, exist_ok=True)
+		with open(os.path.join(log_dir, 'check-results.json'), 'w') as f:
+			json.dump({'policy': self.policy, 'on_failure': self.on_failure, 'results': results}, f, indent=2)
+
+
+# 依赖包测试的执行策略，由 main 按 --check 设置
+CHECKS = CheckRunner(Common.check_policy, Common.check_failure)
+
+
+def build_dependency(dep, version, url, jobs, install_dir, fingerprint, upstream_prefixes):
+	"""
+	把单个依赖包安装到主机级包存储中自己的前缀下，再链接到安装目录的 deps 视图。
+
+	包存储中已有相同指纹的包时直接使用；启用二进制编译缓存时其次从缓存恢复；
+	都没有时下载、解压并编译，编译完成后保存到二进制缓存。
+
+	参数:
+	- dep: 包名
+	- version: 版本号
+	- url: 下载地址
+	- jobs: make -j 的并行数
+	- install_dir: 安装根目录
+	- fingerprint: 依赖阶段指纹，作为包存储和二进制缓存的键
+	- upstream_prefixes: 所有上游依赖的安装前缀
+
+	返回:
+	- str: 'store'、'bundle' 或 'build'，表示包的来源
+	"""
+	src_dir = os.path.join(install_dir, "src")
+	src_file = dependency_archive(install_dir, dep, version)
+	prefix = store_prefix(dep, version, fingerprint)
+	os.makedirs(Common.store_dir, exist_ok=True)
+
+	# 多个安装同时需要同一个包时只编译一次
+	with PROFILER.stage(dep, 'dependency'), open(f"{prefix}.lock", 'a') as lock_file:
+		fcntl.flock(lock_file, fcntl.LOCK_EX)
+		if store_complete(prefix):
+			logging.info(f"Dependency {dep}-{version} found in store {prefix}")
+			source = 'store'
+			CHECKS.skip(dep, version, 'reused from store')
+		else:
+			shutil.rmtree(prefix, ignore_errors=True)
+			if BUNDLE_CACHE is not None and BUNDLE_CACHE.restore(dep, version, fingerprint, prefix):
+				source = 'bundle'
+				CHECKS.skip(dep, version, 'restored from binary cache')
+			else:
+				compile_dependency(dep, version, url, jobs, src_dir, src_file, prefix, upstream_prefixes, os.path.join(install_dir, "logs"))
+				if BUNDLE_CACHE is not None:
+					BUNDLE_CACHE.save(dep, version, fingerprint, prefix)
+				source = 'build'
+			with open(os.path.join(prefix, STORE_COMPLETE), 'w') as f:
+				json.dump({'dep': dep, 'version': version, 'fingerprint': fingerprint, 'source': source}, f)
+	compose_view(os.path.join(install_dir, "deps"), dep, prefix, Common.view_mode)
+	return source
+
+
+def compile_dependency(dep, version, url, jobs, src_dir, src_file, prefix, upstream_prefixes, log_dir):
+	"""下载、解压并编译依赖包，安装到 prefix"""
+	fetch_file(url, src_file)
+
+	logging.info(f"Compiling {dep}-{version}...")
+	# 计算目标目录名称
+	package_base = os.path.basename(src_file)
+	# 去除所有常见压缩扩展名
+	for ext in ['.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+				'.tar.xz', '.txz', '.zip', '.gz',
+				'.bz2', '.xz', '.tar']:
+		if package_base.lower().endswith(ext):
+			package_base = package_base[:-len(ext)]
+			break
+
+	target_dir = os.path.join(src_dir, package_base)
+	# 重新编译时从干净的源码开始，避免沿用旧参数编译出的目标文件
+	shutil.rmtree(target_dir, ignore_errors=True)
+	os.makedirs(target_dir, exist_ok=True)
+
+	try:
+		with PROFILER.stage(f"{dep} extract", 'extract'):
+			extract_file(src_file, target_dir, strip_top=True)
+	except Exception as e:
+		shutil.rmtree(target_dir, ignore_errors=True)
+		raise
+	logging.info(f'Build {dep} in {target_dir}')
+	configure_args = dependency_configure_args(dep, prefix, upstream_prefixes)
+	# 各步骤分别执行和计时；各依赖并行编译，不能使用 os.chdir
+	steps = [
+		('configure', f"chmod +x configure && ./configure {configure_args}"),
+		('make', f"make -j{jobs}"),
+		('install', "make install"),
+	]
+	for step, step_cmd in steps:
+		if step == 'install':
+			# 测试结果单独汇总，失败时按 --check-failure 只报告或中止安装
+			if CHECKS.inline:
+				CHECKS.run(dep, version, target_dir, jobs, log_dir)
+			elif CHECKS.policy == 'skip':
+				CHECKS.skip(dep, version, 'skipped by --check skip')
+		log_path = os.path.join(log_dir, f"{dep}-{step}.log.gz")
+		while True:
+			with PROFILER.stage(f"{dep} {step}", step):
+				returncode, tail = run_logged(step_cmd, log_path, cwd=target_dir, env=BUILD_ENV, label=dep)
+			# 内存不足导致编译失败时减少并行数继续编译，已编译的目标文件会保留
+			if step == 'make' and returncode != 0 and jobs > 1 and looks_out_of_memory(returncode, tail):
+				jobs = max(1, jobs // 2)
+				logging.info(f"{dep} make ran out of memory, retry with {jobs} jobs.")
+				step_cmd = f"make -j{jobs}"
+				continue
+			break
+		report_command(f"{dep}-{version} {step}", returncode, tail, log_path)
+		if returncode != 0:
+			raise RuntimeError(f"{dep}-{version} {step} failed with code {returncode}")
+	if CHECKS.policy == 'deferred':
+		CHECKS.submit(dep, version, target_dir, jobs, log_dir)
+
 
 # 安装依赖
-def install_dependencies(URL_DEP_MAP, mpinum, DEP_DIR, INTEL_PATH,compat_map, install_dir):
+def install_dependencies(URL_DEP_MAP, mpinum, DEP_DIR, INTEL_PATH,compat_map, install_dir, journal, fingerprints):
 
 	target_path = os.path.join(INTEL_PATH, "mpi/latest")
 	if not os.path.exists(target_path):
 		logging.info(f"Error: Path {target_path} does not exist.")
 	elif not os.path.exists(os.path.join(DEP_DIR, 'mpi')):
 		logging.info(f"Target path {target_path} exists, creating symbolic link...")
-		subprocess.run(
-			["bash", "-c",
-			 f"source {CONFIG_DIR}/set_env.sh && ln -sf {target_path} {DEP_DIR}/mpi"]
-		)
+		mpi_link = os.path.join(DEP_DIR, 'mpi')
+		if os.path.lexists(mpi_link):
+			os.remove(mpi_link)
+		os.symlink(target_path, mpi_link)
 	else:
 		logging.info(f"Target path {target_path} is already exists, continue")
+
+	build_list = []
 	for dep in dep_list:
-		logging.info(f"Download: {dep}.")
-		if dep in compat_map.keys():
-			version = compat_map[dep]
-		url_pattern = URL_DEP_MAP.get(f"{dep}")
-		if url_pattern:
-			url = url_pattern.replace("%v", version)
-			src_file = os.path.join(install_dir, "src", f"{dep}-{version}.tar.gz")
-			install_dir_dep = os.path.join(install_dir, "deps")
-
-			if os.path.isdir(os.path.join(install_dir_dep,dep)):
-				logging.info(f"Dependency {dep}-{version} already installed.")
-				continue
+		if dep not in compat_map or not URL_DEP_MAP.get(dep):
+			logging.info(f"Skip {dep}: no version or url configured.")
+			continue
+		if journal.is_done(dep, fingerprints[dep]):
+			logging.info(f"Dependency {dep}-{compat_map[dep]} already installed.")
+			continue
+		build_list.append(dep)
 
-			if not os.path.exists(src_file):
-				download_file_with_wget(url, src_file)
-
-			logging.info(f"Compiling {dep}-{version}...")
-			src_dir = os.path.join(install_dir, "src")
-			# 计算目标目录名称
-			src_file_basename = os.path.basename(src_file)
-			package_base = src_file_basename
-			# 去除所有常见压缩扩展名
-			for ext in ['.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
-						'.tar.xz', '.txz', '.zip', '.gz',
-						'.bz2', '.xz', '.tar']:
-				if package_base.lower().endswith(ext):
-					package_base = package_base[:-len(ext)]
-					break
+	prefixes = {dep: store_prefix(dep, compat_map[dep], fingerprints[dep]) for dep in dep_list if dep in fingerprints}
 
-			target_dir = os.path.join(src_dir, package_base)
-			os.makedirs(target_dir, exist_ok=True)
+	def build(dep, jobs):
+		version = compat_map[dep]
+		url = URL_DEP_MAP[dep].replace("%v", version)
+		upstream_prefixes = [prefixes[up] for up in dependency_closure(dep, Common.dep_graph) if up in prefixes]
+		source = build_dependency(dep, version, url, jobs, install_dir, fingerprints[dep], upstream_prefixes)
+		journal.record(dep, fingerprints[dep], version=version, url=url, prefix=prefixes[dep], source=source)
 
-			try:
-				extract_file(src_file, target_dir)
-				# 整理目录结构
-				normalize_extracted_dir(target_dir)
-			except Exception as e:
-				shutil.rmtree(target_dir, ignore_errors=True)
-				raise
-			logging.info(f'Enter dir to {target_dir}')
-			os.chdir(target_dir)
-			if 'netcdf' in dep:
-				result = subprocess.run(
-					["bash", "-c",
-					 f"source {CONFIG_DIR}/set_env.sh && chmod +x configure && ./configure --prefix={install_dir_dep} CPPFLAGS=-I{install_dir_dep}/include LDFLAGS=-L{install_dir_dep}/lib --disable-dap && make -j{mpinum} && make check || true && make install"],
-					capture_output=True,  # 捕获标准输出和标准错误
-					text=True  # 使输出为字符串而非字节
-				)
-			elif 'hdf5' in dep:
-				result = subprocess.run(
-					["bash", "-c",
-					 f"source {CONFIG_DIR}/set_env.sh && chmod +x configure && ./configure --prefix={install_dir_dep} --enable-fortran && make -j{mpinum} && make check && make install"],
-					capture_output=True,  # 捕获标准输出和标准错误
-					text=True  # 使输出为字符串而非字节
-				)
-			else:
-				result = subprocess.run(
-					["bash", "-c",
-					 f"source {CONFIG_DIR}/set_env.sh && chmod +x configure && ./configure --prefix={install_dir_dep} && make -j{mpinum} && make check && make install"],
-					capture_output=True,  # 捕获标准输出和标准错误
-					text=True  # 使输出为字符串而非字节
-				)
-			if result.returncode != 0:
-				logging.info("Error occurred during execution:")
-				logging.info("STDOUT:", result.stdout)
-				logging.info("STDERR:", result.stderr)
-			else:
-				logging.info("Command executed successfully.")
-				# logging.info("STDOUT:", result.stdout)
+	run_dependency_graph(build_list, Common.dep_graph, build, mpinum)
 # 编译WRF
-def compile_wrf(install_dir, wrf_version, compiler_type, URL_WRF_MAP):
-	wrf_src = os.path.join(install_dir, "src", f"WRF-{wrf_version}")
+def compile_wrf(install_dir, wrf_version, compiler_type, URL_WRF_MAP, variant, clean=False, jobs=1, budget=None):
+	"""
+	下载、解压并编译一个 WRF 变体，每个变体在自己的源码目录中编译。
+
+	参数:
+	- variant: build_variants 生成的变体
+	- clean: 是否先清除上次的编译结果
+	- jobs: WRF compile 的 make 并行数，指定 budget 时不使用
+	- budget: 由 MemoryGovernor 按内存调整的 JobPool，每次编译前取其中未被 WPS 占用的任务数作为 J
+	"""
+	wrf_src = wrf_source_dir(install_dir, wrf_version, variant)
+	# 本变体的编译环境，WRF_DIR 指向本变体的源码目录
+	wrf_env = dict(BUILD_ENV if BUILD_ENV is not None else os.environ, WRF_DIR=wrf_src)
 	wrf_tar = os.path.join(install_dir, "src", "WRF.tar.gz")
 	if not os.path.isdir(wrf_src):
 		wrf_url = URL_WRF_MAP['wrf']
-		download_file_with_wget(wrf_url, os.path.join(install_dir, "src", "WRF.tar.gz"))
+		fetch_file(wrf_url, wrf_tar)
 		# 目标目录名称
 
 		os.makedirs(wrf_src, exist_ok=True)
 		try:
-			extract_file(wrf_tar, wrf_src)
-			# 整理目录结构
-			normalize_extracted_dir(wrf_src)
+			with PROFILER.stage("wrf extract", 'extract'):
+				extract_file(wrf_tar, wrf_src, strip_top=True)
 		except Exception as e:
 			shutil.rmtree(wrf_src, ignore_errors=True)
 			raise
-	###编译wrf
-	os.chdir(wrf_src)
-	try:
-		subprocess.run(["clean", "-a"])
-	except:
+		# 版本相关的源码修改只在解压后执行一次
 		wrf_set_sh = os.path.join(CONFIG_DIR, 'src', 'wrf_version_set', f'wrf_{wrf_version}.sh')
-		subprocess.run(["bash", "-c",f"source {CONFIG_DIR}/set_env.sh && chmod +x {wrf_set_sh} && bash {wrf_set_sh}"])
-		logging.info("Select compilation options:")
-		if compiler_type == "intel":
-			subprocess.run(
-				["bash", "-c",
-				 f"source {CONFIG_DIR}/set_env.sh && chmod +x configure && ./configure"],input="15 1\n",
-				capture_output=True,  # 捕获标准输出和标准错误
-				text=True  # 使输出为字符串而非字节
-			)
+		if os.path.exists(wrf_set_sh):
+			subprocess.run(["bash", wrf_set_sh], cwd=wrf_src, env=wrf_env)
+	# 删除上次编译留下的 I/O 库，同时编译的 WPS 只能用到本次编译生成的库
+	for path in Common.wrf_io_libs:
+		if os.path.exists(os.path.join(wrf_src, path)):
+			os.remove(os.path.join(wrf_src, path))
+	###编译wrf
+	log_dir = os.path.join(install_dir, "logs")
+	if clean and os.path.exists(os.path.join(wrf_src, "configure.wrf")):
+		# 依赖或编译参数变化，清除上次编译结果
+		logging.info("Clean previous WRF build.")
+		with PROFILER.stage("wrf clean", 'clean'):
+			run_logged("./clean -a", os.path.join(log_dir, f"wrf-{variant['tag']}-clean.log.gz"), cwd=wrf_src, env=wrf_env)
+	logging.info("Select compilation options:")
+	if compiler_type == "intel":
+		log_path = os.path.join(log_dir, f"wrf-{variant['tag']}-configure.log.gz")
+		with PROFILER.stage(f"wrf {variant['tag']} configure", 'configure'):
+			returncode, tail = run_logged("chmod +x configure && ./configure", log_path,
+										  cwd=wrf_src, input=variant['wrf_input'], env=wrf_env)
+		report_command(f"WRF {variant['tag']} configure", returncode, tail, log_path)
+		if returncode != 0 or not os.path.exists(os.path.join(wrf_src, "configure.wrf")):
+			logging.info("Error: WRF configure failed.")
+			sys.exit(1)
+		apply_wrf_flags(os.path.join(wrf_src, "configure.wrf"), variant['flags'])
 
 		# elif compiler_type == "gcc":
 		# 	subprocess.run(["./configure"], input="34 1\n", text=True)
 
-	subprocess.run(["bash", "-c",
-				 f"source {CONFIG_DIR}/set_env.sh && ./compile em_real >& wrfcom.log"])
+	log_path = os.path.join(log_dir, f"wrf-{variant['tag']}-compile.log.gz")
+	fixed_jobs = jobs
+
+	def budget_jobs():
+		# 运行中的 make 不能改变并行数，每次启动编译时按当前预算确定
+		return max(1, budget.available) if budget is not None else fixed_jobs
+
+	jobs = budget_jobs()
+	while True:
+		# WRF 的 compile 脚本通过环境变量 J 设置 make 并行数
+		if budget is not None:
+			logging.info(f"Compile WRF {variant['tag']} with J=-j {jobs} (job budget {budget.total}, "
+						 f"{budget.total - budget.available} held by WPS, MemAvailable {available_memory_mb()} MB)")
+		else:
+			logging.info(f"Compile WRF {variant['tag']} with J=-j {jobs}")
+		env = dict(wrf_env, J=f"-j {jobs}")
+		with PROFILER.stage(f"wrf {variant['tag']} compile", 'make'):
+			returncode, tail = run_logged("./compile em_real", log_path, cwd=wrf_src, env=env, label=f"wrf-{variant['tag']}")
+		missing_files = [file for file in ["wrf.exe", "real.exe"] if not os.path.exists(os.path.join(wrf_src, "main", file))]
+		# compile 脚本的返回码不可靠，以可执行文件是否生成为准
+		if missing_files and jobs > 1 and looks_out_of_memory(returncode, tail):
+			jobs = max(1, min(jobs // 2, budget_jobs()))
+			logging.info(f"WRF compile ran out of memory, retry with J=-j {jobs}.")
+			continue
+		break
+	report_command(f"WRF {variant['tag']} compile", returncode, tail, log_path)
 	required_files = ["wrf.exe", "real.exe", "tc.exe", "ndown.exe"]
 	missing_files = [file for file in required_files if not os.path.exists(os.path.join(wrf_src, "main", file))]
 
@@ -332,59 +2393,690 @@ def compile_wrf(install_dir, wrf_version, compiler_type, URL_WRF_MAP):
 		sys.exit(1)
 
 
-def compile_wps(install_dir, wps_version, compiler_type, URL_WRF_MAP):
+def wait_for_wrf_io(wrf_src, wrf_finished, not_before=None):
+	"""
+	等待 WRF 的外部 I/O 库编译完成：Common.wrf_io_libs 中的文件都已生成，
+	并且在 Common.wrf_io_stable_secs 秒内没有变化。
+	修改时间早于 not_before 的文件是上次编译留下的，视为尚未生成。
+
+	参数:
+	- wrf_src: WRF 源码目录
+	- wrf_finished: WRF 编译结束（成功或失败）时设置的 threading.Event
+	- not_before: 本次 WRF 编译开始的时间戳
+
+	返回:
+	- bool: I/O 库可用时为 True；WRF 编译已结束但库不完整时为 False
+	"""
+	paths = [os.path.join(wrf_src, path) for path in Common.wrf_io_libs]
+	last_state = None
+	stable_since = None
+	while True:
+		finished = wrf_finished.is_set()
+		try:
+			state = [(os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+		except OSError:
+			state = None
+		# 文件系统的时间精度可能只到秒
+		if state is not None and not_before is not None and any(mtime < int(not_before) for _, mtime in state):
+			state = None
+		if state is None:
+			if finished:
+				return False
+		elif finished:
+			return True
+		elif state == last_state:
+			if time.time() - stable_since >= Common.wrf_io_stable_secs:
+				return True
+		else:
+			last_state = state
+			stable_since = time.time()
+		wrf_finished.wait(Common.wrf_io_poll_interval)
+
+
+def compile_wps(install_dir, wps_version, compiler_type, URL_WRF_MAP, variant, clean=False, wait_for_wrf=None):
+	"""
+	下载、解压并编译 WPS，使用主 WRF 变体（环境变量 WRF_DIR）的 I/O 库。
+
+	参数:
+	- variant: 主 WRF 变体，决定 WPS 的 configure 选项（串行或 dmpar）
+	- wait_for_wrf: WRF 正在编译时传入，configure 之前调用，等待 WRF 的 I/O 库可用；返回 False 表示 WRF 编译失败
+
+	返回:
+	- bool: 是否编译成功；WRF 编译失败导致未编译时返回 False
+	"""
 	wps_src = os.path.join(install_dir, "src", f"WPS-{wps_version}")
 	wps_tar = os.path.join(install_dir, "src", "WPS.tar.gz")
 	if not os.path.isdir(wps_src):
 		wrf_url = URL_WRF_MAP['wps']
-		download_file_with_wget(wrf_url, os.path.join(install_dir, "src", "WPS.tar.gz"))
+		fetch_file(wrf_url, wps_tar)
 		# 目标目录名称
 
 		os.makedirs(wps_src, exist_ok=True)
 		try:
-			extract_file(wps_tar, wps_src)
-			# 整理目录结构
-			normalize_extracted_dir(wps_src)
+			with PROFILER.stage("wps extract", 'extract'):
+				extract_file(wps_tar, wps_src, strip_top=True)
 		except Exception as e:
 			shutil.rmtree(wps_src, ignore_errors=True)
 			raise
-	###编译wrf
-	os.chdir(wps_src)
-	try:
-		subprocess.run(["clean", "-a"])
-	except:
-		logging.info("Select compilation options:")
-		if compiler_type == "intel":
-			subprocess.run(
-				["bash", "-c",
-				 f"source {CONFIG_DIR}/set_env.sh && chmod +x configure && ./configure"], input="19 \n",
-				capture_output=True,  # 捕获标准输出和标准错误
-				text=True  # 使输出为字符串而非字节
-			)
-			wps_set_sh = os.path.join(CONFIG_DIR, 'src', 'wps_version_set', f'wps_{wps_version}.sh')
-			subprocess.run(["bash", "-c",f"source {CONFIG_DIR}/set_env.sh && chmod +x {wps_set_sh} && bash {wps_set_sh}"])
-	subprocess.run(["bash", "-c",
-	                f"source {CONFIG_DIR}/set_env.sh && ./compile  >& wpscom.log"])
+	###编译wps
+	log_dir = os.path.join(install_dir, "logs")
+	if clean and os.path.exists(os.path.join(wps_src, "configure.wps")):
+		# WRF 或编译参数变化，清除上次编译结果
+		logging.info("Clean previous WPS build.")
+		with PROFILER.stage("wps clean", 'clean'):
+			run_logged("./clean -a", os.path.join(log_dir, "wps-clean.log.gz"), cwd=wps_src, env=BUILD_ENV)
+	if wait_for_wrf is not None:
+		logging.info("Waiting for WRF I/O libraries before configuring WPS...")
+		with PROFILER.stage("wps wait for wrf", 'wait'):
+			ready = wait_for_wrf()
+		if not ready:
+			logging.info("WRF build stopped before its I/O libraries were ready, WPS is not compiled.")
+			return False
+		logging.info("WRF I/O libraries are ready, start WPS build alongside WRF.")
+	logging.info("Select compilation options:")
+	if compiler_type == "intel":
+		log_path = os.path.join(log_dir, "wps-configure.log.gz")
+		with PROFILER.stage("wps configure", 'configure'):
+			returncode, tail = run_logged("chmod +x configure && ./configure", log_path,
+										  cwd=wps_src, input=variant['wps_input'], env=BUILD_ENV)
+		report_command("WPS configure", returncode, tail, log_path)
+		if returncode != 0 or not os.path.exists(os.path.join(wps_src, "configure.wps")):
+			logging.info("Error: WPS configure failed.")
+			sys.exit(1)
+		wps_set_sh = os.path.join(CONFIG_DIR, 'src', 'wps_version_set', f'wps_{wps_version}.sh')
+		subprocess.run(["bash", wps_set_sh], cwd=wps_src, env=BUILD_ENV)
+	log_path = os.path.join(log_dir, "wps-compile.log.gz")
+	with PROFILER.stage("wps compile", 'make'):
+		returncode, tail = run_logged("./compile", log_path, cwd=wps_src, env=BUILD_ENV, label="wps")
+	report_command("WPS compile", returncode, tail, log_path)
+	# WPS 的可执行文件链接在源码根目录下
 	required_files = ["geogrid.exe", "ungrib.exe", "metgrid.exe"]
-	missing_files = [file for file in required_files if not os.path.exists(os.path.join(wps_src, "main", file))]
+	missing_files = [file for file in required_files if not os.path.exists(os.path.join(wps_src, file))]
 	if missing_files:
 		logging.info("Error: WPS compilation failed.")
 		sys.exit(1)
-# 生成环境文件
-# def generate_env(WRF_VERSION, install_dir, compiler_type):
-# 	env_file = os.path.join(install_dir, "env_set.sh")
-# 	with open(env_file, 'w') as f:
-# 		f.write(f'export WRF_BASE="{install_dir}"\n')
-# 		f.write(f'export PATH="${{WRF_BASE}}/deps/netcdf/bin:$PATH"\n')
-# 		f.write(f'export NETCDF="${{WRF_BASE}}/deps/netcdf"\n')
-# 		f.write(f'export JASPERLIB="${{WRF_BASE}}/deps/jasper/lib"\n')
-# 		f.write(f'export JASPERINC="${{WRF_BASE}}/deps/jasper/include"\n')
-# 		f.write(f'export WRF_DIR="${{WRF_BASE}}/WRF-{WRF_VERSION}"\n')
-# 		f.write(f'export WPS_DIR="${{WRF_BASE}}/WPS-{WRF_VERSION}"\n')
-#
-# 		if compiler_type == "intel":
-# 			f.write(f'source "${{WRF_BASE}}/compiler/setvars.sh"\n')
-# 			f.write(f'export CC=icc CXX=icpc FC=ifort\n')
+	return True
+
+
+# WRF 每个时间步输出的耗时，如 "Timing for main: time 0001-01-01_00:00:12 on domain   1:    0.12345 elapsed seconds"
+WRF_TIMING_RE = re.compile(r"Timing for main:.*?on domain\s+\d+:\s+([\d.]+) elapsed seconds")
+
+
+def parse_wrf_timings(text):
+	"""从 WRF 的输出中提取每个时间步的耗时（秒）"""
+	return [float(value) for value in WRF_TIMING_RE.findall(text)]
+
+
+def set_namelist(path, values):
+	"""
+	修改 namelist.input 中的参数，不存在的参数加到 &time_control 中。
+
+	参数:
+	- path: namelist.input 路径
+	- values: 参数名 -> 值（所有嵌套区域使用同一个值）
+	"""
+	with open(path) as f:
+		text = f.read()
+	for key, value in values.items():
+		pattern = re.compile(rf"^(\s*{key}\s*=\s*)[^\n!]*", re.M | re.I)
+		if pattern.search(text):
+			text = pattern.sub(lambda m: f"{m.group(1)}{value},", text, count=1)
+		else:
+			text = re.sub(r"^(\s*&time_control\s*)$", lambda m: f"{m.group(1)}\n {key} = {value},", text, count=1, flags=re.M | re.I)
+	with open(path, 'w') as f:
+		f.write(text)
+
+
+def benchmark_layouts(mode, ranks, threads):
+	"""按变体的并行方式生成 (MPI 进程数, OpenMP 线程数) 组合，超过 CPU 核数的组合不运行"""
+	cpus = os.cpu_count() or 1
+	ranks = ranks if mode in ('dmpar', 'dm+sm') else [1]
+	threads = threads if mode in ('smpar', 'dm+sm') else [1]
+	return [(r, t) for r in ranks for t in threads if r * t <= cpus] or [(1, 1)]
+
+
+def run_wrf_benchmark(install_dir, wrf_version, variant, cases, ranks, threads, jobs):
+	"""
+	编译并运行不需要外部数据的 WRF 理想算例，在不同 MPI 进程数和 OpenMP 线程数下测量性能。
+
+	变体的编译目录复制到 benchmarks/<变体>/WRF 后编译理想算例，不影响用于生产的 em_real 编译结果。
+	每个组合记录每步平均耗时、相对最小核数组合的加速比和并行效率，以及单个进程的峰值内存
+	（来自 wait4，多进程时是内存最大的一个 rank，不是所有 rank 之和）。
+	任一算例编译或运行失败时写出结果后退出。
+
+	参数:
+	- variant: WRF 变体
+	- cases: 理想算例列表，如 em_quarter_ss、em_b_wave
+	- ranks: MPI 进程数列表
+	- threads: OpenMP 线程数列表
+	- jobs: 编译理想算例的 make 并行数
+
+	返回:
+	- str: 结果 JSON 文件路径
+	"""
+	bench_root = os.path.join(install_dir, "benchmarks")
+	bench_src = os.path.join(bench_root, variant['tag'], "WRF")
+	log_dir = os.path.join(install_dir, "logs")
+	wrf_src = wrf_source_dir(install_dir, wrf_version, variant)
+	# 变体重新编译后重新复制
+	source_stamp = str(os.path.getmtime(os.path.join(wrf_src, "main", "wrf.exe")))
+	stamp_path = os.path.join(bench_src, ".source_stamp")
+	copied_stamp = None
+	if os.path.exists(stamp_path):
+		with open(stamp_path) as f:
+			copied_stamp = f.read()
+	if copied_stamp != source_stamp:
+		logging.info(f"Copy WRF {variant['tag']} build to {bench_src}")
+		shutil.rmtree(bench_src, ignore_errors=True)
+		shutil.copytree(wrf_src, bench_src, symlinks=True)
+		with open(stamp_path, 'w') as f:
+			f.write(source_stamp)
+	env = dict(BUILD_ENV if BUILD_ENV is not None else os.environ, WRF_DIR=bench_src, J=f"-j {jobs}")
+	results = []
+	failures = []
+	for case in cases:
+		# 所有算例在同一目录中编译，先删除上一个算例的可执行文件，避免编译失败时计时的是旧程序
+		executables = [os.path.join(bench_src, "main", exe) for exe in ("ideal.exe", "wrf.exe")]
+		for exe in executables:
+			if os.path.lexists(exe):
+				os.remove(exe)
+		log_path = os.path.join(log_dir, f"bench-{variant['tag']}-{case}-compile.log.gz")
+		with PROFILER.stage(f"bench {variant['tag']} {case} compile", 'make'):
+			returncode, tail = run_logged(f"./compile {case}", log_path, cwd=bench_src, env=env, label=f"bench-{case}")
+		if returncode != 0 or not all(os.path.exists(exe) for exe in executables):
+			report_command(f"Benchmark {case} compile", returncode or 1, tail, log_path)
+			failures.append(f"{case} compile")
+			continue
+		run_dir = os.path.join(bench_src, "test", case)
+		namelist = os.path.join(run_dir, "namelist.input")
+		with open(namelist) as f:
+			match = re.search(r"^\s*time_step\s*=\s*(\d+)", f.read(), re.M | re.I)
+		time_step = int(match.group(1)) if match else 60
+		# 只运行固定的步数，不输出历史文件，避免 I/O 影响计时
+		set_namelist(namelist, {'run_days': 0, 'run_hours': 0, 'run_minutes': 0,
+								'run_seconds': time_step * Common.bench_steps, 'history_interval': 100000})
+		log_path = os.path.join(log_dir, f"bench-{variant['tag']}-{case}-ideal.log.gz")
+		returncode, tail = run_logged("ulimit -s unlimited 2>/dev/null; ./ideal.exe", log_path, cwd=run_dir, env=env, label=f"bench-{case}")
+		if returncode != 0 or not os.path.exists(os.path.join(run_dir, "wrfinput_d01")):
+			report_command(f"Benchmark {case} ideal.exe", returncode or 1, tail, log_path)
+			failures.append(f"{case} ideal.exe")
+			continue
+
+		for nranks, nthreads in benchmark_layouts(variant['mode'], ranks, threads):
+			for rsl in os.listdir(run_dir):
+				if rsl.startswith('rsl.'):
+					os.remove(os.path.join(run_dir, rsl))
+			launcher = f"{Common.bench_mpirun} -np {nranks} " if variant['mode'] in ('dmpar', 'dm+sm') else ""
+			run_env = dict(env, OMP_NUM_THREADS=str(nthreads), **Common.bench_env)
+			log_path = os.path.join(log_dir, f"bench-{variant['tag']}-{case}-{nranks}x{nthreads}.log.gz")
+			logging.info(f"Benchmark {variant['tag']} {case}: {nranks} ranks x {nthreads} threads")
+			started = time.time()
+			with PROFILER.stage(f"bench {variant['tag']} {case} {nranks}x{nthreads}", 'benchmark') as event:
+				returncode, tail = run_logged(f"ulimit -s unlimited 2>/dev/null; {launcher}./wrf.exe", log_path,
+											  cwd=run_dir, env=run_env, label=f"bench-{case}")
+			wall = time.time() - started
+			# dmpar 的计时输出在 rsl.error.0000，串行和 smpar 在标准输出
+			rsl_path = os.path.join(run_dir, "rsl.error.0000")
+			if os.path.exists(rsl_path):
+				with open(rsl_path, errors='replace') as f:
+					timings = parse_wrf_timings(f.read())
+			else:
+				with gzip.open(log_path, 'rt', errors='replace') as f:
+					timings = parse_wrf_timings(f.read())
+			# 第一步包含初始化，不参与平均
+			steps = timings[1:] or timings
+			result = {
+				'case': case,
+				'ranks': nranks,
+				'threads': nthreads,
+				'returncode': returncode,
+				'steps': len(timings),
+				'time_per_step': sum(steps) / len(steps) if steps else None,
+				'wall': round(wall, 2),
+				'max_rss_per_process_kb': event['max_rss_kb'],
+				'log': log_path,
+			}
+			if returncode != 0 or not steps:
+				report_command(f"Benchmark {case} {nranks}x{nthreads}", returncode or 1, tail, log_path)
+				failures.append(f"{case} {nranks}x{nthreads}")
+			results.append(result)
+
+	# 以每个算例中核数最少的组合为基准计算加速比和并行效率
+	for case in cases:
+		runs = [r for r in results if r['case'] == case and r['time_per_step']]
+		if not runs:
+			continue
+		base = min(runs, key=lambda r: r['ranks'] * r['threads'])
+		base_cores = base['ranks'] * base['threads']
+		for r in runs:
+			cores = r['ranks'] * r['threads']
+			r['speedup'] = round(base['time_per_step'] / r['time_per_step'], 3)
+			r['efficiency'] = round(r['speedup'] * base_cores / cores, 3)
+			logging.info(f"Benchmark {variant['tag']} {case} {r['ranks']}x{r['threads']}: "
+						 f"{r['time_per_step']:.4f} s/step, speedup {r['speedup']}, efficiency {r['efficiency']:.0%}, "
+						 f"peak RSS per process {r['max_rss_per_process_kb'] / 1024:.0f} MB")
+
+	report = {
+		'host': os.uname().nodename,
+		'cpu': cpu_model(),
+		'cpus': os.cpu_count(),
+		'wrf_version': wrf_version,
+		'variant': variant,
+		'steps': Common.bench_steps,
+		'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+		'results': results,
+		'failures': failures,
+	}
+	os.makedirs(bench_root, exist_ok=True)
+	result_path = os.path.join(bench_root, f"{variant['tag']}-{os.uname().nodename}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+	with open(result_path, 'w') as f:
+		json.dump(report, f, indent=2)
+	logging.info(f"Benchmark results written to {result_path}")
+	if failures:
+		logging.info(f"Error: Benchmark failed - {', '.join(failures)}")
+		sys.exit(1)
+	return result_path
+
+
+def cpu_model(cpuinfo='/proc/cpuinfo'):
+	"""返回 CPU 型号，无法获取时返回 None"""
+	try:
+		with open(cpuinfo) as f:
+			for line in f:
+				if line.startswith('model name'):
+					return line.split(':', 1)[1].strip()
+	except OSError:
+		pass
+	return None
+
+
+# ldd 输出中解析到的库，如 "libnetcdf.so.19 => /path/libnetcdf.so.19 (0x...)"
+LDD_RE = re.compile(r"^\s*(\S+)\s+=>\s+(/\S+)\s+\(0x[0-9a-f]+\)", re.M)
+
+
+def is_system_library(path):
+	"""系统目录中的库（libc 等）不复制，由动态链接器的默认路径查找"""
+	return any(path.startswith(directory.rstrip('/') + '/') for directory in Common.finalize_system_dirs)
+
+
+def library_closure(executables, env):
+	"""
+	用 ldd 解析可执行文件依赖的全部非系统动态库。
+
+	返回:
+	- dict: soname -> 实际路径；无法解析的库的路径为 None
+	"""
+	closure = {}
+	for exe in executables:
+		result = subprocess.run(["ldd", exe], env=env, capture_output=True, text=True)
+		for soname, path in LDD_RE.findall(result.stdout):
+			if not is_system_library(path):
+				closure.setdefault(soname, os.path.realpath(path))
+		for line in result.stdout.splitlines():
+			if '=> not found' in line:
+				closure[line.split()[0]] = None
+	return closure
+
+
+def is_elf(path):
+	"""文件是否为 ELF 格式"""
+	try:
+		with open(path, 'rb') as f:
+			return f.read(4) == b'\x7fELF'
+	except OSError:
+		return False
+
+
+def has_elf_interpreter(path):
+	"""
+	读取 ELF 程序头，判断文件是否有 PT_INTERP（由动态链接器加载）。
+	静态链接的程序和非 ELF 文件返回 False。
+	"""
+	try:
+		with open(path, 'rb') as f:
+			ident = f.read(16)
+			if ident[:4] != b'\x7fELF' or ident[4] not in (1, 2) or ident[5] not in (1, 2):
+				return False
+			is64 = ident[4] == 2
+			order = '<' if ident[5] == 1 else '>'
+			header = f.read(48 if is64 else 36)
+			if is64:
+				phoff, = struct.unpack_from(order + 'Q', header, 16)
+				phentsize, phnum = struct.unpack_from(order + 'HH', header, 38)
+			else:
+				phoff, = struct.unpack_from(order + 'I', header, 12)
+				phentsize, phnum = struct.unpack_from(order + 'HH', header, 26)
+			for index in range(phnum):
+				f.seek(phoff + index * phentsize)
+				p_type, = struct.unpack(order + 'I', f.read(4))
+				if p_type == 3:  # PT_INTERP
+					return True
+	except (OSError, struct.error):
+		return False
+	return False
+
+
+def measure_library_loading(executables, env, runs=None):
+	"""
+	测量可执行文件启动时动态库查找的开销：用 LD_TRACE_LOADED_OBJECTS 只加载库不运行程序，
+	用 LD_DEBUG=libs 统计尝试打开的文件数。
+	LD_TRACE_LOADED_OBJECTS 只对由动态链接器加载的程序有效，静态链接或非 ELF 的文件会被真正运行，
+	因此没有 PT_INTERP 的文件跳过，每次运行也有超时限制。
+
+	返回:
+	- dict: 可执行文件名 -> {'probes': 尝试次数, 'libraries': 加载的库数, 'missing': 找不到的库数, 'seconds': 加载耗时中位数}
+	"""
+	runs = runs or Common.finalize_timing_runs
+	report = {}
+	for exe in executables:
+		if not has_elf_interpreter(exe):
+			logging.info(f"Finalize: {exe} is not a dynamically linked ELF executable, skip load timing.")
+			continue
+		trace_env = dict(env, LD_TRACE_LOADED_OBJECTS='1', LD_DEBUG='libs')
+		timings = []
+		try:
+			for _ in range(runs):
+				started = time.perf_counter()
+				result = subprocess.run([exe], env=trace_env, capture_output=True, text=True,
+										timeout=Common.finalize_timeout)
+				timings.append(time.perf_counter() - started)
+		except subprocess.TimeoutExpired:
+			logging.info(f"Finalize: loading {exe} timed out after {Common.finalize_timeout} s, skip load timing.")
+			continue
+		report[os.path.basename(exe)] = {
+			'probes': result.stderr.count('trying file='),
+			'libraries': len(LDD_RE.findall(result.stdout)),
+			'missing': result.stdout.count('not found'),
+			'seconds': sorted(timings)[len(timings) // 2],
+		}
+	return report
+
+
+def finalize_install(install_dir, executables, strip=False):
+	"""
+	整理运行环境：把可执行文件依赖的非系统动态库（依赖库和 oneAPI 运行库）复制到 install_dir/lib，
+	用 patchelf 把可执行文件的 RPATH 设为该目录（DT_RPATH，对间接依赖同样有效），库的 RPATH 设为 $ORIGIN，
+	运行 WRF 不再需要覆盖 deps 和整个 oneAPI 的 LD_LIBRARY_PATH。可选去掉调试信息。
+	前后分别测量动态库查找的开销。
+
+	参数:
+	- install_dir: 安装根目录
+	- executables: WRF/WPS 可执行文件路径
+	- strip: 是否去掉可执行文件和复制的库中的调试信息
+
+	返回:
+	- dict: 整理前后的测量结果，同时写入 install_dir/finalize.json
+	"""
+	executables = sorted({os.path.realpath(exe) for exe in executables if os.path.exists(exe)})
+	if not executables:
+		logging.info("Finalize: no executables found, skip.")
+		return None
+	build_env = BUILD_ENV if BUILD_ENV is not None else dict(os.environ)
+	before = measure_library_loading(executables, build_env)
+
+	lib_dir = os.path.join(install_dir, "lib")
+	os.makedirs(lib_dir, exist_ok=True)
+	closure = library_closure(executables, build_env)
+	missing = [soname for soname, path in closure.items() if path is None]
+	if missing:
+		logging.info(f"Finalize: libraries not found in the build environment: {', '.join(missing)}")
+	libraries = []
+	for soname, path in sorted(closure.items()):
+		if path is None:
+			continue
+		dest = os.path.join(lib_dir, soname)
+		shutil.copy2(path, dest)
+		os.chmod(dest, os.stat(dest).st_mode | 0o200)
+		libraries.append(dest)
+	logging.info(f"Finalize: copied {len(libraries)} libraries to {lib_dir}")
+
+	patchelf = shutil.which(Common.finalize_patchelf)
+	if patchelf:
+		for exe in executables:
+			rpath = os.path.join('$ORIGIN', os.path.relpath(lib_dir, os.path.dirname(exe)))
+			subprocess.run([patchelf, "--force-rpath", "--set-rpath", rpath, exe], check=True)
+		for lib in libraries:
+			subprocess.run([patchelf, "--set-rpath", "$ORIGIN", lib], check=True)
+		# 依靠 RPATH 查找，不再设置 LD_LIBRARY_PATH
+		runtime_env = {key: value for key, value in build_env.items() if key != 'LD_LIBRARY_PATH'}
+	else:
+		logging.info(f"Finalize: {Common.finalize_patchelf} not found, RPATH is not rewritten; "
+					 f"set LD_LIBRARY_PATH={lib_dir} to use the consolidated libraries.")
+		runtime_env = dict(build_env, LD_LIBRARY_PATH=lib_dir)
+
+	if strip:
+		for path in executables + libraries:
+			subprocess.run(["strip", "--strip-debug", path])
+		logging.info(f"Finalize: stripped debug sections from {len(executables) + len(libraries)} files")
+
+	after = measure_library_loading(executables, runtime_env)
+	for name in sorted(set(before) & set(after)):
+		b, a = before[name], after[name]
+		logging.info(f"Finalize {name}: library probes {b['probes']} -> {a['probes']}, "
+					 f"load time {b['seconds'] * 1000:.1f} ms -> {a['seconds'] * 1000:.1f} ms"
+					 + (f", {a['missing']} libraries missing" if a['missing'] else ""))
+	report = {'lib_dir': lib_dir, 'libraries': [os.path.basename(lib) for lib in libraries],
+			  'rpath': bool(patchelf), 'strip': strip, 'before': before, 'after': after}
+	with open(os.path.join(install_dir, "finalize.json"), 'w') as f:
+		json.dump(report, f, indent=2)
+	return report
+
+
+def enable_compiler_cache(install_dir, cache_dir):
+	"""同名包装脚本放在 BUILD_ENV 的 PATH 最前面，configure 和 configure.wrf 中的编译器都会经过缓存"""
+	shim_dir = os.path.join(install_dir, 'ccache-bin')
+	compiler_cache.install_shims(shim_dir, Common.ccache_compilers)
+	BUILD_ENV['PATH'] = f"{shim_dir}:{BUILD_ENV.get('PATH', '')}"
+	BUILD_ENV[compiler_cache.CACHE_DIR_ENV] = cache_dir
+	logging.info(f"Compiler cache enabled: {cache_dir}")
+
+
+def report_compiler_cache(cache_dir, offset, max_size):
+	"""输出本次运行的编译器缓存命中统计，并把缓存清理到大小上限以内"""
+	stats = compiler_cache.read_stats(cache_dir, offset)
+	cacheable = stats['hit'] + stats['miss']
+	rate = 100.0 * stats['hit'] / cacheable if cacheable else 0.0
+	logging.info(f"Compiler cache: {stats['hit']} hits, {stats['miss']} misses, "
+				 f"{stats['uncacheable']} uncacheable calls, hit rate {rate:.1f}%")
+	removed = compiler_cache.evict(cache_dir, max_size)
+	if removed:
+		logging.info(f"Compiler cache: evicted {removed} entries to stay under {max_size / 1024 ** 3:.1f} GB")
+
+
+def parse_matrix_targets(specs, default_modes):
+	"""
+	解析 --matrix 的目标列表。
+
+	参数:
+	- specs: 形如 WRF版本[:WPS版本[:并行方式[,并行方式]]] 的字符串列表，WPS 版本默认与 WRF 相同，
+	  并行方式默认使用 --variant；WRF 和 WPS 版本相同的项合并为一个目标，各变体并列编译
+	- default_modes: 默认并行方式列表
+
+	返回:
+	- list: 目标 dict，包含 name、wrf、wps、modes
+	"""
+	targets = {}
+	for spec in specs:
+		parts = spec.split(':')
+		if len(parts) > 3 or not parts[0]:
+			raise ValueError(f"Invalid matrix target '{spec}', expected WRF[:WPS[:MODE[,MODE]]]")
+		wrf_version = parts[0]
+		wps_version = parts[1] if len(parts) > 1 and parts[1] else wrf_version
+		modes = parts[2].split(',') if len(parts) > 2 and parts[2] else list(default_modes)
+		unknown = [mode for mode in modes if mode not in Common.wrf_variants]
+		if unknown:
+			raise ValueError(f"Unknown WRF parallel mode {', '.join(unknown)} in matrix target '{spec}'")
+		name = f"WRF-{wrf_version}_WPS-{wps_version}"
+		target = targets.setdefault(name, {'name': name, 'wrf': wrf_version, 'wps': wps_version, 'modes': []})
+		target['modes'].extend(mode for mode in modes if mode not in target['modes'])
+	return list(targets.values())
+
+
+def matrix_target_command(args, target, isa, jobs):
+	"""矩阵目标子进程的命令行：编译器和依赖已由父进程准备好，子进程按日志跳过它们，只编译 WRF/WPS"""
+	cmd = [sys.executable, os.path.abspath(__file__), '-p', target['dir'], '-wrf', target['wrf'], '-wps', target['wps'],
+		   '-c', args.compiler, '-n', str(jobs), '--variant'] + target['modes'] + [
+		   '--isa', isa, '--download-workers', str(args.download_workers),
+		   '--cache-dir', args.cache_dir, '--cache-size', str(args.cache_size), '--extract-workers', str(args.extract_workers),
+		   '--bundle-dir', args.bundle_dir, '--store-dir', args.store_dir, '--view-mode', args.view_mode]
+	for flag in ('no_cache', 'no_bundle', 'offline', 'ipo', 'finalize', 'strip'):
+		if getattr(args, flag):
+			cmd.append('--' + flag.replace('_', '-'))
+	if args.ccache:
+		cmd += ['--ccache', '--ccache-dir', args.ccache_dir, '--ccache-size', str(args.ccache_size)]
+	return cmd
+
+
+def run_matrix(args, targets, install_dir, compiler_type, mpinum):
+	"""
+	矩阵模式：一次安装多个 WRF/WPS 版本及变体组合。
+
+	所有目标共用 install_dir 下的编译器。各目标的依赖阶段合并为一张图，指纹相同的依赖只编译一次，
+	再链接到每个需要它的目标的 deps 视图。每个目标安装在 install_dir/matrix/<目标名> 下，
+	由一个本脚本的子进程编译 WRF/WPS；目标的依赖完成后子进程即可开始，与其余依赖的编译共享同一个任务预算。
+
+	参数:
+	- args: 命令行参数
+	- targets: parse_matrix_targets 的结果
+	- install_dir: 安装根目录
+	- compiler_type: 编译器类型
+	- mpinum: 全局任务预算
+	"""
+	global BUILD_ENV
+	# 指令集只检测一次，子进程使用相同的结果
+	isa = (detect_isa() or 'none') if args.isa == 'auto' else args.isa
+	for target in targets:
+		target['dir'] = os.path.join(install_dir, 'matrix', target['name'])
+		compat_map, target['name_map'] = parse_config_file(VER_CONFIG, target['wrf'])
+		target['deps'] = compat_map[target['wrf']]
+		target['urls'] = parse_url_config(URL_CONFIG, target['wrf'], target['wps'], compat_map)
+		target['variants'] = build_variants(target['modes'], isa, args.ipo)
+		target['fingerprints'] = compute_stage_fingerprints(target['deps'], *target['urls'], compiler_type,
+															target['wrf'], target['wps'], target['variants'])
+		os.makedirs(os.path.join(target['dir'], 'logs'), exist_ok=True)
+		target['journal'] = StageJournal(os.path.join(target['dir'], 'install_journal.json'))
+	first = targets[0]
+	compiler_fingerprints = {target['fingerprints']['compiler'] for target in targets}
+	if len(compiler_fingerprints) > 1:
+		raise ValueError("Matrix targets require different compiler versions, build them in separate install directories")
+
+	# 合并各目标的依赖阶段，指纹相同即为同一个编译（指纹包含版本、参数和全部上游）
+	nodes = {}
+	for target in targets:
+		target['dep_nodes'] = {}
+		for dep in dep_list:
+			if dep not in target['fingerprints']:
+				continue
+			version = target['deps'][dep]
+			fingerprint = target['fingerprints'][dep]
+			node = f"{dep}-{version}@{fingerprint[:8]}"
+			nodes.setdefault(node, {'dep': dep, 'version': version, 'fingerprint': fingerprint,
+									'url': target['urls'][1][dep].replace("%v", version), 'targets': []})
+			nodes[node]['targets'].append(target)
+			target['dep_nodes'][dep] = node
+	graph = {}
+	for node, info in nodes.items():
+		dep_nodes = info['targets'][0]['dep_nodes']
+		graph[node] = [dep_nodes[up] for up in Common.dep_graph.get(info['dep'], []) if up in dep_nodes]
+
+	for target in targets:
+		logging.info(f"Matrix target {target['name']}: WRF variants {', '.join(variant['tag'] for variant in target['variants'])}")
+		versions = dict(target['deps'], wps=target['wps'])
+		versions.update({wrf_stage(variant): target['wrf'] for variant in target['variants']})
+		show_plan(plan_rebuild(target['fingerprints'], target['journal'], versions), target['fingerprints'])
+	shared = [node for node, info in nodes.items() if len(info['targets']) > 1]
+	logging.info(f"Matrix: {len(targets)} targets, {len(nodes)} distinct dependency builds, shared: {', '.join(shared) or 'none'}")
+	if args.plan:
+		return
+
+	journal = StageJournal(os.path.join(install_dir, 'install_journal.json'))
+	compiler_done = journal.is_done('compiler', first['fingerprints']['compiler'])
+	needed = [node for node, info in nodes.items()
+			  if not all(target['journal'].is_done(info['dep'], info['fingerprint']) for target in info['targets'])]
+	pending = [target for target in targets
+			   if not all(target['journal'].is_done(stage, fingerprint) for stage, fingerprint in target['fingerprints'].items()
+						  if stage != 'compiler' and stage not in target['dep_nodes'])]
+
+	# 共享依赖的源码和日志放在第一个需要它的目标下，不同版本的同名包不会冲突
+	downloads = collect_downloads(first['urls'][0], {}, {}, first['name_map'], first['deps'], Common.intel_file_path,
+								  install_dir, first['wrf'], first['wps'], [], {'compiler'} if compiler_done else ())
+	for node in needed:
+		info = nodes[node]
+		downloads.append((info['url'], dependency_archive(info['targets'][0]['dir'], info['dep'], info['version']),
+						  f"{info['dep']}:{info['version']}"))
+	checksums = parse_checksum_config(URL_CONFIG)
+	for url, _, key in downloads:
+		if key in checksums:
+			ARTIFACT_CHECKSUMS[url] = checksums[key]
+	prefetcher = prefetch_downloads(downloads, args.download_workers)
+	try:
+		intel_path = os.path.join(install_dir, 'compiler')
+		if compiler_done:
+			logging.info(f"Compiler is up to date, skip.")
+			set_compiler_env(compiler_type)
+		else:
+			logging.info(f"Start install compiler.")
+			with PROFILER.stage('compiler', 'phase'):
+				install_compiler(first['urls'][0], Common.intel_file_path, intel_path, first['name_map'], compiler_type, install_dir)
+			if os.path.exists(os.path.join(intel_path, 'setvars.sh')):
+				journal.record('compiler', first['fingerprints']['compiler'], type=compiler_type)
+		# 各目标链接共享的编译器，并记录为已完成，子进程不再安装
+		for target in targets:
+			compiler_link = os.path.join(target['dir'], 'compiler')
+			if not os.path.lexists(compiler_link):
+				os.symlink(intel_path, compiler_link)
+			if not target['journal'].is_done('compiler', target['fingerprints']['compiler']):
+				target['journal'].record('compiler', target['fingerprints']['compiler'], type=compiler_type, shared=intel_path)
+		# 依赖的编译不使用 WRF_DIR/WPS_DIR，各目标的环境由子进程生成
+		BUILD_ENV = apply_env_delta(os.environ, toolchain_env_delta(compiler_type, install_dir, '', ''))
+		if BUNDLE_CACHE is not None:
+			BUNDLE_CACHE.toolchain = compiler_identity(BUILD_ENV)
+		if args.ccache:
+			enable_compiler_cache(install_dir, args.ccache_dir)
+
+		def build_node(node, jobs):
+			info = nodes[node]
+			owner = info['targets'][0]
+			upstream_prefixes = [store_prefix(up, owner['deps'][up], owner['fingerprints'][up])
+								 for up in dependency_closure(info['dep'], Common.dep_graph) if up in owner['dep_nodes']]
+			source = build_dependency(info['dep'], info['version'], info['url'], jobs, owner['dir'], info['fingerprint'], upstream_prefixes)
+			prefix = store_prefix(info['dep'], info['version'], info['fingerprint'])
+			for target in info['targets']:
+				if target is not owner:
+					compose_view(os.path.join(target['dir'], 'deps'), info['dep'], prefix, Common.view_mode)
+				target['journal'].record(info['dep'], info['fingerprint'], version=info['version'], url=info['url'], prefix=prefix, source=source)
+
+		def build_target(target, jobs):
+			cmd = shlex.join(matrix_target_command(args, target, isa, jobs))
+			log_path = os.path.join(install_dir, 'logs', f"matrix-{target['name']}.log.gz")
+			logging.info(f"Start matrix target {target['name']}, full log: {log_path}")
+			with PROFILER.stage(target['name'], 'phase'):
+				# Common.base_dir 取自工作目录，子进程需要在脚本目录下运行
+				returncode, tail = run_logged(cmd, log_path, cwd=CONFIG_DIR, label=target['name'])
+			report_command(f"Matrix target {target['name']}", returncode, tail, log_path)
+			if returncode != 0:
+				raise RuntimeError(f"{target['name']} failed with code {returncode}")
+
+		# 目标依赖自己的全部依赖阶段，依赖完成后即可开始编译
+		by_name = {target['name']: target for target in pending}
+		for target in pending:
+			graph[target['name']] = list(target['dep_nodes'].values())
+
+		def build(name, jobs):
+			if name in nodes:
+				build_node(name, jobs)
+			else:
+				build_target(by_name[name], jobs)
+
+		with PROFILER.stage('matrix', 'phase'):
+			run_dependency_graph(needed + list(by_name), graph, build, mpinum)
+	except BaseException:
+		prefetcher.shutdown(wait=False, cancel_futures=True)
+		raise
+	for target in targets:
+		for variant in target['variants']:
+			logging.info(f"{target['name']} WRF {variant['tag']}: {os.path.join(wrf_source_dir(target['dir'], target['wrf'], variant), 'main', 'wrf.exe')}")
+		logging.info(f"{target['name']} environment: source {os.path.join(target['dir'], 'env_set.sh')}")
 
 
 def parse_config_file(ver_config, wrf_version):
@@ -404,6 +3096,7 @@ def parse_config_file(ver_config, wrf_version):
 	try:
 		with open(ver_config, 'r') as f:
 			section = None
+			name_lines = []
 
 			for line in f:
 				line = line.strip()
@@ -415,9 +3108,12 @@ def parse_config_file(ver_config, wrf_version):
 
 				if section == "compatibility" and "=" in line:
 					parse_compatibility_line(line, compat_map)
-					check_version(wrf_version, compat_map)
 				if section == "name" and "=" in line:
-					parse_name_line(line, compat_map, wrf_version, name_map)
+					name_lines.append(line)
+		# 读完全部版本后检查一次
+		check_version(wrf_version, compat_map)
+		for line in name_lines:
+			parse_name_line(line, compat_map, wrf_version, name_map)
 
 	except FileNotFoundError:
 		logging.info(f"Error: The file '{ver_config}' was not found.")
@@ -426,6 +3122,58 @@ def parse_config_file(ver_config, wrf_version):
 
 	return compat_map, name_map
 
+def parse_mirror_config(url_config):
+	"""
+	解析 URL 配置文件中的 [mirrors] 段。
+
+	参数:
+	- url_config: 配置文件路径
+
+	返回:
+	- dict: 主机名 -> 镜像地址前缀列表
+	"""
+	mirrors = {}
+	try:
+		with open(url_config, 'r') as f:
+			section = None
+			for line in f:
+				line = line.strip()
+				if line.startswith("["):
+					section = line
+				elif section == "[mirrors]" and "=" in line and not line.startswith("#"):
+					host, prefixes = line.split("=", 1)
+					mirrors[host.strip()] = prefixes.split()
+	except FileNotFoundError:
+		logging.info(f"Error: The file '{url_config}' was not found.")
+	return mirrors
+
+
+def parse_checksum_config(url_config):
+	"""
+	解析 URL 配置文件中的 [checksums] 段。
+
+	参数:
+	- url_config: 配置文件路径
+
+	返回:
+	- dict: name:version -> SHA-256
+	"""
+	checksums = {}
+	try:
+		with open(url_config, 'r') as f:
+			section = None
+			for line in f:
+				line = line.strip()
+				if line.startswith("["):
+					section = line
+				elif section == "[checksums]" and "=" in line and not line.startswith("#"):
+					key, value = line.split("=", 1)
+					checksums[key.strip()] = value.strip().lower()
+	except FileNotFoundError:
+		logging.info(f"Error: The file '{url_config}' was not found.")
+	return checksums
+
+
 def parse_url_config(ver_config, wrf_version, wps_version, compat_map):
 	"""
 	解析 URL 配置文件，并根据 WRF_VERSION 替换 URL 中的占位符。
@@ -441,17 +3189,27 @@ def parse_url_config(ver_config, wrf_version, wps_version, compat_map):
 	URL_DEP_MAP = {}
 	URL_COMP_MAP = {}
 	URL_WRF_MAP = {}
+	unversioned = []
 	try:
 		with open(ver_config, 'r') as f:
+			section = None
 			for line in f:
+				if line.startswith("["):
+					section = line.strip()
+				if section in ("[mirrors]", "[checksums]"):
+					continue
 				if "=" in line and not line.startswith("#"):
-					key, value = line.split("=")
+					# 地址中可能带有 '='（查询参数）
+					key, value = line.split("=", 1)
 					key = key.strip()
 					value = value.strip()
+					# WRF/WPS 的版本来自命令行，不在 compatibility 中
 					if 'wrf' in key:
 						URL_WRF_MAP[key] = replace_version_placeholder(value, wrf_version)
+						continue
 					if 'wps' in key:
 						URL_WRF_MAP[key] = replace_version_placeholder(value, wps_version)
+						continue
 					# 根据 'intel' 来决定是更新 URL_COMP_MAP 还是 URL_DEP_MAP
 					version_number = compat_map.get(wrf_version, {}).get(key, None)
 					if version_number:
@@ -460,7 +3218,9 @@ def parse_url_config(ver_config, wrf_version, wps_version, compat_map):
 						else:
 							URL_DEP_MAP[key] = replace_version_placeholder(value, version_number)
 					else:
-						logging.info(f"Error: Key '{key}' not found in compatibility map for version {wrf_version}.")
+						unversioned.append(key)
+		if unversioned:
+			logging.info(f"No version configured for {', '.join(unversioned)} in WRF {wrf_version}, skip them.")
 
 
 	except FileNotFoundError:
@@ -521,21 +3281,86 @@ def replace_version_placeholder(value, version_number):
 	return value.replace('%v', version_number)
 # 主函数
 def main():
+	global ARTIFACT_CACHE, BUNDLE_CACHE, BUILD_ENV, CHECKS
+	prefetcher = None
+	profile_dir = None
+	ccache_offset = None
+	history_inputs = None
 	try:
 		parser = argparse.ArgumentParser(description="Install WRF with given options.")
 		parser.add_argument("-p", "--install_dir",  help="Installation directory, must be absolute path")
 		parser.add_argument("-wrf", "--wrf_version", default='3.9', help="WRF version")
 		parser.add_argument("-wps", "--wps_version", default='3.9', help="WPS version")
 		parser.add_argument("-c", "--compiler", default='intel', choices=["intel"], help="Compiler type, only use intel")
-		parser.add_argument("-n", "--mpinum", default=4, help="")
+		parser.add_argument("-n", "--mpinum", default=None, type=int, help="Total parallel make jobs shared by concurrent builds, default from idle cores and free memory")
+		parser.add_argument("--download-workers", default=Common.download_workers, type=int, help="Concurrent prefetch downloads")
+		parser.add_argument("--cache-dir", default=Common.cache_dir, help="Host-wide download cache directory")
+		parser.add_argument("--cache-size", default=Common.cache_max_size / 1024 ** 3, type=float, help="Download cache size limit in GB")
+		parser.add_argument("--no-cache", action="store_true", help="Download directly without the cache")
+		parser.add_argument("--extract-workers", default=Common.extract_workers, type=int, help="Threads writing files when extracting source archives")
+		parser.add_argument("--bundle-dir", default=Common.bundle_dir, help="Binary build cache directory, may be on a shared filesystem")
+		parser.add_argument("--no-bundle", action="store_true", help="Always compile dependencies from source")
+		parser.add_argument("--bundle-export", metavar="DIR", help="Copy all cached binary bundles to DIR and exit")
+		parser.add_argument("--bundle-import", metavar="DIR", help="Import binary bundles from DIR and exit")
+		parser.add_argument("--store-dir", default=Common.store_dir, help="Host-wide store holding one prefix per dependency build")
+		parser.add_argument("--view-mode", default=Common.view_mode, choices=["symlink", "hardlink"], help="How deps/ links to the store")
+		parser.add_argument("--ccache", action="store_true", help="Cache compiler output of icc/icpc/ifort across builds")
+		parser.add_argument("--ccache-dir", default=Common.ccache_dir, help="Compiler cache directory")
+		parser.add_argument("--ccache-size", default=Common.ccache_max_size / 1024 ** 3, type=float, help="Compiler cache size limit in GB")
+		parser.add_argument("--variant", nargs='+', default=[Common.wrf_default_variant], choices=list(Common.wrf_variants),
+							help="WRF parallel modes to build side by side, WPS is built against the first one")
+		parser.add_argument("--isa", default='auto', choices=['auto', 'none'] + list(Common.isa_flags),
+							help="Target instruction set for WRF, auto detects it from /proc/cpuinfo")
+		parser.add_argument("--ipo", action="store_true", help="Build WRF with interprocedural optimization (-ipo)")
+		parser.add_argument("--benchmark", action="store_true", help="Run WRF idealized cases on every variant after the install")
+		parser.add_argument("--bench-cases", nargs='+', default=Common.bench_cases, help="Idealized cases to benchmark")
+		parser.add_argument("--bench-ranks", default=None, help="Comma separated MPI rank counts, default powers of two up to the core count")
+		parser.add_argument("--bench-threads", default=None, help="Comma separated OpenMP thread counts, default powers of two up to the core count")
+		parser.add_argument("--finalize", action="store_true", help="Copy the runtime libraries of WRF/WPS into lib/ and link the executables to it with RPATH")
+		parser.add_argument("--strip", action="store_true", help="With --finalize, strip debug sections from executables and libraries")
+		parser.add_argument("--check", default=Common.check_policy, choices=CheckRunner.POLICIES,
+							help="How to run dependency test suites: serial/parallel before install, deferred to the background after install, or skip")
+		parser.add_argument("--check-failure", default=Common.check_failure, choices=CheckRunner.ON_FAILURE,
+							help="On a failed dependency test suite, only report it (warn) or abort the install (fail)")
+		parser.add_argument("--matrix", nargs='+', metavar="WRF[:WPS[:MODE[,MODE]]]",
+							help="Build several WRF/WPS versions and variants in one run, sharing the compiler and identical dependency builds")
+		parser.add_argument("--plan", "--dry-run", action="store_true",
+							help="Show the stages that would be rebuilt with estimated times, write the lockfile and exit")
+		parser.add_argument("--lock", metavar="FILE",
+							help="With --plan, write the resolved plan to FILE (default <install_dir>/install_lock.json); otherwise install exactly what FILE records")
+		parser.add_argument("--offline", action="store_true", help="Only use cached downloads, never access the network")
 		# parser.add_argument("-h", "--help", action="help", help="Show this help message and exit")
 
 		args = parser.parse_args()
+		if not args.no_bundle:
+			BUNDLE_CACHE = BundleCache(args.bundle_dir)
+		if args.bundle_export or args.bundle_import:
+			if BUNDLE_CACHE is None:
+				parser.error("--bundle-export/--bundle-import require the binary build cache")
+			if args.bundle_import:
+				BUNDLE_CACHE.import_from(args.bundle_import)
+			if args.bundle_export:
+				BUNDLE_CACHE.export_to(args.bundle_export)
+			return
+		lock = None
+		if args.lock and not args.plan:
+			if args.matrix:
+				parser.error("--lock cannot be combined with --matrix")
+			# 锁定文件中的版本和编译器优先于命令行参数，不再解析配置文件
+			lock = read_lockfile(args.lock)
+			args.wrf_version, args.wps_version, args.compiler = lock['wrf_version'], lock['wps_version'], lock['compiler_type']
+			logging.info(f"Using lockfile {args.lock} created {lock['created']} on {lock['host']}")
 		WRF_VERSION = args.wrf_version
 		WPS_VERSION = args.wps_version
 		INSTALL_DIR = args.install_dir
 		COMPILER_TYPE = args.compiler
-		MPINUM = args.mpinum
+		MPINUM = args.mpinum if args.mpinum else default_jobs()
+		Common.extract_workers = max(1, args.extract_workers)
+		Common.store_dir = args.store_dir
+		Common.view_mode = args.view_mode
+		CHECKS = CheckRunner(args.check, args.check_failure)
+		Common.toolchain_cache_dir = os.path.join(args.cache_dir, 'toolchain')
+		Common.history_file = os.path.join(args.cache_dir, 'history.json')
 		logging.info(f"Installing WRF version: {WRF_VERSION}\n Compiler type: {COMPILER_TYPE}\n Installation directory: {INSTALL_DIR}")
 		# WRF_VERSION = '3.9'
 		# WPS_VERSION = '3.9'
@@ -548,38 +3373,221 @@ def main():
 		os.environ['INTEL_PATH'] = INTEL_PATH
 		os.environ['DEP_DIR'] = DEP_DIR
 		os.environ['INSTALL_PATH'] = INSTALL_DIR
-		os.environ['WRF_V'] = f"WRF-{WRF_VERSION}"
-		os.environ['WPS_V'] = f"WPS-{WPS_VERSION}"
-		# 读取版本配置
-		compat_map, name_map = parse_config_file(VER_CONFIG, WRF_VERSION)
-		URL_COMP_MAP, URL_DEP_MAP ,URL_WRF_MAP = parse_url_config(URL_CONFIG, WRF_VERSION,WPS_VERSION, compat_map)
+		MIRROR_MAP.update(lock['mirrors'] if lock is not None else parse_mirror_config(URL_CONFIG))
+		if args.offline and args.no_cache:
+			parser.error("--offline requires the download cache")
+		if not args.no_cache:
+			ARTIFACT_CACHE = ArtifactCache(args.cache_dir, int(args.cache_size * 1024 ** 3), args.offline)
 
 		# 初始化目录结构
 		os.makedirs(os.path.join(INSTALL_DIR, "src"), exist_ok=True)
 		os.makedirs(os.path.join(INSTALL_DIR, "compiler"), exist_ok=True)
 		os.makedirs(os.path.join(INSTALL_DIR, "deps"), exist_ok=True)
 		os.makedirs(os.path.join(INSTALL_DIR, "logs"), exist_ok=True)
+		os.makedirs(intel_file_path, exist_ok=True)
+
+		if args.matrix:
+			if args.benchmark:
+				parser.error("--benchmark cannot be combined with --matrix, benchmark each target install afterwards")
+			try:
+				targets = parse_matrix_targets(args.matrix, args.variant)
+			except ValueError as e:
+				parser.error(str(e))
+			if not args.plan:
+				profile_dir = os.path.join(INSTALL_DIR, "logs")
+			if args.ccache:
+				ccache_offset = compiler_cache.stats_offset(args.ccache_dir)
+			run_matrix(args, targets, INSTALL_DIR, COMPILER_TYPE, MPINUM)
+			if not args.plan:
+				CHECKS.wait()
+				logging.info(f"\nMatrix installation completed successfully!")
+			return
+
+		variants = lock['variants'] if lock is not None else build_variants(args.variant, args.isa, args.ipo)
+		WRF_DIR = wrf_source_dir(INSTALL_DIR, WRF_VERSION, variants[0])
+		WPS_DIR = os.path.join(INSTALL_DIR, "src", f"WPS-{WPS_VERSION}")
+		os.environ['WRF_V'] = os.path.basename(WRF_DIR)
+		os.environ['WPS_V'] = f"WPS-{WPS_VERSION}"
+		# 读取版本配置
+		if lock is not None:
+			compat_map = {WRF_VERSION: lock['versions']}
+			name_map = lock['names']
+			URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP = lock['urls']['compiler'], lock['urls']['deps'], lock['urls']['wrf']
+			checksums = {key: artifact['sha256'] for key, artifact in lock['artifacts'].items() if artifact['sha256']}
+		else:
+			compat_map, name_map = parse_config_file(VER_CONFIG, WRF_VERSION)
+			URL_COMP_MAP, URL_DEP_MAP ,URL_WRF_MAP = parse_url_config(URL_CONFIG, WRF_VERSION,WPS_VERSION, compat_map)
+			checksums = parse_checksum_config(URL_CONFIG)
+
+		# 已完成且配置未变化的阶段直接跳过
+		journal = StageJournal(os.path.join(INSTALL_DIR, 'install_journal.json'))
+		fingerprints = compute_stage_fingerprints(compat_map[WRF_VERSION], URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP, COMPILER_TYPE, WRF_VERSION, WPS_VERSION, variants)
+		if lock is not None and lock['fingerprints'] != fingerprints:
+			# 脚本的编译参数变化后锁定文件不再对应同样的编译结果
+			changed = [stage for stage in dict(fingerprints, **lock['fingerprints']) if lock['fingerprints'].get(stage) != fingerprints.get(stage)]
+			logging.info(f"Error: Lockfile {args.lock} does not match this installer for {', '.join(changed)}. Re-run with --plan.")
+			sys.exit(1)
+		done_stages = {stage for stage, fingerprint in fingerprints.items() if journal.is_done(stage, fingerprint)}
+		if BUNDLE_CACHE is not None and 'compiler' in done_stages:
+			# 编译器已安装时按它实际报告的版本查找二进制缓存
+			BUNDLE_CACHE.toolchain = compiler_identity(apply_env_delta(os.environ, toolchain_env_delta(COMPILER_TYPE, INSTALL_DIR, WRF_DIR, WPS_DIR)))
+		# 包存储中已有或可以从二进制缓存恢复的依赖不需要下载源码
+		bundled = {dep for dep in dep_list if dep in fingerprints and (
+			store_complete(store_prefix(dep, compat_map[WRF_VERSION][dep], fingerprints[dep]))
+			or (BUNDLE_CACHE is not None and BUNDLE_CACHE.has(dep, compat_map[WRF_VERSION][dep], fingerprints[dep])))}
+		versions = dict(compat_map[WRF_VERSION], wps=WPS_VERSION)
+		versions.update({wrf_stage(variant): WRF_VERSION for variant in variants})
+		plan = plan_rebuild(fingerprints, journal, versions)
+		estimates = estimate_plan(plan, fingerprints, versions, load_history(Common.history_file), bundled)
+		show_plan(plan, fingerprints, estimates)
+		if args.plan:
+			reasons = dict(plan)
+			write_lockfile(args.lock or os.path.join(INSTALL_DIR, Common.lock_file), {
+				'lock_version': LOCK_VERSION,
+				'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+				'host': os.uname().nodename,
+				'wrf_version': WRF_VERSION,
+				'wps_version': WPS_VERSION,
+				'compiler_type': COMPILER_TYPE,
+				'compiler_env': Common.compiler_env,
+				'versions': compat_map[WRF_VERSION],
+				'names': name_map,
+				'urls': {'compiler': URL_COMP_MAP, 'deps': URL_DEP_MAP, 'wrf': URL_WRF_MAP},
+				'artifacts': resolve_artifacts(URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP, compat_map[WRF_VERSION], WRF_VERSION, WPS_VERSION, checksums),
+				'mirrors': dict(MIRROR_MAP),
+				'variants': variants,
+				'configure': {dep: dependency_configure_args(dep, '@PREFIX@', [f"@{up}@" for up in dependency_closure(dep, Common.dep_graph)])
+							  for dep in dep_list if dep in fingerprints},
+				'fingerprints': fingerprints,
+				'stages': [{'stage': stage, 'planned': stage in reasons, 'reason': reasons.get(stage),
+							'estimate': estimates[0].get(stage)} for stage in fingerprints],
+				'estimate': {'critical_path': estimates[1], 'no_history': estimates[2]},
+			})
+			return
+		history_inputs = (journal, fingerprints, versions)
+
+		# 预取所有源码包，下载与编译并行进行
+		downloads = collect_downloads(URL_COMP_MAP, URL_DEP_MAP, URL_WRF_MAP, name_map, compat_map[WRF_VERSION], intel_file_path, INSTALL_DIR, WRF_VERSION, WPS_VERSION, variants, done_stages | bundled)
+		for url, _, key in downloads:
+			if key in checksums:
+				ARTIFACT_CHECKSUMS[url] = checksums[key]
+		prefetcher = prefetch_downloads(downloads, args.download_workers)
+		profile_dir = os.path.join(INSTALL_DIR, "logs")
 
 		# 安装过程
 		logging.info(f"Start installing WRF v{WRF_VERSION} ({COMPILER_TYPE} compiler)")
 		logging.info(f"Installation directory: {INSTALL_DIR}")
 		logging.info(f"The following dependencies will be installed: {compat_map[WRF_VERSION]}")
-		logging.info(f"Start install compiler.")
-		install_compiler(URL_COMP_MAP, intel_file_path, INTEL_PATH,name_map, COMPILER_TYPE, INSTALL_DIR)
+		if 'compiler' in done_stages:
+			logging.info(f"Compiler is up to date, skip.")
+			set_compiler_env(COMPILER_TYPE)
+		else:
+			logging.info(f"Start install compiler.")
+			with PROFILER.stage('compiler', 'phase'):
+				install_compiler(URL_COMP_MAP, intel_file_path, INTEL_PATH,name_map, COMPILER_TYPE, INSTALL_DIR)
+			if os.path.exists(os.path.join(INTEL_PATH, 'setvars.sh')):
+				journal.record('compiler', fingerprints['compiler'], type=COMPILER_TYPE)
+		# 工具链环境只解析一次，之后的编译步骤都直接使用
+		env_delta = toolchain_env_delta(COMPILER_TYPE, INSTALL_DIR, WRF_DIR, WPS_DIR)
+		BUILD_ENV = apply_env_delta(os.environ, env_delta)
+		generate_env(env_delta, INSTALL_DIR)
+		if BUNDLE_CACHE is not None:
+			BUNDLE_CACHE.toolchain = compiler_identity(BUILD_ENV)
+		if args.ccache:
+			enable_compiler_cache(INSTALL_DIR, args.ccache_dir)
+			ccache_offset = compiler_cache.stats_offset(args.ccache_dir)
 		logging.info(f"Start install dependencies.")
-		install_dependencies(URL_DEP_MAP, MPINUM, DEP_DIR, INTEL_PATH,compat_map[WRF_VERSION], INSTALL_DIR)
-		logging.info(f"Start install WRF v{WRF_VERSION} ({COMPILER_TYPE} compiler).")
-		compile_wrf(INSTALL_DIR, WRF_VERSION, COMPILER_TYPE, URL_WRF_MAP)
-		logging.info(f"Start install WPS v{WPS_VERSION} ({COMPILER_TYPE} compiler).")
-		compile_wps(INSTALL_DIR, WPS_VERSION, COMPILER_TYPE, URL_WRF_MAP)
-
-		# generate_env(WRF_VERSION,INSTALL_DIR, COMPILER_TYPE)
+		with PROFILER.stage('dependencies', 'phase'):
+			install_dependencies(URL_DEP_MAP, MPINUM, DEP_DIR, INTEL_PATH,compat_map[WRF_VERSION], INSTALL_DIR, journal, fingerprints)
+		# WRF 各变体在后台线程依次编译，WPS 在主变体的 I/O 库生成后与 WRF 的其余部分同时编译
+		wrf_finished = threading.Event()
+		pending_variants = []
+		for variant in variants:
+			if wrf_stage(variant) in done_stages:
+				logging.info(f"WRF v{WRF_VERSION} {variant['tag']} is up to date, skip.")
+			else:
+				pending_variants.append(variant)
+		# WRF 和 WPS 共用一个按内存调整的任务预算，WPS 编译期间占用其中的 Common.wps_jobs 个
+		wrf_budget = JobPool(MPINUM)
+		with ThreadPoolExecutor(max_workers=1, thread_name_prefix="wrf") as wrf_executor, \
+				MemoryGovernor(wrf_budget, Common.wrf_job_memory_mb, MPINUM):
+			wrf_future = None
+			wps_jobs = 0
+			if 'wps' not in done_stages and wrf_budget.total > Common.wps_jobs:
+				wps_jobs = wrf_budget.acquire(Common.wps_jobs)
+			if pending_variants:
+				def build_wrf():
+					try:
+						for variant in pending_variants:
+							stage = wrf_stage(variant)
+							logging.info(f"Start install WRF v{WRF_VERSION} {variant['tag']} ({COMPILER_TYPE} compiler).")
+							try:
+								with PROFILER.stage(stage, 'phase'):
+									compile_wrf(INSTALL_DIR, WRF_VERSION, COMPILER_TYPE, URL_WRF_MAP, variant, clean=stage in journal.stages, budget=wrf_budget)
+							finally:
+								if variant is variants[0]:
+									wrf_finished.set()
+							journal.record(stage, fingerprints[stage], version=WRF_VERSION, variant=variant['tag'], path=wrf_source_dir(INSTALL_DIR, WRF_VERSION, variant))
+					finally:
+						wrf_finished.set()
+				wrf_started = time.time()
+				wrf_future = wrf_executor.submit(build_wrf)
+			wps_built = None
+			if 'wps' in done_stages:
+				logging.info(f"WPS v{WPS_VERSION} is up to date, skip.")
+			else:
+				logging.info(f"Start install WPS v{WPS_VERSION} ({COMPILER_TYPE} compiler).")
+				# 主变体正在编译时等待它的 I/O 库
+				wait_for_wrf = (lambda: wait_for_wrf_io(WRF_DIR, wrf_finished, wrf_started)) if variants[0] in pending_variants else None
+				try:
+					with PROFILER.stage('wps', 'phase'):
+						wps_built = compile_wps(INSTALL_DIR, WPS_VERSION, COMPILER_TYPE, URL_WRF_MAP, variants[0], clean='wps' in journal.stages, wait_for_wrf=wait_for_wrf)
+				finally:
+					if wps_jobs:
+						wrf_budget.release(wps_jobs)
+			# WRF 编译失败时在这里抛出异常
+			if wrf_future is not None:
+				wrf_future.result()
+			if wps_built is False:
+				logging.info("Error: WPS was not compiled.")
+				sys.exit(1)
+			if wps_built:
+				journal.record('wps', fingerprints['wps'], version=WPS_VERSION)
+		for variant in variants:
+			logging.info(f"WRF {variant['tag']}: {os.path.join(wrf_source_dir(INSTALL_DIR, WRF_VERSION, variant), 'main', 'wrf.exe')}")
+		if args.finalize:
+			executables = [os.path.join(wrf_source_dir(INSTALL_DIR, WRF_VERSION, variant), "main", exe)
+						   for variant in variants for exe in ["wrf.exe", "real.exe", "tc.exe", "ndown.exe"]]
+			executables += [os.path.join(WPS_DIR, exe) for exe in ["geogrid.exe", "ungrib.exe", "metgrid.exe"]]
+			with PROFILER.stage('finalize', 'phase'):
+				finalize_install(INSTALL_DIR, executables, strip=args.strip)
+		if args.benchmark:
+			cpus = os.cpu_count() or 1
+			default_counts = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+			bench_ranks = [int(n) for n in args.bench_ranks.split(',')] if args.bench_ranks else default_counts
+			bench_threads = [int(n) for n in args.bench_threads.split(',')] if args.bench_threads else default_counts
+			for variant in variants:
+				with PROFILER.stage(f"benchmark {variant['tag']}", 'phase'):
+					run_wrf_benchmark(INSTALL_DIR, WRF_VERSION, variant, args.bench_cases, bench_ranks, bench_threads, MPINUM)
+		CHECKS.wait()
 
 		logging.info(f"\nInstallation completed successfully! Activate environment with:")
 		logging.info(f"source {os.path.join(INSTALL_DIR, 'env_set.sh')}")
 	except Exception as e:
 		logging.info(f"Error: An unexpected error occurred - {e}")
+		if prefetcher is not None:
+			prefetcher.shutdown(wait=False, cancel_futures=True)
+		CHECKS.shutdown()
 		raise e
+	finally:
+		# 失败时同样写出已完成阶段的耗时，便于定位
+		if profile_dir is not None:
+			CHECKS.report(profile_dir)
+			PROFILER.write(profile_dir)
+		if history_inputs is not None:
+			record_history(Common.history_file, PROFILER.stage_times(('phase', 'dependency')), *history_inputs)
+		if ccache_offset is not None:
+			report_compiler_cache(args.ccache_dir, ccache_offset, int(args.ccache_size * 1024 ** 3))
 
 if __name__ == "__main__":
 	main()